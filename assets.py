@@ -0,0 +1,154 @@
+"""
+Lazily loaded assets for the pyglet frontends.
+
+Nothing is read from disk when this module is imported. An AssetCache decodes
+an image the first time it is asked for and hands back the same object after
+that, so every board and window in a process shares one copy.
+
+The block graphics come from a single BlockAtlas: one texture holding the
+plain block, drawn for locked cells, and a tinted variant of it for each kind
+of shape, drawn for the active shape and its ghost. Every block sprite of a
+board then draws from the same texture, and a batch of them is drawn without
+switching textures. The atlas is built once per cache, and pyglet shares
+textures between the windows of a process, so further boards and windows
+reuse it as it is.
+
+Run it directly to time loading the assets, cold and from the cache:
+
+    python assets.py
+"""
+import os
+import sys
+import time
+
+import pyglet
+
+__module_name__ = 'assets'
+__module_description__ = 'lazily loaded assets for the tetris clone'
+__version__ = (0, 1, 0)
+
+#found next to the code, whatever the working directory is
+ASSET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'img')
+BLOCK_IMG_FILE = 'block.png'
+
+#the colour each kind of shape is tinted, in the order of engine.Shape._shapes
+SHAPE_COLOURS = (
+    (0, 240, 240),                                                              #I, cyan
+    (240, 240, 0),                                                              #O, yellow
+    (160, 0, 240),                                                              #T, purple
+    (0, 0, 240),                                                                #J, blue
+    (240, 0, 0),                                                                #Z, red
+    (0, 240, 0),                                                                #S, green
+)
+
+
+def tint(pixels, colour):
+    """
+    Returns RGBA pixels with each colour channel scaled by the matching channel of colour, out of 255.
+    """
+    pixels = bytearray(pixels)
+    for channel, value in enumerate(colour):
+        table = bytes(level * value // 255 for level in range(256))
+        pixels[channel::4] = pixels[channel::4].translate(table)
+    return bytes(pixels)
+
+
+class BlockAtlas(object):
+    """
+    One texture holding the block image and a tinted variant of it for each shape colour.
+    """
+    border = 1                                                                  #transparent pixels between the images, so scaled sprites do not sample their neighbours
+
+    def __init__(self, block, colours=SHAPE_COLOURS):
+        """
+        block: the pyglet image of a single block
+        colours: the RGB colour of each variant
+        """
+        self.width, self.height = block.width, block.height
+        pixels = block.get_image_data().get_data('RGBA', block.width * 4)
+        cell_width = block.width + 2 * self.border
+        self.atlas = pyglet.image.atlas.TextureAtlas(cell_width * (len(colours) + 1), block.height + 2 * self.border)
+        self.block = self.atlas.add(pyglet.image.ImageData(block.width, block.height, 'RGBA', pixels), self.border)
+        self.variants = [self.atlas.add(pyglet.image.ImageData(block.width, block.height, 'RGBA', tint(pixels, colour)),
+                                        self.border)
+                         for colour in colours]
+
+    @property
+    def texture(self):
+        return self.atlas.texture
+
+    def variant(self, kind):
+        """
+        Returns the region of the atlas drawn for blocks of the given kind of shape.
+        """
+        return self.variants[kind]
+
+
+class AssetCache(object):
+    """
+    Loads assets the first time they are asked for, and keeps them for every later caller.
+    """
+    def __init__(self, directory=ASSET_DIR):
+        self.directory = directory
+        self.assets = {}
+        self.load_time = 0.0                                                    #seconds spent loading, for the startup report
+
+    def get(self, name, loader):
+        """
+        Returns the asset cached under name, calling loader to create it if it has not been loaded yet.
+        """
+        asset = self.assets.get(name)
+        if asset is None:
+            start = time.perf_counter()
+            asset = self.assets[name] = loader()
+            self.load_time += time.perf_counter() - start
+        return asset
+
+    def image(self, filename):
+        """
+        Returns an image from the asset directory.
+        """
+        return self.get(filename, lambda: pyglet.image.load(os.path.join(self.directory, filename)))
+
+    def block_atlas(self):
+        """
+        Returns the BlockAtlas built from the block image, building it on first use.
+        """
+        return self.get('block_atlas', lambda: BlockAtlas(self.image(BLOCK_IMG_FILE)))
+
+    def clear(self):
+        """
+        Forgets every asset, so the next request loads it again.
+        """
+        self.assets.clear()
+
+
+cache = AssetCache()                                                            #shared by every board and window of the process
+
+
+def block_atlas():
+    """
+    Returns the shared BlockAtlas.
+    """
+    return cache.block_atlas()
+
+
+def main(argv):
+    window = pyglet.window.Window(visible=False)                                #textures need a GL context
+    local = AssetCache()
+    start = time.perf_counter()
+    atlas = local.block_atlas()
+    cold = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(1000):
+        local.block_atlas()
+    cached = (time.perf_counter() - start) / 1000
+    print('block atlas %dx%d with %d variants' % (atlas.texture.width, atlas.texture.height, len(atlas.variants)))
+    print('cold load:   %8.3f ms' % (cold * 1000))
+    print('cached load: %8.3f us' % (cached * 1e6))
+    window.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,373 @@
+"""
+Autoplayer for the headless engine.
+
+Finds every placement the active shape (and optionally the pending shape) can
+reach, scores the boards they leave with a pluggable heuristic, and plays the
+best one by calling the engine.Board move methods directly. The search works on
+rows stored as bitmasks, the same layout engine.BitBoard uses, carries an
+engine.ColumnIndex along with them so that landing rows and column heights
+never need a scan of the board, and remembers scored positions in a bounded
+LRU cache.
+
+Run it directly for a soak test that plays a bot through engine.Game:
+
+    python autoplay.py [number of pieces] [search depth]
+"""
+import collections
+import concurrent.futures
+import sys
+import time
+
+import engine
+
+__module_name__ = 'autoplay'
+__module_description__ = 'a tetris bot for the headless engine'
+__version__ = (0, 1, 0)
+
+#a reachable placement of a shape: how to get there from the shape's current state, and the board it leaves behind
+Placement = collections.namedtuple('Placement', [
+    'rotations',                                                                #number of rotate_shape calls, made before shifting
+    'x',                                                                        #column to shift the shape to after rotating
+    'y',                                                                        #row the shape lands on
+    'orientation',
+    'rows',                                                                     #the board rows after the shape locks and lines are cleared
+    'columns',                                                                  #the engine.ColumnIndex of those rows
+    'lines',                                                                    #number of lines the placement clears
+])
+
+LOST = float('-inf')                                                            #value of a position that ends the game
+
+
+def board_rows(board):
+    """
+    Returns the rows of an engine board as a tuple of bitmasks, bit x is set when column x is full.
+    """
+    return tuple(board.row_masks())
+
+
+def collides(rows, height, orientation, x, y):
+    """
+    Checks if an orientation placed at x, y overlaps the rows, rows above the top of the board never collide.
+    """
+    for i, mask in enumerate(orientation.masks):
+        if mask and 0 <= y + i < height:
+            if rows[y + i] & (mask << x if x >= 0 else mask >> -x):
+                return True
+    return False
+
+
+def fits(rows, width, height, orientation, x, y):
+    """
+    Checks if an orientation at x, y is within the walls, above the floor and clear of the rows.
+    """
+    if x + orientation.left_edge < 0 or x + orientation.right_edge >= width:
+        return False
+    if y + orientation.bottom_edge >= height:
+        return False
+    return not collides(rows, height, orientation, x, y)
+
+
+def rotate(rows, width, height, kind, rotation, x, y):
+    """
+    Rotates a shape the way engine.Board.rotate_shape does, returns the new rotation and x, or None if it cannot rotate.
+    """
+    rotation = (rotation + 1) % 4
+    orientation = engine.ORIENTATIONS[kind][rotation]
+    if orientation.left_edge + x < 0:
+        x = -orientation.left_edge
+    elif orientation.right_edge + x >= width:
+        x = width - orientation.right_edge - 1
+    if y + orientation.bottom_edge >= height or collides(rows, height, orientation, x, y):
+        return None
+    return rotation, x
+
+
+def lock(rows, columns, width, height, orientation, x, y):
+    """
+    Places an orientation at x, y and clears full rows, returning the new rows, their engine.ColumnIndex and the
+    number of lines cleared. columns is the index of rows, which is copied rather than changed.
+    Returns None for the rows and index if part of the shape would lock above the top of the board, which loses the game.
+    """
+    if y < 0 and any(orientation.masks[:-y]):
+        return None, None, 0
+    full_mask = (1 << width) - 1
+    rows = list(rows)
+    for i, mask in enumerate(orientation.masks):
+        if mask:
+            rows[y + i] |= mask << x if x >= 0 else mask >> -x
+    columns = columns.copy()
+    columns.add_shape(orientation, x, y)
+    full = [i for i in range(max(y, 0), y + orientation.bottom_edge + 1) if rows[i] == full_mask]
+    if full:
+        rows = [0] * len(full) + [row for i, row in enumerate(rows) if i not in full]
+        columns.clear_rows(len(full), lambda cx, cy: rows[cy] >> cx & 1)
+    return tuple(rows), columns, len(full)
+
+
+def placements(rows, columns, width, height, kind, rotation, x, y):
+    """
+    Returns every Placement a shape can reach by rotating where it is, then shifting sideways, then dropping.
+    columns is the engine.ColumnIndex of rows, which gives the landing row of each drop without stepping down.
+    Orientations that look the same, such as the rotations of the square, are only tried once.
+    """
+    found = []
+    seen = set()
+    state = (rotation, x)
+    for rotations in range(4):
+        if rotations:
+            state = rotate(rows, width, height, kind, state[0], state[1], y)
+            if state is None:                                                   #engine.Board leaves the shape as it is, so later rotations fail too
+                break
+        orientation = engine.ORIENTATIONS[kind][state[0]]
+        if orientation.shape in seen:
+            continue
+        seen.add(orientation.shape)
+
+        columns_reached = [state[1]]
+        for step in (-1, 1):
+            column = state[1] + step
+            while fits(rows, width, height, orientation, column, y):
+                columns_reached.append(column)
+                column += step
+
+        for column in columns_reached:
+            landing = columns.landing_y(orientation, column, y)
+            if landing is None:                                                 #under an overhang, so step down instead
+                landing = y
+                while fits(rows, width, height, orientation, column, landing + 1):
+                    landing += 1
+            new_rows, new_columns, lines = lock(rows, columns, width, height, orientation, column, landing)
+            found.append(Placement(rotations, column, landing, orientation, new_rows, new_columns, lines))
+    return found
+
+
+def spawn_state(width, kind, rotation):
+    """
+    Returns the rotation, x and y a shape spawns at, as in engine.Board.add_shape.
+    """
+    return rotation, width // 2 - engine.ORIENTATIONS[kind][rotation].left_edge, -1
+
+
+def bumpiness(heights):
+    """
+    Returns the sum of the height differences between neighbouring columns.
+    """
+    return sum(abs(a - b) for a, b in zip(heights, heights[1:]))
+
+
+class WeightedHeuristic(object):
+    """
+    Scores a board as a weighted sum of its aggregate height, holes and bumpiness, with a bonus per line cleared.
+    Any object with a line_weight and a (rows, columns, width, height) call can be used as a heuristic instead,
+    columns being the engine.ColumnIndex of the rows.
+    """
+    def __init__(self, height=-0.510066, lines=0.760666, holes=-0.35663, bumpiness=-0.184483):
+        self.height_weight = height
+        self.line_weight = lines
+        self.hole_weight = holes
+        self.bumpiness_weight = bumpiness
+
+    def __call__(self, rows, columns, width, height):
+        heights = columns.heights
+        return (self.height_weight * sum(heights) +
+                self.hole_weight * sum(columns.holes) +
+                self.bumpiness_weight * bumpiness(heights))
+
+
+class LRUCache(object):
+    """
+    A bounded mapping that forgets the least recently used entry once it holds maxsize entries.
+    """
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.hits = self.misses = 0
+
+    def get(self, key, default=None):
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def evaluate(rows, columns, width, height, pieces, depth, heuristic, cache):
+    """
+    Returns the best value reachable by placing depth more shapes on the rows, columns being their engine.ColumnIndex.
+    pieces holds the (kind, rotation) of the shapes known to come next; past those, every kind is averaged over.
+    """
+    key = (rows, pieces[:depth], depth)
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    if depth == 0:
+        value = heuristic(rows, columns, width, height)
+        cache.put(key, value)
+        return value
+
+    if pieces:
+        kinds = [pieces[0]]
+    else:
+        kinds = [(kind, 0) for kind in range(len(engine.ORIENTATIONS))]
+
+    total = 0.0
+    for kind, rotation in kinds:
+        rotation, x, y = spawn_state(width, kind, rotation)
+        if collides(rows, height, engine.ORIENTATIONS[kind][rotation], x, y):
+            best = LOST                                                         #the shape cannot spawn, so the game is over
+        else:
+            best = max([place_value(placement, width, height, pieces[1:], depth - 1, heuristic, cache)
+                        for placement in placements(rows, columns, width, height, kind, rotation, x, y)] or [LOST])
+        total += best
+    value = total / len(kinds)
+
+    cache.put(key, value)
+    return value
+
+
+def place_value(placement, width, height, pieces, depth, heuristic, cache):
+    """
+    Returns the value of making a placement and then searching depth more shapes.
+    """
+    if placement.rows is None:
+        return LOST
+    return heuristic.line_weight * placement.lines + evaluate(placement.rows, placement.columns, width, height, pieces, depth,
+                                                              heuristic, cache)
+
+
+_worker_cache = None                                                            #the cache of a process pool worker, kept between tasks
+
+
+def _evaluate_in_worker(args):
+    global _worker_cache
+    placement, width, height, pieces, depth, heuristic, cache_size = args
+    if _worker_cache is None:
+        _worker_cache = LRUCache(cache_size)
+    return place_value(placement, width, height, pieces, depth, heuristic, _worker_cache)
+
+
+class AutoPlayer(object):
+    """
+    Plays an engine board by choosing the best placement for the active shape and making it with the board's move methods.
+    depth: number of shapes to search, 1 places only the active shape
+    use_pending: search the known pending shape as the second shape, instead of averaging over every kind
+    processes: spread the top level of searches deeper than one shape across this many processes
+    """
+    def __init__(self, board, heuristic=None, depth=1, use_pending=True, cache_size=100000, processes=0):
+        self.board = board
+        self.heuristic = heuristic or WeightedHeuristic()
+        self.depth = depth
+        self.use_pending = use_pending
+        self.cache_size = cache_size
+        self.cache = LRUCache(cache_size)
+        self.pool = None
+        if processes and depth > 1:
+            self.pool = concurrent.futures.ProcessPoolExecutor(processes)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def choose(self):
+        """
+        Returns the best Placement for the active shape, or None if it has nowhere to go.
+        """
+        board = self.board
+        shape = board.active_shape
+        rows = board_rows(board)
+        pieces = ()
+        if self.use_pending and self.depth > 1:
+            pieces = ((board.pending_shape.kind, board.pending_shape.rotation),)
+
+        options = placements(rows, board.columns, board.width, board.height, shape.kind, shape.rotation, shape.x, shape.y)
+        if not options:
+            return None
+
+        depth = self.depth - 1
+        if self.pool is not None:
+            values = list(self.pool.map(_evaluate_in_worker, [
+                (placement, board.width, board.height, pieces, depth, self.heuristic, self.cache_size)
+                for placement in options
+            ]))
+        else:
+            values = [place_value(placement, board.width, board.height, pieces, depth, self.heuristic, self.cache)
+                      for placement in options]
+        return options[max(range(len(options)), key=values.__getitem__)]
+
+    def apply(self, placement, drop=True):
+        """
+        Moves the active shape to a placement using the board's own move methods, then drops it if drop is set.
+        """
+        board = self.board
+        for i in range(placement.rotations):
+            board.rotate_shape()
+        while board.active_shape.x > placement.x and board.move_left():
+            pass
+        while board.active_shape.x < placement.x and board.move_right():
+            pass
+        if drop:
+            board.hard_drop()
+
+    def play(self, drop=True):
+        """
+        Chooses and makes a placement for the active shape, returning it.
+        """
+        placement = self.choose()
+        if placement is not None:
+            self.apply(placement, drop)
+        return placement
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def main(argv):
+    pieces = int(argv[1]) if len(argv) > 1 else 500
+    depth = int(argv[2]) if len(argv) > 2 else 1
+
+    board = engine.Board()
+    game = engine.Game(board)
+    player = AutoPlayer(board, depth=depth)
+    totals = collections.Counter()
+    def on_lines(num_lines, rows=()):
+        totals['lines'] += num_lines
+    def on_game_over():
+        totals['games over'] += 1
+    board.push_handlers(on_lines=on_lines, on_game_over=on_game_over)
+
+    timings = []
+    for piece in range(pieces):
+        spawned = board.pieces
+        start = time.perf_counter()
+        player.play(drop=False)
+        timings.append(time.perf_counter() - start)
+        while board.pieces == spawned:                                          #let the game's gravity bring the shape down, until the next one spawns
+            game.cycle(game.gravity.interval)
+
+    tick = engine.gravity_interval(game.starting_level)
+    print('%d pieces, %d lines, %d games over' % (pieces, totals['lines'], totals['games over']))
+    print('decision time p50 %.2fms p99 %.2fms max %.2fms (gravity tick %.0fms)' % (
+        percentile(timings, .5) * 1000, percentile(timings, .99) * 1000, max(timings) * 1000, tick * 1000))
+    print('cache %d entries, %d hits, %d misses' % (len(player.cache), player.cache.hits, player.cache.misses))
+    player.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
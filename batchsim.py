@@ -0,0 +1,265 @@
+"""
+Vectorized batch simulator.
+
+Advances many boards in lockstep, holding all of them in one NumPy array of
+shape (N, height, width). Moves, collisions, locking and line clears are done
+for every board at once, with the same rules and piece set as engine.Board,
+so a board here plays out exactly like an engine.Board with the same seed.
+
+Run it directly to benchmark it against engine.Board:
+
+    python batchsim.py [number of boards] [number of steps]
+"""
+import random
+import sys
+import time
+
+import numpy as np
+
+import engine
+
+__module_name__ = 'batchsim'
+__module_description__ = 'a vectorized simulator for many tetris boards at once'
+__version__ = (0, 1, 0)
+
+#actions that can be applied to each board on a step, these match engine.Board.move_piece
+ACTION_NONE = 0
+ACTION_LEFT = 1
+ACTION_RIGHT = 2
+ACTION_ROTATE = 3
+ACTION_DOWN = 4
+
+ACTION_MOTIONS = {
+    ACTION_LEFT: engine.MOTION_LEFT,
+    ACTION_RIGHT: engine.MOTION_RIGHT,
+    ACTION_ROTATE: engine.MOTION_UP,
+    ACTION_DOWN: engine.MOTION_DOWN,
+}
+
+#the cells and edges of every orientation in engine.ORIENTATIONS, indexed by [kind, rotation]
+CELLS = np.array([[o.cells for o in rotations] for rotations in engine.ORIENTATIONS], dtype=np.int64)
+LEFT_EDGE = np.array([[o.left_edge for o in rotations] for rotations in engine.ORIENTATIONS], dtype=np.int64)
+RIGHT_EDGE = np.array([[o.right_edge for o in rotations] for rotations in engine.ORIENTATIONS], dtype=np.int64)
+BOTTOM_EDGE = np.array([[o.bottom_edge for o in rotations] for rotations in engine.ORIENTATIONS], dtype=np.int64)
+
+
+class BatchSimulator(object):
+    """
+    Simulates N boards at once. Each board draws its shapes from its own random.Random(seed) in the same way
+    engine.Board does, so an engine.Board created with the same seed replays it.
+    """
+    queue_length = 64                                                           #shapes drawn ahead for each board at a time
+
+    def __init__(self, seeds, width=engine.BOARD_WIDTH, height=engine.BOARD_HEIGHT):
+        """
+        seeds: one seed per board
+        """
+        self.seeds = list(seeds)
+        self.size = len(self.seeds)
+        self.width, self.height = width, height
+        self.rngs = [random.Random(seed) for seed in self.seeds]
+
+        self.boards = np.zeros((self.size, height, width), dtype=np.uint8)
+        self.kind = np.zeros(self.size, dtype=np.int64)                         #the active shape of each board
+        self.rotation = np.zeros(self.size, dtype=np.int64)
+        self.x = np.zeros(self.size, dtype=np.int64)
+        self.y = np.zeros(self.size, dtype=np.int64)
+        self.pending_kind = np.zeros(self.size, dtype=np.int64)                 #the shape each board spawns next
+        self.pending_rotation = np.zeros(self.size, dtype=np.int64)
+
+        self.lines = np.zeros(self.size, dtype=np.int64)                        #lines cleared, pieces locked and games lost by each board
+        self.pieces = np.zeros(self.size, dtype=np.int64)
+        self.games_over = np.zeros(self.size, dtype=np.int64)
+
+        self.queue_kind = np.zeros((self.size, self.queue_length), dtype=np.int64)
+        self.queue_rotation = np.zeros((self.size, self.queue_length), dtype=np.int64)
+        self.queue_pos = np.full(self.size, self.queue_length, dtype=np.int64)
+
+        self.reset(np.arange(self.size))
+
+    def draw_shapes(self, idx):
+        """
+        Returns the next kind and rotation from the random generators of the boards in idx.
+        """
+        empty = idx[self.queue_pos[idx] >= self.queue_length]
+        for i in empty:                                                         #refill the queues that have run out, in the order engine.Shape draws
+            rng = self.rngs[i]
+            for j in range(self.queue_length):
+                self.queue_kind[i, j] = rng.choice(range(len(engine.Shape._shapes)))
+                self.queue_rotation[i, j] = rng.choice(range(4))
+            self.queue_pos[i] = 0
+        pos = self.queue_pos[idx]
+        self.queue_pos[idx] += 1
+        return self.queue_kind[idx, pos], self.queue_rotation[idx, pos]
+
+    def reset(self, idx):
+        """
+        Clears the boards in idx and starts new games on them, like engine.Board.reset.
+        """
+        self.boards[idx] = 0
+        self.pending_kind[idx], self.pending_rotation[idx] = self.draw_shapes(idx)
+        self.add_shape(idx)
+
+    def add_shape(self, idx):
+        """
+        Spawns the pending shape on the boards in idx, resetting any board where it does not fit.
+        """
+        self.kind[idx] = self.pending_kind[idx]
+        self.rotation[idx] = self.pending_rotation[idx]
+        self.x[idx] = self.width // 2 - LEFT_EDGE[self.kind[idx], self.rotation[idx]]
+        self.y[idx] = -1
+        self.pending_kind[idx], self.pending_rotation[idx] = self.draw_shapes(idx)
+
+        over = idx[self.collides(idx, self.kind[idx], self.rotation[idx], self.x[idx], self.y[idx])]
+        if len(over):
+            self.games_over[over] += 1
+            self.reset(over)
+
+    def cell_positions(self, kind, rotation, x, y):
+        """
+        Returns the board columns and rows of the four blocks of each shape, as two (n, 4) arrays.
+        """
+        cells = CELLS[kind, rotation]
+        return x[:, None] + cells[:, :, 0], y[:, None] + cells[:, :, 1]
+
+    def collides(self, idx, kind, rotation, x, y):
+        """
+        Returns which of the shapes overlap a block on their board in idx, blocks above the top of the board never collide.
+        """
+        bx, by = self.cell_positions(kind, rotation, x, y)
+        visible = by >= 0
+        hits = self.boards[idx[:, None], np.clip(by, 0, self.height - 1), np.clip(bx, 0, self.width - 1)]
+        return ((hits != 0) & visible).any(axis=1)
+
+    def shift(self, idx, dx):
+        """
+        Moves the active shapes of the boards in idx sideways by dx, where the move is possible.
+        """
+        x = self.x[idx] + dx
+        kind, rotation = self.kind[idx], self.rotation[idx]
+        ok = (x + LEFT_EDGE[kind, rotation] >= 0) & (x + RIGHT_EDGE[kind, rotation] < self.width)
+        ok[ok] = ~self.collides(idx[ok], kind[ok], rotation[ok], x[ok], self.y[idx][ok])
+        self.x[idx[ok]] = x[ok]
+
+    def rotate(self, idx):
+        """
+        Rotates the active shapes of the boards in idx, pushing them back inside the walls like engine.Board.rotate_shape.
+        """
+        kind, y = self.kind[idx], self.y[idx]
+        rotation = (self.rotation[idx] + 1) % 4
+        left, right = LEFT_EDGE[kind, rotation], RIGHT_EDGE[kind, rotation]
+        x = self.x[idx]
+        x = np.where(left + x < 0, -left, np.where(right + x >= self.width, self.width - right - 1, x))
+        ok = y + BOTTOM_EDGE[kind, rotation] < self.height
+        ok[ok] = ~self.collides(idx[ok], kind[ok], rotation[ok], x[ok], y[ok])
+        self.rotation[idx[ok]] = rotation[ok]
+        self.x[idx[ok]] = x[ok]
+
+    def move_down(self, idx):
+        """
+        Moves the active shapes of the boards in idx down, locking the ones that cannot move and spawning new shapes.
+        """
+        kind, rotation, x = self.kind[idx], self.rotation[idx], self.x[idx]
+        y = self.y[idx] + 1
+        ok = y + BOTTOM_EDGE[kind, rotation] < self.height
+        ok[ok] = ~self.collides(idx[ok], kind[ok], rotation[ok], x[ok], y[ok])
+        self.y[idx[ok]] = y[ok]
+
+        locked = idx[~ok]
+        if len(locked):
+            self.lock(locked)
+            self.add_shape(locked)
+
+    def lock(self, idx):
+        """
+        Places the active shapes of the boards in idx and clears the lines they completed.
+        """
+        bx, by = self.cell_positions(self.kind[idx], self.rotation[idx], self.x[idx], self.y[idx])
+        visible = by >= 0                                                       #blocks still above the top of the board are lost
+        rows = np.broadcast_to(idx[:, None], by.shape)
+        self.boards[rows[visible], by[visible], bx[visible]] = engine.BLOCK_FULL
+        self.pieces[idx] += 1
+
+        full = self.boards[idx].all(axis=2)                                     #(n, height) rows with every cell filled
+        counts = full.sum(axis=1)
+        cleared = counts > 0
+        if cleared.any():
+            idx, full, counts = idx[cleared], full[cleared], counts[cleared]
+            order = np.argsort(~full, axis=1, kind='stable')                    #full rows first, then the kept rows in their order
+            boards = np.take_along_axis(self.boards[idx], order[:, :, None], axis=1)
+            boards[np.arange(self.height)[None, :] < counts[:, None]] = engine.BLOCK_EMPTY
+            self.boards[idx] = boards
+            self.lines[idx] += counts
+
+    def step(self, actions):
+        """
+        Applies one action to every board, actions is an array holding one of the ACTION_ values per board.
+        """
+        actions = np.asarray(actions)
+        for action, method, args in (
+            (ACTION_LEFT, self.shift, (-1,)),
+            (ACTION_RIGHT, self.shift, (1,)),
+            (ACTION_ROTATE, self.rotate, ()),
+            (ACTION_DOWN, self.move_down, ()),
+        ):
+            idx = np.flatnonzero(actions == action)
+            if len(idx):
+                method(idx, *args)
+
+
+def run_scalar(seed, actions, width=engine.BOARD_WIDTH, height=engine.BOARD_HEIGHT):
+    """
+    Plays a sequence of ACTION_ values on an engine.Board created with seed, returning the board.
+    """
+    board = engine.Board(width, height, seed)
+    board.lines = board.games_over = 0
+    def on_lines(num_lines, rows=()):
+        board.lines += num_lines
+    def on_game_over():
+        board.games_over += 1
+    board.push_handlers(on_lines=on_lines, on_game_over=on_game_over)
+    for action in actions:
+        if action != ACTION_NONE:
+            board.move_piece(ACTION_MOTIONS[int(action)])
+    return board
+
+
+def random_actions(steps, size, seed=0):
+    """
+    Returns a (steps, size) array of random actions, weighted towards moving down so that games progress.
+    """
+    rng = np.random.RandomState(seed)
+    return rng.choice([ACTION_NONE, ACTION_LEFT, ACTION_RIGHT, ACTION_ROTATE, ACTION_DOWN],
+                      size=(steps, size), p=[.1, .2, .2, .2, .3])
+
+
+def main(argv):
+    size = int(argv[1]) if len(argv) > 1 else 1000
+    steps = int(argv[2]) if len(argv) > 2 else 500
+    actions = random_actions(steps, size)
+
+    sim = BatchSimulator(range(size))
+    start = time.perf_counter()
+    for step in actions:
+        sim.step(step)
+    batch_time = time.perf_counter() - start
+
+    checked = min(size, 20)                                                     #replay a few boards on engine.Board, timing and checking them
+    start = time.perf_counter()
+    scalar = [run_scalar(i, actions[:, i]) for i in range(checked)]
+    scalar_time = time.perf_counter() - start
+
+    for i, board in enumerate(scalar):
+        if (np.array(board.board) != sim.boards[i]).any() or board.lines != sim.lines[i] or \
+           board.games_over != sim.games_over[i] or board.active_shape.x != sim.x[i] or board.active_shape.y != sim.y[i]:
+            print('board %s differs from engine.Board' % i)
+            return 1
+
+    print('batch:  %10.0f board-steps/s (%d boards, %d steps)' % (size * steps / batch_time, size, steps))
+    print('scalar: %10.0f board-steps/s (%d boards, %d steps)' % (checked * steps / scalar_time, checked, steps))
+    print('%d boards match engine.Board' % checked)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
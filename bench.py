@@ -0,0 +1,466 @@
+"""
+Benchmarks for the engine and the renderers.
+
+Each benchmark times one operation, such as a rotation, a collision test, a
+lock or a whole simulated game, and reports the best time per operation over a
+few repeats. Board benchmarks run on empty, half full and near death boards for
+every board backend. The rendering benchmarks draw into an offscreen pyglet
+window and are skipped when no GL context can be created.
+
+    python bench.py run [--output FILE] [--filter TEXT] [--no-gl] [--quick]
+    python bench.py compare BASELINE CURRENT [--threshold FRACTION]
+
+compare exits with status 1 if any benchmark in CURRENT is slower than in
+BASELINE by more than the threshold, 10% by default.
+"""
+import argparse
+import collections
+import gc
+import importlib
+import itertools
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+
+import engine
+import snapshot
+
+__module_name__ = 'bench'
+__module_description__ = 'benchmarks for the tetris engine and renderers'
+__version__ = (0, 1, 0)
+
+#name, group and setup function of every benchmark; setup returns the operation to time,
+#or a (prepare, operation) pair where prepare builds fresh state for each call outside of the timing
+Benchmark = collections.namedtuple('Benchmark', 'name group setup')
+BENCHMARKS = []
+
+FILLS = ('empty', 'half', 'near_death')
+BACKENDS = tuple(sorted(engine.BOARD_BACKENDS))
+STAR_COUNTS = (100, 1000, 5000)
+ARRAY_STAR_COUNTS = STAR_COUNTS + (100000,)                                      #the numpy starfield is meant for far larger fields
+TALL_SIZES = ((14, 20), (14, 200), (14, 2000), (1000, 2000))                    #a lock should cost the same however tall the board is, only its width counts
+
+Size = collections.namedtuple('Size', 'width height')                           #stands in for a window where only its size is used
+
+
+def benchmark(name, group='engine'):
+    """
+    Registers the decorated setup function as a benchmark.
+    """
+    def register(setup):
+        BENCHMARKS.append(Benchmark(name, group, setup))
+        return setup
+    return register
+
+
+def make_shape(kind, rotation, x=0, y=0):
+    """
+    Returns a Shape of a given kind and rotation, without touching any random generator the benchmark cares about.
+    """
+    return engine.Shape.of(kind, rotation, x, y)
+
+
+def filled_rows(fill, height):
+    """
+    Returns the number of rows filled from the bottom for a fill level.
+    """
+    return {'empty': 0, 'half': height // 2, 'near_death': height - 4, 'full': height}[fill]
+
+
+def filled_board(backend, fill, seed=0):
+    """
+    Returns a board with its lower rows filled to a fill level, each row keeping a hole so that none of them are full.
+    """
+    board = engine.new_board(backend=backend, seed=seed)
+    rng = random.Random(seed)
+    for y in range(board.height - filled_rows(fill, board.height), board.height):
+        cells = [engine.BLOCK_FULL] * board.width
+        for hole in rng.sample(range(board.width), rng.randint(1, 3)):
+            cells[hole] = engine.BLOCK_EMPTY
+        board.set_row(y, cells)
+    board.columns                                                               #build the column index now, so no timed operation pays for it
+    return board
+
+
+def above_surface(board, shape):
+    """
+    Moves a shape to the middle column, as low as it can go without reaching the filled rows.
+    """
+    filled = next((y for y in range(board.height) if any(board.row(y))), board.height)
+    shape.x = board.width // 2 - shape.left_edge
+    shape.y = max(filled - shape.bottom_edge - 1, -1)
+    return shape
+
+
+@benchmark('shape.rotate')
+def bench_rotate():
+    shape = make_shape(2, 0)
+    return shape.rotate
+
+
+@benchmark('shape.clone')
+def bench_clone():
+    shape = make_shape(2, 0)
+    return shape.clone
+
+
+def register_board_benchmarks():
+    for backend in BACKENDS:
+        for fill in FILLS:
+            def setup_collision(backend=backend, fill=fill):
+                board = filled_board(backend, fill)
+                shape = above_surface(board, make_shape(0, 0))
+                return lambda: board.is_collision(shape)
+
+            def setup_out_of_bounds(backend=backend, fill=fill):
+                board = filled_board(backend, fill)
+                shape = above_surface(board, make_shape(0, 1))
+                return lambda: board.out_of_bounds(shape)
+
+            def setup_lock(backend=backend, fill=fill):
+                def prepare():
+                    board = filled_board(backend, fill)
+                    board.active_shape = above_surface(board, make_shape(1, 0))
+                    return board
+                return prepare, lambda board: board.shape_to_board()
+
+            def setup_process_line(backend=backend, fill=fill):
+                def prepare():
+                    board = filled_board(backend, fill)
+                    board.set_row(board.height - 1, [engine.BLOCK_FULL] * board.width)
+                    board.columns
+                    return board
+                return prepare, lambda board: board.process_line(board.height - 1)
+
+            def setup_hard_drop(backend=backend, fill=fill):
+                def prepare():
+                    board = filled_board(backend, fill)
+                    board.active_shape = make_shape(1, 0, board.width // 2, -1)
+                    return board
+                return prepare, lambda board: board.hard_drop()
+
+            suffix = '[%s,%s]' % (backend, fill)
+            benchmark('board.is_collision' + suffix)(setup_collision)
+            benchmark('board.out_of_bounds' + suffix)(setup_out_of_bounds)
+            benchmark('board.shape_to_board' + suffix)(setup_lock)
+            benchmark('board.process_line' + suffix)(setup_process_line)
+            benchmark('board.hard_drop' + suffix)(setup_hard_drop)
+
+        def setup_tetris(backend=backend):
+            def prepare():
+                board = engine.new_board(backend=backend, seed=0)
+                for y in range(board.height - 4, board.height):
+                    board.set_row(y, [engine.BLOCK_EMPTY] + [engine.BLOCK_FULL] * (board.width - 1))
+                board.active_shape = make_shape(0, 0, -1, board.height - 4)     #a vertical line dropped into the gap clears four lines
+                board.columns
+                return board
+            return prepare, lambda board: board.shape_to_board()
+
+        benchmark('board.shape_to_board[%s,tetris]' % backend)(setup_tetris)
+
+        def setup_spawn(backend=backend):
+            board = engine.new_board(backend=backend, seed=0)
+            return board.add_shape
+
+        def setup_rotate(backend=backend):
+            board = engine.new_board(backend=backend, seed=0)
+            board.active_shape.y = board.height // 2                            #clear of the walls and floor, so every rotation succeeds
+            return board.rotate_shape
+
+        benchmark('board.add_shape[%s]' % backend)(setup_spawn)
+        benchmark('board.rotate_shape[%s]' % backend)(setup_rotate)
+
+        def setup_game(backend=backend):
+            seeds = iter(range(sys.maxsize))
+            motions = (engine.MOTION_LEFT, engine.MOTION_RIGHT, engine.MOTION_UP, engine.MOTION_DOWN)
+            def play():
+                board = engine.new_board(backend=backend, seed=next(seeds))
+                game = engine.Game(board)
+                rng = random.Random(board.seed)
+                over = []
+                board.push_handlers(on_game_over=lambda: over.append(True))
+                while not over:
+                    game.keyboard_handler(rng.choice(motions))
+                    game.cycle(game.gravity.interval)
+            return play
+
+        benchmark('game.random_play[%s]' % backend)(setup_game)
+
+        def setup_input(backend=backend):
+            game = engine.Game(engine.new_board(backend=backend, seed=0))
+            game.gravity.interval = float('inf')                                #only the queued inputs move the shape
+            motions = itertools.cycle((engine.MOTION_LEFT, engine.MOTION_RIGHT))
+            def press():
+                game.press(next(motions))
+                game.cycle(0.0)
+            return press
+
+        benchmark('game.press_to_applied[%s]' % backend)(setup_input)
+
+        def setup_capture(backend=backend):
+            board = filled_board(backend, 'half')
+            return lambda: snapshot.capture(board, rng=False)
+
+        def setup_restore(backend=backend):
+            board = filled_board(backend, 'half')
+            data = snapshot.capture(board, rng=False)
+            return lambda: snapshot.restore(data, board)
+
+        benchmark('snapshot.capture[%s]' % backend)(setup_capture)
+        benchmark('snapshot.restore[%s]' % backend)(setup_restore)
+
+        for width, height in TALL_SIZES:
+            def setup_tall_tetris(backend=backend, width=width, height=height):
+                board = engine.new_board(width, height, backend, seed=0)
+                shape = make_shape(0, 0, -1, height - 4)                        #a vertical line dropped into the hole of the garbage clears it again
+                def clear():
+                    board.add_garbage(4, 0)
+                    board.active_shape = shape
+                    board.shape_to_board()
+                return clear
+
+            benchmark('board.garbage_tetris[%s,%dx%d]' % (backend, width, height))(setup_tall_tetris)
+
+
+register_board_benchmarks()
+
+
+@benchmark('starfield.cycle', group='starfield')
+def bench_starfield_cycle():
+    starfield = import_frontend('starfield')
+    field = starfield.StarField(Size(800, 600))
+    field.num_stars = 1000
+    field.update_stars()
+    return field.cycle
+
+
+@benchmark('starfield.cycle[numpy,100000]', group='starfield')
+def bench_array_starfield_cycle():
+    starfield = import_frontend('starfield')
+    field = starfield.ArrayStarField(Size(800, 600), seed=0)
+    field.num_stars = 100000
+    field.update_stars()
+    return field.cycle
+
+
+_window = None
+
+
+def import_frontend(name):
+    """
+    Imports one of the pyglet frontend modules, making pyglet render offscreen through EGL so no display is needed.
+    """
+    import pyglet
+    pyglet.options['headless'] = True                                           #has to be set before pyglet.window is first imported
+    return importlib.import_module(name)
+
+
+def gl_window():
+    """
+    Returns the offscreen window shared by the rendering benchmarks, creating it on first use.
+    """
+    global _window
+    if _window is None:
+        window_module = import_frontend('pyglet.window')
+        _window = window_module.Window(800, 600, visible=False)
+    _window.switch_to()
+    return _window
+
+
+def finish_frame():
+    import pyglet
+    pyglet.gl.glFinish()                                                        #count the time the GL takes, not just the time to submit the work
+
+
+def register_render_benchmarks():
+    for fill in FILLS + ('full',):
+        def setup_board(fill=fill):
+            window = gl_window()
+            tetris = import_frontend('tetris')
+            board = filled_board('list', 'empty' if fill == 'full' else fill)
+            if fill == 'full':
+                for y in range(board.height):
+                    board.set_row(y, [engine.BLOCK_FULL] * board.width)
+            renderer = tetris.BoardRenderer(board)
+            def draw():
+                window.clear()
+                renderer.draw_game_board()
+                finish_frame()
+            return draw
+        benchmark('render.draw_game_board[%s]' % fill, group='gl')(setup_board)
+
+    def setup_large_board():
+        window = gl_window()
+        tetris = import_frontend('tetris')
+        board = engine.new_board(1000, 2000, 'bitboard', seed=0)
+        for y in range(board.height // 2, board.height):
+            board.set_row(y, [engine.BLOCK_FULL] * (board.width - 1) + [engine.BLOCK_EMPTY])
+        #only the part of the board that fits in the window is drawn
+        renderer = tetris.BoardRenderer(board, width=window.width, height=window.height)
+        def draw():
+            window.clear()
+            renderer.draw_game_board()
+            finish_frame()
+        return draw
+    benchmark('render.draw_game_board[1000x2000]', group='gl')(setup_large_board)
+
+    @benchmark('assets.block_atlas[cold]', group='gl')
+    def bench_block_atlas():
+        gl_window()
+        assets = import_frontend('assets')
+        return lambda: assets.AssetCache().block_atlas()                        #a fresh cache decodes the image and builds the atlas again
+
+    for backend, counts, prefix in (('objects', STAR_COUNTS, ''), ('numpy', ARRAY_STAR_COUNTS, 'numpy,')):
+        for num_stars in counts:
+            for draw_3d in (False, True):
+                def setup_stars(backend=backend, num_stars=num_stars, draw_3d=draw_3d):
+                    field = import_frontend('starfield').STARFIELDS[backend](gl_window())
+                    field.num_stars = num_stars
+                    field.draw_3d = draw_3d
+                    field.update_stars()
+                    def draw():
+                        field.draw_handler()
+                        finish_frame()
+                    return draw
+                benchmark('render.starfield[%s%d,%s]' % (prefix, num_stars, '3d' if draw_3d else '2d'), group='gl')(setup_stars)
+
+
+register_render_benchmarks()
+
+
+def time_operation(operation, prepare, number):
+    """
+    Returns the seconds taken to call operation number times, not counting prepare.
+    The garbage collector is kept off while timing, as timeit does.
+    """
+    states = [prepare() for i in range(number)] if prepare is not None else None
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        if states is None:
+            start = time.perf_counter()
+            for i in range(number):
+                operation()
+        else:
+            start = time.perf_counter()
+            for state in states:
+                operation(state)
+        return time.perf_counter() - start
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def measure(bench, min_time=0.05, repeat=5):
+    """
+    Runs a benchmark, returning its results as a dict of seconds per operation.
+    The number of operations per repeat is doubled until a repeat takes at least min_time.
+    """
+    prepared = bench.setup()
+    prepare, operation = prepared if isinstance(prepared, tuple) else (None, prepared)
+    max_number = 1 << (20 if prepare is None else 12)                          #fresh state for every call is costly to build, so fewer calls are made
+
+    number = 1
+    while True:
+        elapsed = time_operation(operation, prepare, number)
+        if elapsed >= min_time or number >= max_number:
+            break
+        number *= 2
+
+    times = [elapsed / number] + [time_operation(operation, prepare, number) / number for i in range(repeat - 1)]
+    return {
+        'best': min(times),
+        'median': statistics.median(times),
+        'ops_per_second': 1 / min(times),
+        'number': number,
+        'repeat': repeat,
+    }
+
+
+def run(args):
+    results = {}
+    for bench in BENCHMARKS:
+        if args.filter and args.filter not in bench.name:
+            continue
+        if bench.group == 'gl' and args.no_gl:
+            continue
+        try:
+            result = measure(bench, min_time=0.01 if args.quick else 0.05, repeat=3 if args.quick else 5)
+        except Exception as e:
+            if bench.group == 'engine':
+                raise
+            print('skipping %s: %s' % (bench.name, e))                         #pyglet is missing or no GL context could be created here
+            continue
+        results[bench.name] = result
+        print('%-48s %12.3f us %14.0f ops/s' % (bench.name, result['best'] * 1e6, result['ops_per_second']))
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'results': results,
+        }, f, indent=2, sort_keys=True)
+    print('saved %d results to %s' % (len(results), args.output))
+    return 0
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)['results']
+    with open(args.current) as f:
+        current = json.load(f)['results']
+
+    regressions = 0
+    for name in sorted(set(baseline) | set(current)):
+        if name not in current:
+            print('%-48s missing from %s' % (name, args.current))
+            continue
+        if name not in baseline:
+            print('%-48s new' % name)
+            continue
+        ratio = current[name]['best'] / baseline[name]['best']
+        if ratio > 1 + args.threshold:
+            status = 'REGRESSION'
+            regressions += 1
+        elif ratio < 1 - args.threshold:
+            status = 'faster'
+        else:
+            status = ''
+        print('%-48s %12.3f us -> %12.3f us %7.2fx %s' % (
+            name, baseline[name]['best'] * 1e6, current[name]['best'] * 1e6, ratio, status))
+    print('%d regressions' % regressions)
+    return 1 if regressions else 0
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog=argv[0], description=__module_description__)
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    run_parser = commands.add_parser('run', help='run the benchmarks and save the results as JSON')
+    run_parser.add_argument('--output', default='bench.json', help='file to save the results to')
+    run_parser.add_argument('--filter', help='only run benchmarks with this text in their name')
+    run_parser.add_argument('--no-gl', action='store_true', help='skip the rendering benchmarks')
+    run_parser.add_argument('--quick', action='store_true', help='fewer and shorter repeats')
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser('compare', help='compare saved results against a baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help='fraction a benchmark may slow down by before it counts as a regression')
+    compare_parser.set_defaults(func=compare)
+    return parser.parse_args(argv[1:])
+
+
+def main(argv):
+    args = parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,406 @@
+"""
+Training data export.
+
+An Exporter attached to a board writes a fixed width record for every move
+made through Board.move_piece and for every shape locked by gravity: the board
+before the move as bit-packed rows, the active and pending shapes, the action
+taken, the lines it cleared and the score they were worth, and whether it
+locked the shape or ended the game. Records are gathered in a chunk in memory
+and copied a chunk at a time into a memory-mapped file that is allocated ahead
+and grown by doubling, so exporting never holds more than a chunk in memory.
+
+The file starts with a HEADER_SIZE byte header: MAGIC, the length of a JSON
+description of the layout (the board size, the record count, the numpy dtype
+of a record and the action codes), and the JSON itself. The records follow as
+a packed numpy structured array, which Dataset maps straight back into memory
+and hands out in batches that are views of the file rather than copies.
+
+    python dataset.py export FILE [--games N] [--pieces N] [--epsilon E] [--seed S]
+    python dataset.py info FILE
+"""
+import argparse
+import json
+import random
+import struct
+import sys
+import time
+
+import numpy as np
+
+import engine
+import replay
+
+__module_name__ = 'dataset'
+__module_description__ = 'exports tetris games as memory-mapped training data'
+__version__ = (0, 1, 0)
+
+MAGIC = b'TDAT'
+VERSION = 1
+HEADER_SIZE = 4096                                                              #room for the JSON header, and keeps the records page aligned
+HEADER_LENGTH = struct.Struct('<4sI')                                           #magic, length of the JSON that follows
+
+#the action stored in a record, the replay event codes
+ACTIONS = {
+    replay.EVENT_LEFT: 'left',
+    replay.EVENT_RIGHT: 'right',
+    replay.EVENT_ROTATE: 'rotate',
+    replay.EVENT_DOWN: 'down',
+    replay.EVENT_GRAVITY: 'gravity',
+    replay.EVENT_DROP: 'drop',
+}
+
+
+class Layout(object):
+    """
+    The record layout for boards of width by height, both as a numpy dtype for reading and a struct for writing.
+    """
+    def __init__(self, width, height):
+        self.width, self.height = width, height
+        self.row_bytes = (width + 7) // 8
+        self.board_bytes = self.row_bytes * height
+        self.dtype = np.dtype([
+            ('board', 'u1', (self.board_bytes,)),                               #rows before the action, row_bytes each, bit x of a row is column x
+            ('active_kind', 'u1'),
+            ('active_rotation', 'u1'),
+            ('active_x', '<i2'),
+            ('active_y', '<i2'),
+            ('pending_kind', 'u1'),
+            ('pending_rotation', 'u1'),
+            ('action', 'u1'),                                                   #one of ACTIONS
+            ('lines', 'u1'),                                                    #lines the action cleared
+            ('reward', '<f4'),                                                  #the score those lines were worth
+            ('locked', 'u1'),                                                   #1 if the action locked the shape
+            ('done', 'u1'),                                                     #1 if the action ended the game
+            ('game', '<u4'),                                                    #the game the record belongs to, counting from 0
+            ('step', '<u4'),                                                    #the record's place within its game
+        ])
+        self.record = struct.Struct('<%dsBBhhBBBBfBBII' % self.board_bytes)
+        assert self.record.size == self.dtype.itemsize
+
+    def header(self, count, capacity):
+        """
+        Returns the header of a file holding count records with room for capacity, padded to HEADER_SIZE.
+        """
+        description = json.dumps({
+            'version': VERSION,
+            'width': self.width,
+            'height': self.height,
+            'row_bytes': self.row_bytes,
+            'count': count,
+            'capacity': capacity,
+            'record_size': self.dtype.itemsize,
+            'dtype': self.dtype.descr,
+            'actions': dict((str(code), name) for code, name in ACTIONS.items()),
+        }, sort_keys=True).encode()
+        header = HEADER_LENGTH.pack(MAGIC, len(description)) + description
+        if len(header) > HEADER_SIZE:
+            raise ValueError('The layout of a %dx%d board does not fit in the header' % (self.width, self.height))
+        return header.ljust(HEADER_SIZE, b' ')
+
+
+def read_header(path):
+    """
+    Returns the JSON header of a dataset file as a dict.
+    """
+    with open(path, 'rb') as f:
+        data = f.read(HEADER_SIZE)
+    if len(data) < HEADER_LENGTH.size:
+        raise ValueError('%s is too short to be a dataset' % path)
+    magic, length = HEADER_LENGTH.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError('%s is not a dataset' % path)
+    header = json.loads(data[HEADER_LENGTH.size:HEADER_LENGTH.size + length].decode())
+    if header['version'] != VERSION:
+        raise ValueError('Unsupported dataset version %d' % header['version'])
+    return header
+
+
+class Exporter(object):
+    """
+    Writes a record for every move and lock of the boards it is attached to into a memory-mapped file.
+    A record stays open until the next one starts, so the lines, lock and game over that follow a move are added to it.
+    capacity: records to allocate the file for at first, it doubles whenever it fills up
+    chunk_size: records gathered in memory before they are copied into the file
+    """
+    def __init__(self, path, width=engine.BOARD_WIDTH, height=engine.BOARD_HEIGHT, capacity=1 << 16, chunk_size=4096):
+        self.path = path
+        self.layout = Layout(width, height)
+        self.chunk = bytearray(chunk_size * self.layout.record.size)
+        self.chunk_size = chunk_size
+        self.pending = 0                                                        #records in the chunk
+        self.count = 0                                                          #records in the file
+        self.capacity = 0
+        self.records = None
+        self.game = None
+        self.game_index = 0
+        self.step = 0
+        self.current = None                                                     #the fields of the open record
+        self.moving = False                                                     #inside Board.move_piece
+
+        with open(path, 'wb') as f:
+            f.write(self.layout.header(0, 0))
+        self.file = open(path, 'r+b')
+        self.grow(capacity)
+
+    def attach(self, board, game=None):
+        """
+        Starts recording a board, scoring the lines cleared at the level of game if one is given.
+        """
+        if (board.width, board.height) != (self.layout.width, self.layout.height):
+            raise ValueError('Cannot export a %dx%d board to a %dx%d dataset' % (
+                board.width, board.height, self.layout.width, self.layout.height))
+        board.exporter = self
+        board.push_handlers(on_lines=self.on_lines, on_game_over=self.on_game_over)    #ahead of the game's, at the level the lines scored
+        self.game = game
+
+    def detach(self, board):
+        self.commit()
+        board.exporter = None
+        board.remove_handlers(on_lines=self.on_lines, on_game_over=self.on_game_over)
+
+    def begin(self, board, action):
+        """
+        Opens a record of the board as it is before an action.
+        """
+        self.commit()
+        active, pending = board.active_shape, board.pending_shape
+        self.current = [board.packed_rows(), active.kind, active.rotation, active.x, active.y,
+                        pending.kind, pending.rotation, action, 0, 0.0, 0, 0, self.game_index, self.step]
+        self.step += 1
+
+    def on_move(self, board, motion):
+        action = replay.MOTION_EVENTS.get(motion)
+        if action is None:
+            return                                                              #a key the board ignores is not an action
+        self.begin(board, action)
+        self.moving = True
+
+    def on_moved(self, board):
+        self.moving = False
+
+    def on_lock(self, board):
+        if not self.moving:                                                     #locked by gravity rather than by a move
+            self.begin(board, replay.EVENT_GRAVITY)
+        self.current[10] = 1
+
+    def on_lines(self, num_lines, rows=()):
+        if self.current is not None:
+            self.current[8] += num_lines
+            self.current[9] += num_lines * (self.game.level if self.game is not None else 1)
+
+    def on_game_over(self):
+        if self.current is not None:
+            self.current[11] = 1
+        self.next_game()
+
+    def next_game(self):
+        """
+        Counts the records that follow as a new game, for when a game is ended without a game over.
+        """
+        self.commit()
+        self.game_index += 1
+        self.step = 0
+
+    def commit(self):
+        """
+        Closes the open record, writing it into the chunk.
+        """
+        if self.current is None:
+            return
+        self.layout.record.pack_into(self.chunk, self.pending * self.layout.record.size, *self.current)
+        self.current = None
+        self.pending += 1
+        if self.pending == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Copies the chunk into the file and updates the record count in the header.
+        """
+        if not self.pending:
+            return
+        if self.count + self.pending > self.capacity:
+            self.grow(max(self.capacity * 2, self.count + self.pending))
+        chunk = np.frombuffer(self.chunk, self.layout.dtype, self.pending)
+        self.records[self.count:self.count + self.pending] = chunk
+        self.count += self.pending
+        self.pending = 0
+        self.write_header()
+
+    def grow(self, capacity):
+        """
+        Extends the file to hold capacity records and maps it again.
+        """
+        if self.records is not None:
+            self.records.flush()
+            self.records = None
+        self.file.truncate(HEADER_SIZE + capacity * self.layout.dtype.itemsize)
+        self.capacity = capacity
+        self.records = np.memmap(self.path, self.layout.dtype, 'r+', HEADER_SIZE, (capacity,))
+        self.write_header()
+
+    def write_header(self):
+        self.file.seek(0)
+        self.file.write(self.layout.header(self.count, self.capacity))
+        self.file.flush()
+
+    def close(self):
+        """
+        Writes out everything recorded and trims the file down to the records written.
+        """
+        self.commit()
+        self.flush()
+        self.records.flush()
+        self.records = None
+        self.capacity = self.count
+        self.file.truncate(HEADER_SIZE + self.count * self.layout.dtype.itemsize)
+        self.write_header()
+        self.file.close()
+
+
+class Dataset(object):
+    """
+    A dataset file mapped into memory, read with batches that are views of the file.
+    """
+    def __init__(self, path):
+        self.header = read_header(path)
+        self.width, self.height = self.header['width'], self.header['height']
+        self.dtype = np.dtype([tuple(tuple(part) if isinstance(part, list) else part for part in field)
+                               for field in self.header['dtype']])
+        count = self.header['count']
+        if count:
+            self.records = np.memmap(path, self.dtype, 'r', HEADER_SIZE, (count,))
+        else:
+            self.records = np.zeros(0, self.dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    def batches(self, size, rng=None, drop_last=False):
+        """
+        Yields the records in batches of size, each a slice of the mapped file. With rng, a numpy Generator,
+        the batches come in a random order, but the records within a batch stay in order so that no copy is made.
+        """
+        starts = np.arange(0, len(self.records), size)
+        if drop_last and len(self.records) % size:
+            starts = starts[:-1]
+        if rng is not None:
+            rng.shuffle(starts)
+        for start in starts:
+            yield self.records[start:start + size]
+
+    def boards(self, batch):
+        """
+        Returns the boards of a batch as an (n, height, width) array of 0 and 1 cells. Unlike a batch this is a copy.
+        """
+        packed = batch['board'].reshape(len(batch), self.height, -1)
+        return np.unpackbits(packed, axis=2, bitorder='little')[:, :, :self.width]
+
+
+class BotPolicy(object):
+    """
+    Plays a game through Board.move_piece, one move a frame, towards the placement autoplay.AutoPlayer picks for each
+    shape, making a random move instead a fraction epsilon of the time.
+    """
+    motions = tuple(sorted(replay.MOTION_EVENTS))
+
+    def __init__(self, game, rng, epsilon=0.1):
+        import autoplay
+        self.game = game
+        self.board = game.board
+        self.random = rng
+        self.epsilon = epsilon
+        self.player = autoplay.AutoPlayer(game.board)
+        self.planned = None                                                     #board.pieces when the moves were planned
+        self.rotations = 0
+        self.target = None                                                      #the column to shift to after rotating, None if there is nowhere to go
+
+    def plan(self):
+        placement = self.player.choose()
+        self.rotations = placement.rotations if placement is not None else 0
+        self.target = placement.x if placement is not None else None
+        self.planned = self.board.pieces
+
+    def update(self):
+        shape = self.board.active_shape
+        if self.planned != self.board.pieces:
+            self.plan()
+        if self.random.random() < self.epsilon:
+            motion = self.random.choice(self.motions)
+            self.planned = None                                                 #plan again from wherever that leaves the shape
+        elif self.target is None:
+            return
+        elif self.rotations:
+            motion = engine.MOTION_UP
+            self.rotations -= 1
+        elif shape.x != self.target:
+            motion = engine.MOTION_LEFT if shape.x > self.target else engine.MOTION_RIGHT
+        else:
+            motion = engine.MOTION_DROP
+        x = shape.x
+        self.game.keyboard_handler(motion)
+        if motion in (engine.MOTION_LEFT, engine.MOTION_RIGHT) and shape.x == x:
+            self.target = x                                                     #blocked, so drop it where it is
+
+
+def export(args):
+    rng = random.Random(args.seed)
+    exporter = Exporter(args.file)
+    start = time.perf_counter()
+    for i in range(args.games):
+        board = engine.new_board(backend='bitboard', seed=args.seed + i)
+        game = engine.Game(board)
+        exporter.attach(board, game)
+        policy = BotPolicy(game, rng, args.epsilon)
+        over = []
+        board.push_handlers(on_game_over=lambda: over.append(True))
+        while not over and board.pieces <= args.pieces:
+            policy.update()
+            game.cycle(1 / game.frame_rate)
+        exporter.detach(board)
+        if not over:
+            exporter.next_game()
+    exporter.close()
+    elapsed = time.perf_counter() - start
+    print('%d records of %d bytes from %d games, %.0f records/s' % (
+        exporter.count, exporter.layout.dtype.itemsize, args.games, exporter.count / elapsed))
+    return 0
+
+
+def info(args):
+    dataset = Dataset(args.file)
+    header = dataset.header
+    print('%d records of %d bytes, %dx%d boards' % (len(dataset), header['record_size'], dataset.width, dataset.height))
+    if len(dataset):
+        records = dataset.records
+        print('%d games, %d locks, %d lines, %d games over' % (
+            int(records['game'].max()) + 1, int(records['locked'].sum()), int(records['lines'].sum()), int(records['done'].sum())))
+        start = time.perf_counter()
+        filled = sum(int(dataset.boards(batch).sum()) for batch in dataset.batches(4096))
+        print('unpacked every board in %.3fs, %d filled cells' % (time.perf_counter() - start, filled))
+    return 0
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog=argv[0], description=__module_description__)
+    commands = parser.add_subparsers(dest='command', required=True)
+    export_parser = commands.add_parser('export', help='play games with a bot and export them')
+    export_parser.add_argument('file')
+    export_parser.add_argument('--games', type=int, default=10)
+    export_parser.add_argument('--pieces', type=int, default=500, help='end a game after this many shapes')
+    export_parser.add_argument('--epsilon', type=float, default=0.1, help='fraction of moves made at random')
+    export_parser.add_argument('--seed', type=engine.parse_seed, default=0)
+    export_parser.set_defaults(run=export)
+    info_parser = commands.add_parser('info', help='describe an exported dataset')
+    info_parser.add_argument('file')
+    info_parser.set_defaults(run=info)
+    return parser.parse_args(argv[1:])
+
+
+def main(argv):
+    args = parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
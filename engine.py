@@ -0,0 +1,1486 @@
+"""
+Headless tetris engine.
+
+Holds the shapes, the board and the scoring rules with no dependency on pyglet,
+so games can be simulated without a display. The pyglet frontend lives in
+tetris.py and drives the classes defined here.
+
+Run it directly to check that the column index of every backend stays in step
+with the rows when they are set directly and then shifted or locked onto, and
+that auto repeat and input tracing behave:
+
+    python engine.py [number of boards]
+"""
+import collections
+import random
+import sys
+import time
+
+__module_name__ = 'engine'
+__module_description__ = 'the headless game engine for the tetris clone'
+__version__ = (0, 1, 0)
+#Comments done by Pasindu Gunasekara for COMP SCI 3IO3
+
+# these are the dimensions from the gameboy version
+BOARD_WIDTH = 14
+BOARD_HEIGHT = 20
+MIN_BOARD_WIDTH = 7                                                             #shapes spawn in the middle column, and have to fit to the right of it
+MIN_BOARD_HEIGHT = 4                                                            #and the longest shape has to fit standing up
+MAX_BOARD_WIDTH = 1000                                                          #the largest boards the engine is tuned for, for marathon and stress games
+MAX_BOARD_HEIGHT = 2000
+MAX_SEED = 2 ** 64 - 1                                                          #replays and snapshots store seeds as unsigned 64 bit integers
+
+#values to represent various types of spaces on the board
+#0 - empty space on the board
+#1 - space occupied by a block
+#2 - active block
+BLOCK_EMPTY = 0
+BLOCK_FULL = 1
+BLOCK_ACTIVE = 2
+
+#translate tables between the bytearray rows of Board and the binary digits of a row mask, so converting a row runs in C
+CELL_DIGITS = bytes.maketrans(bytes((BLOCK_EMPTY, BLOCK_FULL)), b'01')
+DIGIT_CELLS = bytes.maketrans(b'01', bytes((BLOCK_EMPTY, BLOCK_FULL)))
+
+#motion values used to move the active shape, these match pyglet.window.key so the
+#frontend can pass its on_text_motion values straight through
+MOTION_UP = 0xff52
+MOTION_RIGHT = 0xff53
+MOTION_DOWN = 0xff54
+MOTION_LEFT = 0xff51
+MOTION_DROP = 0x020                                                             #pyglet.window.key.SPACE, drops the shape straight down
+REPEATING_MOTIONS = (MOTION_LEFT, MOTION_RIGHT, MOTION_DOWN)                    #the motions AutoRepeat repeats while their key is held
+MAX_TRACED_INPUTS = 1024                                                        #applied inputs a Game keeps waiting to be presented
+
+EVENT_HANDLED = True
+EVENT_UNHANDLED = None
+
+
+class EventDispatcher(object):
+    """
+    A minimal stand in for pyglet.event.EventDispatcher, so boards can dispatch events without pyglet.
+    Supports the same register_event_type, push_handlers, pop_handlers, remove_handlers and dispatch_event calls.
+    """
+    event_types = []
+
+    @classmethod
+    def register_event_type(cls, name):
+        """
+        Registers an event name that handlers can listen for on this class.
+        """
+        if 'event_types' not in cls.__dict__:
+            cls.event_types = list(cls.event_types)                             #give each subclass its own list of event types
+        cls.event_types.append(name)
+        return name
+
+    def push_handlers(self, *args, **kwargs):
+        """
+        Pushes a new frame of handlers, taken from the methods of the objects passed in and from keyword arguments.
+        """
+        if '_event_stack' not in self.__dict__:
+            self._event_stack = []
+
+        frame = {}
+        for obj in args:
+            for name in self.event_types:
+                handler = getattr(obj, name, None)
+                if handler is not None:
+                    frame[name] = handler
+        for name, handler in kwargs.items():
+            if name not in self.event_types:
+                raise ValueError('Unknown event "%s"' % name)
+            frame[name] = handler
+        self._event_stack.insert(0, frame)                                      #the newest frame gets the first chance to handle an event
+
+    def pop_handlers(self):
+        """
+        Removes the most recently pushed frame of handlers.
+        """
+        del self._event_stack[0]
+
+    def remove_handlers(self, *args, **kwargs):
+        """
+        Removes the handlers taken from the objects passed in, and the keyword handlers, from every frame they were pushed in.
+        """
+        stack = self.__dict__.get('_event_stack', [])
+        for frame in stack:
+            for name, handler in list(frame.items()):
+                if getattr(handler, '__self__', None) in args or kwargs.get(name) == handler:
+                    del frame[name]
+        stack[:] = [frame for frame in stack if frame]                          #drop the frames that are now empty
+
+    def dispatch_event(self, event_type, *args):
+        """
+        Calls the handlers for the event from the newest frame to the oldest, stopping if one handles it.
+        """
+        for frame in list(self.__dict__.get('_event_stack', ())):
+            handler = frame.get(event_type)
+            if handler is not None and handler(*args):
+                return EVENT_HANDLED
+        handler = getattr(self, event_type, None)                               #a method on the dispatcher itself is called last
+        if handler is not None and handler(*args):
+            return EVENT_HANDLED
+        return EVENT_UNHANDLED
+
+
+Orientation = collections.namedtuple('Orientation', [
+    'shape',                                                                    #the 4x4 grid of the orientation as a tuple of rows
+    'cells',                                                                    #(x, y) of each full block within the 4x4 grid
+    'masks',                                                                    #bitmask of each row, bit x is set when column x is full
+    'left_edge',
+    'right_edge',
+    'bottom_edge',
+    'profile',                                                                  #(x, y) of the lowest block in each column, used to find where the shape lands
+])
+
+
+def build_orientation(shape):
+    """
+    Builds the immutable Orientation entry for a 4x4 shape grid, working out its cells and edges once.
+    """
+    cells = tuple((x, y) for y in range(4) for x in range(4) if shape[y][x] == BLOCK_FULL)
+    return Orientation(
+        shape=tuple(tuple(row) for row in shape),
+        cells=cells,
+        masks=tuple(sum(1 << x for x in range(4) if row[x] == BLOCK_FULL) for row in shape),
+        left_edge=min(x for x, y in cells),
+        right_edge=max(x for x, y in cells),
+        bottom_edge=max(y for x, y in cells),
+        profile=tuple((x, max(cy for cx, cy in cells if cx == x)) for x in sorted(set(x for x, y in cells))),
+    )
+
+
+def build_orientations(shapes):
+    """
+    Expands each shape into its four clockwise rotations, returning a tuple of Orientation tuples indexed by [kind][rotation].
+    """
+    table = []
+    for shape in shapes:
+        rotations = []
+        for rotation in range(4):
+            rotations.append(build_orientation(shape))
+            shape = [[shape[4 - j - 1][i] for j in range(4)] for i in range(4)]  #rotate the matrix holding the shape clockwise
+        table.append(tuple(rotations))
+    return tuple(table)
+
+
+class Shape(object):
+    """
+    The shape class is used to build each shape that the user might encounter in a game of tetris.
+    Performs various other operations on shapes, such as selecting, cloning, and rotating.
+    A shape is just its kind, rotation and position; the grid and edges come from the precomputed ORIENTATIONS table.
+    """
+    #Array of 6 different types of shapes that a user may recieve randomly at each iteration of the game.
+    _shapes = [
+        [[0, 1, 0, 0], [0, 1, 0, 0], [0, 1, 0, 0], [0, 1, 0, 0]],
+        [[0, 0, 0, 0], [0, 1, 1, 0], [0, 1, 1, 0], [0, 0, 0, 0]],
+        [[0, 0, 0, 0], [0, 1, 0, 0], [1, 1, 1, 0], [0, 0, 0, 0]],
+        [[0, 0, 0, 0], [0, 0, 1, 0], [0, 0, 1, 0], [0, 1, 1, 0]],
+        [[0, 0, 0, 0], [0, 0, 1, 0], [0, 1, 1, 0], [0, 1, 0, 0]],
+        [[0, 0, 0, 0], [0, 1, 0, 0], [0, 1, 1, 0], [0, 0, 1, 0]],
+    ]
+
+    __slots__ = ('kind', 'rotation', 'orientation', 'x', 'y')
+    
+    def __init__(self, x=0, y=0, rng=random):
+        """
+        x: x coordinate of the shape with a default value of 0 
+        y: y coordinate of the shape with a default value of 0 
+        rng: the random.Random (or the random module) the shape is picked from
+        """
+        self.kind = rng.choice(range(len(self._shapes)))                        #Selects a random shape from the preset array of shapes
+        self.rotation = rng.choice(range(4))                                    #Select a random orientation for the shape
+        self.orientation = ORIENTATIONS[self.kind][self.rotation]
+        self.x = x
+        self.y = y
+
+    @property
+    def shape(self):
+        """
+        The 4x4 grid of the current orientation, as a tuple of rows.
+        """
+        return self.orientation.shape
+
+    @property
+    def cells(self):
+        """
+        The (x, y) offsets of each full block of the current orientation.
+        """
+        return self.orientation.cells
+
+    def copy_shape(self):
+        """
+        Returns an array with the copy of the current shape selected for the object.
+        """
+        return [list(row) for row in self.orientation.shape]
+    
+    def clone(self):
+        """
+        Creates a object of the Shape class with the same kind, rotation and position as this one.
+        """
+        cloned = Shape.__new__(Shape)                                           #skips the constructor so no random shape is picked only to be overwritten
+        cloned.kind = self.kind
+        cloned.rotation = self.rotation
+        cloned.orientation = self.orientation
+        cloned.x = self.x
+        cloned.y = self.y
+        return cloned
+    
+    @classmethod
+    def of(cls, kind, rotation, x=0, y=0):
+        """
+        Creates a shape of a given kind and rotation, without drawing from any random generator.
+        """
+        shape = cls.__new__(cls)
+        shape.assign(kind, rotation, x, y)
+        return shape
+
+    def assign(self, kind, rotation, x=0, y=0):
+        """
+        Turns this shape into a shape of another kind and rotation in place, so that shape objects can be reused.
+        """
+        self.kind = kind
+        self.rotation = rotation
+        self.orientation = ORIENTATIONS[kind][rotation]
+        self.x = x
+        self.y = y
+
+    def copy_from(self, other):
+        """
+        Makes this shape the same kind, rotation and position as other, in place.
+        """
+        self.kind = other.kind
+        self.rotation = other.rotation
+        self.orientation = other.orientation
+        self.x = other.x
+        self.y = other.y
+
+    def rotate(self):
+        """
+        Rotates the shape to change it's orientation when the shape is generated or when the user rotates it.
+        """
+        self.rotation = (self.rotation + 1) % 4                                 #the next clockwise rotation in the table
+        self.orientation = ORIENTATIONS[self.kind][self.rotation]
+
+    @property
+    def left_edge(self):
+        """
+        The x coordinate of the leftmost block within the shape.
+        """
+        return self.orientation.left_edge
+
+    @property
+    def right_edge(self):
+        """
+        The x coordinate of the rightmost block within the shape.
+        """
+        return self.orientation.right_edge
+
+    @property
+    def bottom_edge(self):
+        """
+        The y coordinate of the lowest block within the shape.
+        """
+        return self.orientation.bottom_edge
+
+
+ORIENTATIONS = build_orientations(Shape._shapes)                                #every orientation of every shape, built once at import
+
+
+class UniformRandomizer(object):
+    """
+    Deals every shape and rotation independently and uniformly at random, the way this clone has always dealt them.
+    """
+    name = 'uniform'
+
+    def __init__(self, rng):
+        self.random = rng
+        self.kinds = range(len(Shape._shapes))
+        self.rotations = range(4)
+
+    def deal(self, kinds, rotations, slot):
+        """
+        Deals the next shape into slot of the kinds and rotations lists.
+        """
+        kinds[slot] = self.random.choice(self.kinds)                            #drawn in the same order Shape picks, so seeds keep dealing the same games
+        rotations[slot] = self.random.choice(self.rotations)
+
+
+class BagRandomizer(UniformRandomizer):
+    """
+    Deals every kind of shape once, in a shuffled order, before dealing any of them again, as the 7-bag of other
+    tetris games does with this clone's 6 shapes. Rotations are still picked at random.
+    """
+    name = 'bag'
+
+    def __init__(self, rng):
+        super(BagRandomizer, self).__init__(rng)
+        self.bag = list(self.kinds)
+        self.position = len(self.bag)                                           #empty, so the first deal shuffles
+
+    def deal(self, kinds, rotations, slot):
+        if self.position == len(self.bag):
+            self.random.shuffle(self.bag)                                       #shuffled in place, no new bag is made
+            self.position = 0
+        kinds[slot] = self.bag[self.position]
+        self.position += 1
+        rotations[slot] = self.random.choice(self.rotations)
+
+
+RANDOMIZERS = {
+    'uniform': UniformRandomizer,
+    'bag': BagRandomizer,
+}
+
+
+class PieceQueue(object):
+    """
+    The next depth shapes a board will spawn, kept in a ring buffer that is allocated once. Taking a shape deals a
+    new one into its slot, so within a game the order shapes are dealt in does not depend on the depth.
+    """
+    def __init__(self, randomizer, depth=1):
+        if depth < 1:
+            raise ValueError('A piece queue needs a depth of at least 1')
+        self.randomizer = randomizer
+        self.depth = depth
+        self.kinds = [0] * depth
+        self.rotations = [0] * depth
+        self.position = 0                                                       #the slot of the next shape
+
+    def refill(self):
+        """
+        Deals a whole new queue, as a new game does.
+        """
+        for slot in range(self.depth):
+            self.randomizer.deal(self.kinds, self.rotations, slot)
+        self.position = 0
+
+    def take(self, shape):
+        """
+        Turns shape into the next shape in the queue, and deals a new shape into the end of the queue.
+        """
+        slot = self.position
+        shape.assign(self.kinds[slot], self.rotations[slot])
+        self.randomizer.deal(self.kinds, self.rotations, slot)
+        self.position = (slot + 1) % self.depth
+
+    def peek(self, shape, i=0):
+        """
+        Turns shape into the shape i places from the front of the queue, without taking it.
+        """
+        slot = (self.position + i) % self.depth
+        shape.assign(self.kinds[slot], self.rotations[slot])
+
+    def preview(self):
+        """
+        Returns the (kind, rotation) of every shape in the queue, next first.
+        """
+        return [(self.kinds[(self.position + i) % self.depth], self.rotations[(self.position + i) % self.depth])
+                for i in range(self.depth)]
+
+
+class ColumnIndex(object):
+    """
+    The surface height and number of holes of each column of a board, kept up to date as shapes lock and lines clear
+    instead of being found by scanning the grid. Boards keep one as their columns attribute, and bots can copy one to
+    follow candidate placements without rescanning either.
+    A column's height counts rows up from the floor to its highest block, and its holes are the empty cells below that block.
+    """
+    __slots__ = ('width', 'height', 'heights', 'holes')
+
+    def __init__(self, width, height, heights=None, holes=None):
+        self.width, self.height = width, height
+        self.heights = heights if heights is not None else [0] * width
+        self.holes = holes if holes is not None else [0] * width
+
+    @classmethod
+    def from_rows(cls, rows, width, height):
+        """
+        Builds the index of a board by scanning it, rows being a bitmask per row with bit x set when column x is full.
+        The rows are scanned a whole row at a time rather than cell by cell, so that large boards rebuild quickly:
+        a column's height comes from the first row its bit shows up in, and its holes from the number of full cells
+        in it, which are counted for every column at once with one binary counter per bit of the count, held across
+        the columns as row masks.
+        """
+        heights = [0] * width
+        seen = 0                                                                #columns that have had a block in them so far
+        counters = []                                                           #bit k of the full cells counted in column x is bit x of counters[k]
+        for y, row in enumerate(rows):
+            new = row & ~seen
+            while new:
+                low = new & -new
+                heights[low.bit_length() - 1] = height - y
+                new ^= low
+            seen |= row
+            carry, k = row, 0
+            while carry:                                                        #adds the row to every column's count at once
+                if k == len(counters):
+                    counters.append(0)
+                counters[k], carry = counters[k] ^ carry, counters[k] & carry
+                k += 1
+        filled = [sum(((counter >> x) & 1) << k for k, counter in enumerate(counters)) for x in range(width)]
+        return cls(width, height, heights, [heights[x] - filled[x] for x in range(width)])
+
+    def copy(self):
+        return ColumnIndex(self.width, self.height, list(self.heights), list(self.holes))
+
+    def add_shape(self, orientation, x, y):
+        """
+        Accounts for an orientation locked at x, y, blocks above the top of the board are lost so they are skipped.
+        """
+        heights, holes = self.heights, self.holes
+        for cx, cy in orientation.cells:
+            if cy + y < 0:
+                continue
+            column = cx + x
+            cell_height = self.height - cy - y
+            if cell_height > heights[column]:
+                holes[column] += cell_height - 1 - heights[column]              #the cells skipped over between the old surface and this block
+                heights[column] = cell_height
+            else:
+                holes[column] -= 1                                              #filled a hole, after sliding under an overhang
+
+    def clear_rows(self, count, filled):
+        """
+        Accounts for count full rows having been removed. Every column had a block in each of them, so each column
+        drops by count; a column whose new top cell is empty had its highest block in a cleared row, and drops further
+        to its next block, its holes in between no longer being covered.
+        filled: a filled(x, y) function telling whether a cell of the board is full, after the rows were removed
+        """
+        heights, holes = self.heights, self.holes
+        for x in range(self.width):
+            heights[x] -= count
+            while heights[x] and not filled(x, self.height - heights[x]):
+                heights[x] -= 1
+                holes[x] -= 1
+
+    def landing_y(self, orientation, x, y):
+        """
+        Returns the row an orientation at x, y lands on when dropped straight down, from the surface under each of its
+        columns. Returns None if the orientation is already below the surface of one of its columns, after sliding
+        under an overhang, where only stepping down row by row can tell where it stops.
+        """
+        landing = min(self.height - self.heights[x + cx] - 1 - cy for cx, cy in orientation.profile)
+        if landing < y:
+            return None
+        return landing
+
+
+
+class Board(EventDispatcher):
+    """
+    The board class is used for the game board containing the shapes.
+    Allows for various board operations, such as resetting the game, adding shapes, and collision detection.
+    Each row of the board is a bytearray of BLOCK_EMPTY/BLOCK_FULL cells, so that boards up to MAX_BOARD_WIDTH by
+    MAX_BOARD_HEIGHT stay compact, and work on whole rows such as finding full ones runs in C.
+    """
+    #variables used to keep track of the current shape, the next shape, and the board matrix
+    active_shape = None
+    pending_shape = None
+    pieces = 0                                                                  #shapes spawned in the current game, counting the active one
+    board = None
+    _columns = None
+    dirty = True                                                                #set whenever the shape moves or the board changes, and cleared by whoever draws the board
+    profiler = None                                                             #if set, times move_down and shape_to_board, see profiler.Profiler
+    exporter = None                                                             #if set, told about every move and lock, see dataset.Exporter
+    
+    def __init__(self, width=BOARD_WIDTH, height=BOARD_HEIGHT, seed=None, randomizer='uniform', preview=1):
+        """
+        Initializes the board with the height, and width, and begins a new game.
+        seed: seeds the board's own random generator, so the same seed always deals the same shapes. A random seed is picked if it is None
+        randomizer: the name of one of the RANDOMIZERS, which decides how shapes are dealt
+        preview: the number of upcoming shapes the board knows about, see preview()
+        """
+        if not (MIN_BOARD_WIDTH <= width <= MAX_BOARD_WIDTH and MIN_BOARD_HEIGHT <= height <= MAX_BOARD_HEIGHT):
+            raise ValueError('A board must be from %dx%d to %dx%d cells, not %dx%d' % (
+                MIN_BOARD_WIDTH, MIN_BOARD_HEIGHT, MAX_BOARD_WIDTH, MAX_BOARD_HEIGHT, width, height))
+        self.width, self.height = width, height                                 #sets the height and width of the game board
+        if seed is None:
+            seed = random.SystemRandom().getrandbits(63)
+        elif not 0 <= seed <= MAX_SEED:
+            raise ValueError('A seed must be from 0 to %d, not %d' % (MAX_SEED, seed))
+        self.seed = seed
+        self.random = random.Random(seed)                                       #the shapes of this board are only ever drawn from here
+        try:
+            self.randomizer = RANDOMIZERS[randomizer](self.random)
+        except KeyError:
+            raise ValueError('Unknown randomizer "%s"' % randomizer)
+        self.queue = PieceQueue(self.randomizer, preview)
+        self.active_shape = Shape.of(0, 0)                                      #the shape objects are made once, and reused for every shape dealt
+        self.pending_shape = Shape.of(0, 0)
+        self.rotated_shape = Shape.of(0, 0)                                     #where rotations are tried out before being made
+        self.reset()                                                            #clears the board, and starts a new game
+    
+    def reset(self):
+        """
+        Clears the board and starts a new game
+        """
+        self.board = []                                                         #sets the board to be an empty board
+        for row in range(self.height):                                          #For each row in the board where the number of rows = height
+            self.board.append(bytearray(self.width))                            #Set each row to be an array of 0s
+        self.columns = ColumnIndex(self.width, self.height)                     #every column starts out empty
+        
+        self.queue.refill()                                                     #deal the shapes of the new game
+        self.pieces = 0
+        self.add_shape()                                                        #calls the add_shape method to add the new shape to the window
+        self.dispatch_event('on_rows_changed', 0, self.height - 1)              #every row of the board has been cleared
+
+    def add_shape(self):
+        """
+        Adds a new shape to the window, and sets it as the current active shape
+        """
+        self.queue.take(self.active_shape)                                      #the active shape becomes the next shape in the queue
+        self.active_shape.x = self.width // 2 - self.active_shape.left_edge     #sets the shape to be in the middle of the x axis of the board
+        self.active_shape.y = -1                                                #sets the y coordinate of the shape to be the top of the screen
+        self.queue.peek(self.pending_shape)                                     #and the pending shape shows the one after it
+        self.pieces += 1
+        self.dirty = True
+        
+        if self.is_collision():                                                 #checks if the blocks hit the top of the the window
+            self.reset()                                                        #If so, the game ends, and resets
+            self.dispatch_event('on_game_over')                                 #the on_game_over event will reset the game
+    
+    def rotate_shape(self):
+        """
+        Rotates the active shape
+        """
+        rotated_shape = self.rotated_shape                                      #works on a copy of the active shape
+        rotated_shape.copy_from(self.active_shape)
+        rotated_shape.rotate()                                                  #rotate once using the rotate method on Shape
+
+        if rotated_shape.left_edge + rotated_shape.x < 0:
+            rotated_shape.x = -rotated_shape.left_edge
+        elif rotated_shape.right_edge + rotated_shape.x >= self.width:
+            rotated_shape.x = self.width - rotated_shape.right_edge - 1
+        
+        if self.check_bottom(rotated_shape):                                    #a rotation that pushes the shape through the floor is not possible
+            return False
+        
+        if not self.is_collision(rotated_shape):                                #if no collision is detected on the rotated shape
+            self.active_shape.copy_from(rotated_shape)                          #make the rotation on the active shape
+            self.dirty = True
+    
+    def move_left(self):
+        """
+        Moves the active shape left if possible, and returns true. If it is not possible to move, then returns False.
+        """
+        self.active_shape.x -= 1                                                #moves the shape by 1 unit to the left
+        if self.out_of_bounds() or self.is_collision():                         #checks if the move causes the shape to collide with another shape or go out of bounds
+            self.active_shape.x += 1                                            #if there is a collision or it goes out of bounds, then reset the shape back to it's previous position
+            return False                                                        #return false if it is not possible to move left
+        self.dirty = True
+        return True                                                             #return true if it is possible to move left
+    
+    def move_right(self):
+        """
+        Moves the active shape right if possible, and returns true. If it is not possible to move, then returns False.
+        """
+        self.active_shape.x += 1                                                #moves the shape by 1 unit to the right
+        if self.out_of_bounds() or self.is_collision():                         #checks if the move causes the shape to collide with another shape or go out of bounds
+            self.active_shape.x -= 1                                            #if there is a collision or it goes out of bounds, then reset the shape back to it's previous position
+            return False                                                        #return false if it is not possible to move right
+        self.dirty = True
+        return True                                                             #return true if it is possible to move right
+    
+    def move_down(self):
+        """
+        Moves the active shape down if possible, and returns true. If it is not possible to move, then returns False.
+        """
+        profiler = self.profiler
+        if profiler is not None:
+            start = time.perf_counter()
+        self.active_shape.y += 1                                                #moves the shape by 1 unit down
+        
+        moved = not (self.check_bottom() or self.is_collision())                #Checks if the new position of the shape causes the shape to hit to the bottom or cause a collision
+        if moved:
+            self.dirty = True
+        else:
+            self.active_shape.y -= 1                                            #if so, reset back to the original position of the shape
+            self.shape_to_board()                                               #add shape to permant location on the board
+            self.add_shape()                                                    #add a new shape, as the current one has hit the bottom
+        if profiler is not None:
+            profiler.record('board.move_down', time.perf_counter() - start)
+        return moved                                                            #return whether the move was possible
+
+    def drop_y(self, shape=None):
+        """
+        Returns the row a shape, the active shape by default, would land on if dropped straight down.
+        The column index gives the answer without stepping, unless the shape is under an overhang.
+        """
+        shape = shape or self.active_shape
+        landing = self.columns.landing_y(shape.orientation, shape.x, shape.y)
+        if landing is None:
+            probe = shape.clone()
+            while not (self.check_bottom(probe) or self.is_collision(probe)):
+                probe.y += 1
+            landing = probe.y - 1
+        return landing
+
+    def hard_drop(self):
+        """
+        Drops the active shape straight to where it lands and locks it there, returning the number of rows it fell.
+        """
+        shape = self.active_shape
+        landing = self.drop_y()
+        fallen = landing - shape.y
+        shape.y = landing
+        self.dirty = True
+        self.shape_to_board()
+        self.add_shape()
+        return fallen
+
+    def preview(self):
+        """
+        Returns the (kind, rotation) of the upcoming shapes, as many as the board was created to preview, next first.
+        """
+        return self.queue.preview()
+
+    def add_garbage(self, lines, hole):
+        """
+        Pushes the board up by lines rows of garbage, full except for the hole column, as sent by an opponent clearing lines.
+        The active shape is pushed up along with the blocks if they would overlap it, and the game is over if any
+        blocks are pushed off the top of the board.
+        """
+        if lines <= 0:
+            return
+        lines = min(lines, self.height)
+        top = self.stack_top()
+        overflow = self.push_up(lines, hole)
+        heights, holes = self.columns.heights, self.columns.holes
+        for x in range(self.width):                                             #every column rises by the garbage, which adds a hole under the hole column
+            if x != hole:
+                heights[x] += lines
+            elif heights[x]:
+                heights[x] += lines
+                holes[x] += lines
+        self.dirty = True
+        if overflow:
+            self.reset()
+            self.dispatch_event('on_game_over')
+            return
+        while self.is_collision():
+            self.active_shape.y -= 1
+        #from the old top of the stack down
+        self.dispatch_event('on_rows_changed', max(top - lines, 0), self.height - 1)
+
+    def push_up(self, lines, hole):
+        """
+        Moves every row up by lines rows and fills the bottom with garbage rows, returning True if any blocks fell off the top.
+        """
+        overflow = any(BLOCK_FULL in row for row in self.board[:lines])
+        garbage = bytearray((BLOCK_FULL,)) * self.width
+        garbage[hole] = BLOCK_EMPTY
+        del self.board[:lines]                                                  #shifts the rows in place rather than copying the whole board
+        self.board.extend(bytearray(garbage) for i in range(lines))
+        return overflow
+    
+    def out_of_bounds(self, shape=None):
+        """
+        Checks if the shape has gone out of bounds on the two sides of the board
+        """
+        shape = shape or self.active_shape                                      #check the shape that gets passed in, or by default the currently selected shape
+        if shape.x + shape.left_edge < 0:                                       #check for the shape going off the left side of the board
+            return True                                                         #return true if it does
+        elif shape.x + shape.right_edge >= self.width:                          #check for the shape going off the of the right side of the board
+            return True                                                         #return true if it does
+        return False                                                            #if the shape does not go out of the left and right bounds, then return false
+    
+    def check_bottom(self, shape=None):
+        """
+        Checks if the shape has hit the bottom of the board.
+        """
+        shape = shape or self.active_shape                                      #the shape to be checked if not passed in, will be the current shape for the board
+        if shape.y + shape.bottom_edge >= self.height:                          #if the shape has hit the bottom, or goes lower than the bottom of the board
+            return True                                                         #return true as the shape is at the bottom
+        return False                                                            #return false as the shape has not hit the bottom
+    
+    def is_collision(self, shape=None):
+        """
+        Check if a shape has collide with other shapes that are transposed onto the board.
+        """
+        shape = shape or self.active_shape                                      #checks the current shape or a user specified shape
+        for x, y in shape.orientation.cells:                                    #loop over the full blocks of the shape only
+            if y + shape.y < 0:                                                 #
+                continue                                                        #skip this iteration of the loop
+            if self.board[y + shape.y][x + shape.x]:                            #if a point on the shape collides with a transposed shape on the board
+                return True                                                     #return true as there is a collision
+        return False                                                            #return false as there is no collision detected
+    
+    def test_for_line(self):
+        """
+        Test is there is a full row, if so then the row can be removed
+        """
+        for y in range(self.height - 1, self.stack_top() - 1, -1):              #loop from the bottom of the board up to the highest block, the rows above it are empty
+            if BLOCK_EMPTY not in self.board[y]:                                #if no cell of the row is empty, the row is full
+                self.process_line(y)                                            #remove the current row, and move all lines above it down one line
+                return True                                                     #return true as a line was found
+        return False                                                            #return false as a line was not found after looping through all cells within the board
+    
+    def process_line(self, y_to_remove):
+        """
+        Removed a row based on the row value provided in the argument by moving all over rows above it it down by one unit.
+        """
+        full = BLOCK_EMPTY not in self.board[y_to_remove]
+        columns = self.columns                                                  #a stale index has to be rebuilt from the rows as they were, before they shift
+        del self.board[y_to_remove]                                             #the rows above it move down by one
+        self.board.insert(0, bytearray(self.width))                             #nothing is left above the top row to move down into it
+        if full:
+            columns.clear_rows(1, self.cell)
+        else:
+            self.rebuild_columns()                                              #only removing a full row keeps the columns in step
+    
+    def shape_rows(self, shape):
+        """
+        Returns the range of board rows covered by the blocks of a shape.
+        """
+        return range(max(shape.y, 0), shape.y + shape.bottom_edge + 1)
+
+    def row(self, y, start=0, stop=None):
+        """
+        Returns row y of the board as a sequence of BLOCK_EMPTY/BLOCK_FULL cells, or only its cells from start to stop.
+        """
+        if start or stop is not None:
+            return self.board[y][start:stop]
+        return self.board[y]
+
+    def set_row(self, y, cells):
+        """
+        Replaces row y of the board with a list of BLOCK_EMPTY/BLOCK_FULL cells.
+        """
+        self.board[y] = bytearray(BLOCK_FULL if cell else BLOCK_EMPTY for cell in cells)
+        self.rebuild_columns()
+        self.dirty = True
+        self.dispatch_event('on_rows_changed', y, y)
+
+    def cell(self, x, y):
+        """
+        Returns whether cell x, y of the board is full.
+        """
+        return self.board[y][x] != BLOCK_EMPTY
+
+    def row_masks(self):
+        """
+        Returns the rows of the board as bitmasks, bit x is set when column x is full.
+        """
+        return [int(row[::-1].translate(CELL_DIGITS), 2) for row in self.board]
+
+    @property
+    def columns(self):
+        """
+        The ColumnIndex of the board, updated as shapes lock and lines clear, and rebuilt the first time it is needed after
+        rows were set directly.
+        """
+        if self._columns is None:
+            self._columns = ColumnIndex.from_rows(self.row_masks(), self.width, self.height)
+        return self._columns
+
+    @columns.setter
+    def columns(self, columns):
+        self._columns = columns
+
+    def rebuild_columns(self):
+        """
+        Has the column index rebuilt by scanning the board, after rows were changed directly rather than by locking a shape.
+        It is rebuilt when next used, so setting many rows in a row costs a single scan.
+        """
+        self._columns = None
+
+    def stack_top(self):
+        """
+        Returns the highest row with a block in it, or the height of the board if it is empty. No row above it has changed
+        since the board was last cleared, which keeps the rows touched by line clears and garbage to those below it.
+        """
+        return self.height - max(self.columns.heights)
+
+    def packed_rows(self):
+        """
+        Returns the rows of the board as bytes, each row a bitmask of row_bytes bytes, least significant byte first.
+        """
+        size = self.row_bytes
+        return b''.join(mask.to_bytes(size, 'little') for mask in self.row_masks())
+
+    def load_packed_rows(self, data):
+        """
+        Replaces every row of the board with rows packed by packed_rows, from bytes or a memoryview.
+        Each row is unpacked by translating its binary digits into cells, and the column index is left for the caller to set.
+        """
+        size, digits = self.row_bytes, '0%db' % self.width
+        self.board = [bytearray(format(int.from_bytes(data[y * size:(y + 1) * size], 'little'), digits)[::-1].encode()
+                                .translate(DIGIT_CELLS)) for y in range(self.height)]
+        self.dirty = True
+
+    @property
+    def row_bytes(self):
+        """
+        The number of bytes a row takes when packed.
+        """
+        return (self.width + 7) // 8
+
+    def full_rows(self, rows):
+        """
+        Returns which of the given rows are full, in order from the top of the board.
+        """
+        return [y for y in rows if BLOCK_EMPTY not in self.board[y]]
+
+    def remove_rows(self, full_rows):
+        """
+        Removes the given rows, keeping the rows above them in order and adding empty rows at the top.
+        Deleting a row from the list of rows moves the rows above it down in C, rather than cell by cell.
+        """
+        for y in reversed(full_rows):                                           #rows below the lowest cleared row do not move
+            del self.board[y]
+        self.board[0:0] = [bytearray(self.width) for y in full_rows]
+
+    def place_shape(self, shape):
+        """
+        Transposes the blocks of a shape onto the board, blocks still above the top of the board are lost.
+        """
+        for x, y in shape.orientation.cells:                                    #loop through the full blocks of the shape
+            if y + shape.y >= 0:                                                #a negative row would wrap around to the bottom of the board
+                self.board[y + shape.y][x + shape.x] = BLOCK_FULL               #then transpose it onto the board
+
+    def shape_to_board(self):
+        """
+        Locks the active shape onto the board and clears any lines it completed.
+        Only the rows the shape covers can have become full, so only those are tested.
+        """
+        profiler = self.profiler
+        if profiler is not None:
+            start = time.perf_counter()
+        if self.exporter is not None:
+            self.exporter.on_lock(self)
+        shape = self.active_shape
+        columns = self.columns                                                  #a stale index is rebuilt before the shape is placed, or add_shape would count it twice
+        self.place_shape(shape)
+        columns.add_shape(shape.orientation, shape.x, shape.y)
+        rows = self.shape_rows(shape)
+        cleared = self.full_rows(rows)                                          #rows the shape completed, which are removed together
+        if cleared:                                                             #if the players score increased
+            top = self.stack_top()
+            self.remove_rows(cleared)
+            columns.clear_rows(len(cleared), self.cell)
+            self.dispatch_event('on_rows_changed', top, cleared[-1])            #every row from the top of the stack down to the lowest cleared one has moved
+            self.dispatch_event('on_lines', len(cleared), cleared)              #then update the score, passing on which rows were cleared
+        elif rows:
+            self.dispatch_event('on_rows_changed', rows[0], rows[-1])
+        if profiler is not None:
+            profiler.record('board.shape_to_board', time.perf_counter() - start)
+
+    def move_piece(self, motion_state):
+        """
+        Defines a set of keyboard events to perform actions on the shape within the game.
+        """
+        if self.exporter is not None:
+            self.exporter.on_move(self, motion_state)
+        if motion_state == MOTION_LEFT:                                         #listens for the left arrow key
+            self.move_left()                                                    #move the shape left by one unit if possible
+        elif motion_state == MOTION_RIGHT:                                      #listens for the right arrow key
+            self.move_right()                                                   #move the shape right by one unit if possible
+        elif motion_state == MOTION_UP:                                         #listens for the up arrow key
+            self.rotate_shape()                                                 #rotate the shape clockwise by 90 degrees
+        elif motion_state == MOTION_DOWN:                                       #listens for the down arrow key
+            self.move_down()                                                    #move the shape down by one unit if possible
+        elif motion_state == MOTION_DROP:                                       #listens for the space bar
+            self.hard_drop()                                                    #drop the shape as far as it goes and lock it
+        if self.exporter is not None:
+            self.exporter.on_moved(self)
+
+
+Board.register_event_type('on_lines')                                           #event listener to update score and increase difficulty
+Board.register_event_type('on_game_over')                                       #event listener to check for a game over
+Board.register_event_type('on_rows_changed')                                    #event listener for the range of rows whose cells changed, used to redraw only those rows
+
+
+class BitBoard(Board):
+    """
+    A board that stores each row as an integer bitmask instead of a list of cells.
+    Shapes are placed through the row masks of their Orientation, so collisions become a few ANDs, placing a shape a few ORs, and a full row a single compare against full_mask.
+    """
+    rows = None
+
+    def reset(self):
+        """
+        Clears the board and starts a new game
+        """
+        self.full_mask = (1 << self.width) - 1                                  #the value of a row with every cell filled
+        self.rows = [0] * self.height                                           #every row starts out empty
+        self.columns = ColumnIndex(self.width, self.height)
+
+        self.queue.refill()
+        self.pieces = 0
+        self.add_shape()                                                        #calls the add_shape method to add the new shape to the window
+        self.dispatch_event('on_rows_changed', 0, self.height - 1)              #every row of the board has been cleared
+
+    @property
+    def board(self):
+        """
+        The board as a list of rows of BLOCK_EMPTY/BLOCK_FULL cells, the same layout Board.board uses.
+        """
+        return [[(row >> x) & 1 for x in range(self.width)] for row in self.rows]
+
+    def row(self, y, start=0, stop=None):
+        """
+        Returns row y of the board as a list of BLOCK_EMPTY/BLOCK_FULL cells, or only its cells from start to stop.
+        """
+        row = self.rows[y] >> start
+        return [(row >> x) & 1 for x in range((self.width if stop is None else min(stop, self.width)) - start)]
+
+    def set_row(self, y, cells):
+        """
+        Replaces row y of the board with a list of BLOCK_EMPTY/BLOCK_FULL cells.
+        """
+        self.rows[y] = sum(1 << x for x, cell in enumerate(cells) if cell)
+        self.rebuild_columns()
+        self.dirty = True
+        self.dispatch_event('on_rows_changed', y, y)
+
+    def cell(self, x, y):
+        """
+        Returns whether cell x, y of the board is full.
+        """
+        return self.rows[y] >> x & 1 == 1
+
+    def row_masks(self):
+        """
+        Returns the rows of the board as bitmasks, bit x is set when column x is full.
+        """
+        return list(self.rows)
+
+    def placed_masks(self, shape):
+        """
+        Returns the row masks of a shape shifted to its x position on the board.
+        """
+        if shape.x >= 0:
+            return [mask << shape.x for mask in shape.orientation.masks]
+        return [mask >> -shape.x for mask in shape.orientation.masks]
+
+    def out_of_bounds(self, shape=None):
+        """
+        Checks if the shape has gone out of bounds on the two sides of the board
+        """
+        shape = shape or self.active_shape
+        if shape.x < 0:
+            lost = (1 << -shape.x) - 1                                          #the columns that would be shifted off the left side
+            return any(mask & lost for mask in shape.orientation.masks)
+        return any(mask << shape.x > self.full_mask for mask in shape.orientation.masks)
+
+    def is_collision(self, shape=None):
+        """
+        Check if a shape has collide with other shapes that are transposed onto the board.
+        """
+        shape = shape or self.active_shape
+        rows = self.rows
+        for y, mask in enumerate(self.placed_masks(shape)):
+            if mask and y + shape.y >= 0 and rows[y + shape.y] & mask:
+                return True
+        return False
+
+    def test_for_line(self):
+        """
+        Test is there is a full row, if so then the row can be removed
+        """
+        for y in range(self.height - 1, self.stack_top() - 1, -1):
+            if self.rows[y] == self.full_mask:
+                self.process_line(y)
+                return True
+        return False
+
+    def process_line(self, y_to_remove):
+        """
+        Removes a row by moving all of the rows above it down by one unit.
+        """
+        full = self.rows[y_to_remove] == self.full_mask
+        columns = self.columns                                                  #a stale index has to be rebuilt from the rows as they were, before they shift
+        del self.rows[y_to_remove]
+        self.rows.insert(0, 0)
+        if full:
+            columns.clear_rows(1, self.cell)
+        else:
+            self.rebuild_columns()                                              #only removing a full row keeps the columns in step
+
+    def full_rows(self, rows):
+        """
+        Returns which of the given rows are full, in order from the top of the board.
+        """
+        return [y for y in rows if self.rows[y] == self.full_mask]
+
+    def remove_rows(self, full_rows):
+        """
+        Removes the given rows, keeping the rows above them in order and adding empty rows at the top.
+        """
+        for y in reversed(full_rows):
+            del self.rows[y]
+        self.rows[0:0] = [0] * len(full_rows)
+
+    def push_up(self, lines, hole):
+        """
+        Moves every row up by lines rows and fills the bottom with garbage rows, returning True if any blocks fell off the top.
+        """
+        overflow = any(self.rows[:lines])
+        del self.rows[:lines]
+        self.rows.extend([self.full_mask & ~(1 << hole)] * lines)
+        return overflow
+
+    def packed_rows(self):
+        size = self.row_bytes
+        return b''.join(row.to_bytes(size, 'little') for row in self.rows)
+
+    def load_packed_rows(self, data):
+        """
+        Replaces every row of the board with rows packed by packed_rows, one int.from_bytes per row.
+        """
+        size = self.row_bytes
+        self.rows = [int.from_bytes(data[y * size:(y + 1) * size], 'little') for y in range(self.height)]
+        self.dirty = True
+
+    def place_shape(self, shape):
+        """
+        Transposes the blocks of a shape onto the board, blocks still above the top of the board are lost.
+        """
+        for y, mask in enumerate(self.placed_masks(shape)):
+            if mask and y + shape.y >= 0:
+                self.rows[y + shape.y] |= mask
+
+
+BOARD_BACKENDS = {
+    'list': Board,
+    'bitboard': BitBoard,
+}
+
+
+def new_board(width=BOARD_WIDTH, height=BOARD_HEIGHT, backend='list', seed=None, randomizer='uniform', preview=1):
+    """
+    Creates a board using one of the BOARD_BACKENDS, every backend has the same Board API.
+    """
+    try:
+        board_class = BOARD_BACKENDS[backend]
+    except KeyError:
+        raise ValueError('Unknown board backend "%s"' % backend)
+    return board_class(width, height, seed, randomizer, preview)
+
+
+def parse_seed(text):
+    """
+    Parses a --seed argument, accepting only seeds every board, replay and snapshot can store.
+    Raises ValueError for any other, which argparse reports as an invalid value.
+    """
+    seed = int(text)
+    if not 0 <= seed <= MAX_SEED:
+        raise ValueError('a seed must be from 0 to %d, not %d' % (MAX_SEED, seed))
+    return seed
+
+
+def gravity_interval(level, frame_rate=60.0, factor=4):
+    """
+    Returns the number of seconds between gravity steps at a level.
+    Each level takes factor frames off the interval, down to a floor of a single frame from level frame_rate / factor onwards.
+    """
+    frames = max(frame_rate - int(level) * factor, 1)
+    return frames / frame_rate
+
+
+class GravityClock(object):
+    """
+    A fixed timestep clock for gravity, driven by the real time passed between updates rather than by counting calls.
+    Time is gathered in an accumulator and spent one interval per gravity step, so late updates catch up with several steps.
+    """
+    def __init__(self, interval, max_steps=5):
+        """
+        interval: seconds between gravity steps
+        max_steps: the most steps a single update may catch up on, so a long stall does not drop the shape all the way down
+        """
+        self.interval = interval
+        self.max_steps = max_steps
+        self.accumulator = 0.0
+
+    def reset(self, interval=None):
+        """
+        Forgets any time gathered so far, optionally changing the interval.
+        """
+        if interval is not None:
+            self.interval = interval
+        self.accumulator = 0.0
+
+    def advance(self, dt):
+        """
+        Adds dt seconds to the clock and returns the number of gravity steps that are now due.
+        """
+        self.accumulator += dt
+        steps = 0
+        while self.accumulator >= self.interval and steps < self.max_steps:
+            self.accumulator -= self.interval
+            steps += 1
+        if steps == self.max_steps:
+            self.accumulator = min(self.accumulator, self.interval)             #drop whatever could not be caught up on
+        return steps
+
+    def time_until_next(self):
+        """
+        Returns the number of seconds until the next gravity step is due, for scheduling it directly.
+        """
+        return max(self.interval - self.accumulator, 0.0)
+
+
+class InputQueue(object):
+    """
+    Inputs waiting to be applied to a game, in the order they arrived.
+    Each input is a (trace id, timestamp, motion, pressed) tuple: the trace id is unique within the queue, so the input
+    can be followed until the frame showing it is on screen, and the timestamp is the perf_counter time it arrived at.
+    pressed is False for a key being released, which only matters to auto repeat.
+    """
+    def __init__(self):
+        self.inputs = collections.deque()
+        self.next_trace = 1
+
+    def push(self, motion, timestamp=None, pressed=True):
+        """
+        Adds an input to the back of the queue, timestamped now unless a timestamp is given, and returns its trace id.
+        """
+        trace = self.next_trace
+        self.next_trace += 1
+        self.inputs.append((trace, time.perf_counter() if timestamp is None else timestamp, motion, pressed))
+        return trace
+
+    def drain(self):
+        """
+        Removes and returns every queued input, oldest first.
+        """
+        inputs = list(self.inputs)
+        self.inputs.clear()
+        return inputs
+
+    def __len__(self):
+        return len(self.inputs)
+
+
+class AutoRepeat(object):
+    """
+    Repeats a held motion from within the engine, in game time, instead of relying on the operating system's key repeat.
+    Once a motion has been held for the delayed auto shift (delay) it repeats every interval seconds, the auto repeat
+    rate, or as far as the shape will go at once if interval is 0. Only the latest pressed of the held motions repeats.
+    """
+    instant_repeats = MAX_BOARD_HEIGHT                                          #enough repeats to cross any board, for an interval of 0
+
+    def __init__(self, delay=0.167, interval=0.033):
+        """
+        delay: seconds a motion has to be held before it starts repeating
+        interval: seconds between repeats once it has started
+        """
+        self.delay = delay
+        self.interval = interval
+        self.held = []                                                          #motions held down, in the order they were pressed
+        self.reset()
+
+    def reset(self):
+        """
+        Starts the delay over, as when the repeating motion changes.
+        """
+        self.elapsed = 0.0
+        self.repeats = 0
+        self.restarted = True                                                   #the next advance began before the delay did
+
+    def press(self, motion):
+        if motion in REPEATING_MOTIONS:
+            if motion in self.held:
+                self.held.remove(motion)
+            self.held.append(motion)
+            self.reset()
+
+    def release(self, motion):
+        if motion in self.held:
+            if self.held[-1] == motion:
+                self.reset()                                                    #a motion still held underneath starts its own delay
+            self.held.remove(motion)
+
+    def advance(self, dt):
+        """
+        Adds dt seconds to the time the latest motion has been held, and returns it along with the number of repeats now due.
+        The first advance after the delay starts over adds nothing, since its dt was mostly spent before the key was pressed.
+        """
+        if not self.held:
+            return None, 0
+        if self.restarted:
+            self.restarted = False
+            dt = 0.0
+        self.elapsed += dt
+        if self.elapsed < self.delay:
+            return self.held[-1], 0
+        if self.interval <= 0:
+            return self.held[-1], self.instant_repeats
+        due = int((self.elapsed - self.delay) / self.interval) + 1              #the first repeat comes as soon as the delay is over
+        repeats, self.repeats = due - self.repeats, due
+        return self.held[-1], repeats
+
+    def time_until_next(self):
+        """
+        Returns the number of seconds until the next repeat is due, or None if no motion is held.
+        """
+        if not self.held:
+            return None
+        if self.elapsed < self.delay:
+            return self.delay - self.elapsed
+        return max(self.delay + self.repeats * self.interval - self.elapsed, 0.0)
+
+
+class Game(object):
+    """
+    The game class puts together the other two classes, and contains functionality to run the game loop, handle keyboard events, and keep track of the user score.
+    It has no window of its own; the frontend in tetris.py adds drawing on top of it.
+    """
+    factor = 4                                                                  #frames taken off the gravity interval for each level
+    frame_rate = 60.0                                                           #the gravity curve is measured in frames of a 60fps display
+    
+    is_paused = False
+    dirty = True                                                                #set when the score, level or pause state changes
+    recorder = None                                                             #if set, told about every input and gravity step, see replay.Recorder
+    profiler = None                                                             #if set, times cycle and counts inputs and gravity steps, see set_profiler
+    auto_repeat = None                                                          #if set, an AutoRepeat repeating held motions, fed by press and release
+    
+    def __init__(self, board, starting_level=1):
+        """
+        Constructor: sets up the board, and the callback functions
+        """
+        self.board = board                                                      #Sets the default game board
+        self.time = 0.0                                                         #seconds of unpaused play, used to timestamp recorded inputs
+        self.starting_level = int(starting_level)                               #if the starting level is specified by the user, set it manually
+        self.gravity = GravityClock(gravity_interval(self.starting_level, self.frame_rate, self.factor))
+        self.inputs = InputQueue()                                              #pressed keys wait here until the next cycle applies them
+        #(trace id, timestamp, applied) of inputs applied while profiling, until a frontend presents them; only the
+        #most recent are kept, so a headless game that never presents them does not gather them forever
+        self.traced = collections.deque(maxlen=MAX_TRACED_INPUTS)
+        self.register_callbacks()                                               #register callback functions for
+        self.reset()
+    
+    def register_callbacks(self):
+        """ Sets up the callback functions for drawing, and keyboard """
+        self.board.push_handlers(self)                                          #pushes event handlers onto the stack (drawing, and keyboard)
+    
+    def reset(self):
+        """
+        Resets the current game, but setting the start level back to the start level specified by the user, and reseting the score.
+        """
+        self.level = self.starting_level
+        self.lines = 0
+        self.score = 0
+        self.gravity.reset(self.gravity_interval())
+        self.dirty = True
+
+    def gravity_interval(self):
+        """
+        Returns the number of seconds between gravity steps at the current level.
+        """
+        return gravity_interval(self.level, self.frame_rate, self.factor)
+    
+    def should_update(self, dt=None):
+        """
+        Advances the gravity clock by dt seconds, a single frame by default, and returns the number of gravity steps due.
+        """
+        if self.is_paused:                                                      #check if the game is currently paused
+            return 0                                                            #if paused, don't update board
+        
+        if dt is None:
+            dt = 1 / self.frame_rate
+        self.time += dt
+        return self.gravity.advance(dt)
+    
+    def set_profiler(self, profiler):
+        """
+        Attaches a profiler.Profiler to the game and its board, or detaches it if profiler is None.
+        """
+        self.profiler = self.board.profiler = profiler
+
+    def keyboard_handler(self, motion):
+        if self.recorder is not None:
+            self.recorder.on_input(motion)
+        if self.profiler is not None:
+            self.profiler.count('input')
+        self.board.move_piece(motion)                                           #sets up the keyboard handler, by passing the key values into the board keyboard function
+
+    def press(self, motion, timestamp=None):
+        """
+        Queues a key press to be applied at the start of the next cycle, and returns its trace id.
+        timestamp: the perf_counter time the key was pressed, now by default
+        """
+        return self.inputs.push(motion, timestamp)
+
+    def release(self, motion, timestamp=None):
+        """
+        Queues a key release, which stops the motion auto repeating.
+        """
+        return self.inputs.push(motion, timestamp, pressed=False)
+
+    def process_inputs(self, dt=0.0):
+        """
+        Applies the queued inputs in the order they arrived, then runs the auto repeats due after dt seconds.
+        cycle calls it first, so inputs always take effect at the same point of an update, before gravity.
+        """
+        auto_repeat = self.auto_repeat
+        if self.inputs:
+            profiler = self.profiler
+            for trace, timestamp, motion, pressed in self.inputs.drain():
+                if not pressed:
+                    if auto_repeat is not None:
+                        auto_repeat.release(motion)
+                    continue
+                if auto_repeat is not None:
+                    auto_repeat.press(motion)
+                self.keyboard_handler(motion)
+                if profiler is not None:
+                    self.traced.append((trace, timestamp, time.perf_counter()))
+        if auto_repeat is not None and not self.is_paused:
+            motion, repeats = auto_repeat.advance(dt)
+            board = self.board
+            shape, pieces = board.active_shape, board.pieces
+            for i in range(repeats):
+                x, y = shape.x, shape.y
+                self.keyboard_handler(motion)
+                if board.pieces != pieces or (shape.x, shape.y) == (x, y):
+                    break                                                       #stopped by a wall, the stack or the shape locking
+
+    def time_until_input(self):
+        """
+        Returns the number of seconds until the next auto repeat is due, 0 if inputs are queued, or None if there is nothing to do.
+        """
+        if self.inputs:
+            return 0.0
+        if self.auto_repeat is None or self.is_paused:
+            return None
+        return self.auto_repeat.time_until_next()
+    
+    def on_lines(self, num_lines, rows=()):
+        """
+        Sets the score and current level;
+        rows: the board rows that were cleared, from the top of the board
+        """
+        self.score += (num_lines * self.level)                                  #the score per line increases as the level increase
+        self.lines += num_lines
+        if self.lines // 10 > self.level:
+            self.level = self.lines // 10                                       #Set the level one the user reaches level * 10 lines
+            self.gravity.interval = self.gravity_interval()                     #and speed up gravity to match
+        self.dirty = True
+    
+    def on_game_over(self):
+        self.reset()                                                            #reset the game on game overs
+    
+    def cycle(self, dt=None):
+        """
+        Advances the game by dt seconds, a single frame by default, and returns the number of gravity steps taken.
+        """
+        profiler = self.profiler
+        if profiler is not None:
+            start = time.perf_counter()
+        self.process_inputs(1 / self.frame_rate if dt is None else dt)
+        steps = self.should_update(dt)                                          #cycles through the game as long as it is not paused
+        for step in range(steps):
+            if self.recorder is not None:
+                self.recorder.on_gravity()
+            if profiler is not None:
+                profiler.count('gravity')
+            self.board.move_down()                                              #start moving shapes down if the game is not paused
+        if profiler is not None:
+            profiler.record('game.cycle', time.perf_counter() - start)
+        return steps
+
+    def time_until_gravity(self):
+        """
+        Returns the number of seconds until the next gravity step, or None while the game is paused.
+        """
+        if self.is_paused:
+            return None
+        return self.gravity.time_until_next()
+    
+    def toggle_pause(self):
+        self.is_paused = not self.is_paused                                     #pause or unpause the game
+        self.dirty = True
+
+    @property
+    def needs_redraw(self):
+        """
+        True if the game or its board has changed since mark_drawn was last called.
+        """
+        return self.dirty or self.board.dirty
+
+    def mark_drawn(self):
+        """
+        Clears the dirty flags of the game and its board once they have been drawn.
+        """
+        self.dirty = self.board.dirty = False
+
+
+def check_columns(backend, boards=200, seed=0):
+    """
+    Returns the number of boards whose column index disagreed with one rebuilt from their rows, after rows were set
+    directly and a line removed or a shape locked straight afterwards, before anything else read the index.
+    """
+    rng = random.Random(seed)
+    failures = 0
+    for i in range(boards):
+        board = new_board(backend=backend, seed=seed + i)
+        filled = rng.randint(1, 6)
+        for y in range(board.height - filled, board.height):
+            cells = [BLOCK_FULL] * board.width
+            if rng.random() < 0.5:
+                cells[rng.randrange(board.width)] = BLOCK_EMPTY                 #full rows and rows with a hole both have to stay in step
+            board.set_row(y, cells)
+        if rng.random() < 0.5:
+            board.process_line(rng.randrange(board.height - filled, board.height))
+        else:
+            shape = Shape.of(1, 0, rng.randrange(-1, board.width - 2))          #an O, landed on the filled rows without asking the index where
+            shape.y = board.height - filled - shape.orientation.bottom_edge - 1
+            board.active_shape = shape
+            board.shape_to_board()
+        expected = ColumnIndex.from_rows(board.row_masks(), board.width, board.height)
+        if (board.columns.heights, board.columns.holes) != (expected.heights, expected.holes):
+            failures += 1
+    return failures
+
+
+def check_inputs():
+    """
+    Returns a list of the ways queued inputs and auto repeat misbehaved, empty if they all behaved.
+    """
+    from profiler import Profiler
+    problems = []
+    game = Game(new_board(seed=0))
+    game.gravity.interval = float('inf')                                        #only the inputs move the shape
+    game.auto_repeat = AutoRepeat(delay=0.167, interval=0.033)
+    shape = game.board.active_shape
+    start = shape.x
+    game.cycle(0.1)
+    game.press(MOTION_LEFT)
+    game.cycle(0.2)                                                             #longer than the delay, but the key was only pressed during it
+    game.release(MOTION_LEFT)
+    game.cycle(0.05)
+    if shape.x != start - 1:
+        problems.append('a single tap moved %d columns' % (start - shape.x))
+
+    game.press(MOTION_RIGHT)
+    game.cycle(0.0)
+    game.cycle(0.25)
+    if shape.x <= start:
+        problems.append('a held key did not repeat')
+    game.release(MOTION_RIGHT)
+
+    game.set_profiler(Profiler())
+    for i in range(MAX_TRACED_INPUTS * 4):                                      #nothing presents them headless
+        game.press(MOTION_UP)
+        game.cycle(0.0)
+    if len(game.traced) > MAX_TRACED_INPUTS:
+        problems.append('%d traced inputs were kept' % len(game.traced))
+    return problems
+
+
+def main(argv):
+    boards = int(argv[1]) if len(argv) > 1 else 200
+    failures = 0
+    for backend in sorted(BOARD_BACKENDS):
+        count = check_columns(backend, boards)
+        print('%-10s %d of %d column indexes out of step' % (backend, count, boards))
+        failures += count
+    problems = check_inputs()
+    print('inputs     %s' % ('; '.join(problems) or 'ok'))
+    return 1 if failures or problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,188 @@
+"""
+Load generator for server.py.
+
+Opens many sessions against a running server, each sending random inputs at a
+steady rate, and times how long each input takes to come back acknowledged in
+a delta. At the end it asks the server for its statistics and reports how many
+sessions one core of the server can carry, along with the percentiles of the
+input round trip and of the server's tick lateness and tick work.
+
+Run it against a server started with ``python server.py``:
+
+    python loadgen.py [--sessions N] [--seconds S] [--rate INPUTS_PER_SECOND] [--websocket]
+"""
+import argparse
+import asyncio
+import base64
+import collections
+import json
+import os
+import random
+import struct
+import sys
+import time
+
+import engine
+import replay
+import server
+from profiler import PERCENTILES, percentile
+
+__module_name__ = 'loadgen'
+__module_description__ = 'a load generator for the tetris server'
+__version__ = (0, 1, 0)
+
+EVENTS = (replay.EVENT_LEFT, replay.EVENT_RIGHT, replay.EVENT_ROTATE, replay.EVENT_DOWN, replay.EVENT_DROP)
+
+
+class TcpClient(object):
+    async def connect(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.transport = server.TcpTransport(self.reader, self.writer)
+
+    def send(self, message):
+        self.transport.send(message)
+
+
+class WebSocketClient(object):
+    async def connect(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        key = base64.b64encode(os.urandom(16))
+        self.writer.write(b'GET / HTTP/1.1\r\nHost: %s:%d\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                          b'Sec-WebSocket-Key: %s\r\nSec-WebSocket-Version: 13\r\n\r\n' % (host.encode(), port, key))
+        status = await self.reader.readline()
+        if b' 101 ' not in status:
+            raise ConnectionError('WebSocket handshake refused: %r' % status)
+        while await self.reader.readline() not in (b'\r\n', b''):
+            pass
+        self.transport = server.WebSocketTransport(self.reader, self.writer)
+
+    def send(self, message):
+        """
+        Sends a binary frame, masked as clients must.
+        """
+        mask = os.urandom(4)
+        length = len(message)
+        header = bytes((0x82, 0x80 | length)) if length < 126 else bytes((0x82, 0x80 | 126)) + struct.pack('>H', length)
+        self.writer.write(header + mask + bytes(byte ^ mask[i % 4] for i, byte in enumerate(message)))
+
+
+class Player(object):
+    """
+    One session: joins, then sends an input every 1 / rate seconds, timing each until its delta acknowledges it.
+    """
+    def __init__(self, client, seed, rate, latencies):
+        self.client = client
+        self.random = random.Random(seed)
+        self.seed = seed
+        self.rate = rate
+        self.latencies = latencies
+        self.sent = collections.deque()                                         #(input number, when it was sent) of the inputs not yet acknowledged
+        self.number = 0
+        self.deltas = 0
+
+    async def run(self, seconds):
+        self.client.send(bytes((server.MSG_JOIN,)) + server.JOIN.pack(self.seed, 1, 0))
+        reading = asyncio.ensure_future(self.read())
+        loop = asyncio.get_running_loop()
+        end = loop.time() + seconds
+        await asyncio.sleep(self.random.random() / self.rate)                   #spread the players' inputs out
+        while loop.time() < end:
+            self.number = (self.number + 1) & 0xffff
+            self.sent.append((self.number, time.perf_counter()))
+            self.client.send(bytes((server.MSG_INPUT,)) + server.INPUT.pack(self.number, self.random.choice(EVENTS)))
+            await asyncio.sleep(1.0 / self.rate)
+        reading.cancel()
+
+    async def read(self):
+        while True:
+            message = await self.client.transport.receive()
+            if message is None:
+                return
+            if message[0] == server.MSG_DELTA:
+                self.deltas += 1
+                if message[1] & server.DELTA_ACK:
+                    self.acknowledge(server.ACK.unpack_from(message, 2)[0])
+
+    def acknowledge(self, number):
+        """
+        Times every input sent up to and including number, and forgets them.
+        The server applies inputs in order and only acknowledges the last of a tick, so the ones before it are shown too.
+        """
+        if not any(sent_number == number for sent_number, sent in self.sent):
+            return                                                              #numbers wrap, so look for it rather than comparing
+        now = time.perf_counter()
+        while self.sent:
+            sent_number, sent = self.sent.popleft()
+            self.latencies.append(now - sent)
+            if sent_number == number:
+                break
+
+
+async def request_stats(client_type, host, port):
+    client = client_type()
+    await client.connect(host, port)
+    client.send(bytes((server.MSG_STATS,)))
+    while True:
+        message = await client.transport.receive()
+        if message is None or message[0] == server.MSG_STATS:
+            break
+    client.writer.close()
+    return json.loads(message[1:].decode()) if message else None
+
+
+async def run(args):
+    client_type = WebSocketClient if args.websocket else TcpClient
+    before = await request_stats(client_type, args.host, args.port)
+
+    latencies = []
+    players = []
+    for i in range(args.sessions):
+        client = client_type()
+        await client.connect(args.host, args.port)
+        players.append(Player(client, args.seed + i, args.rate, latencies))
+    await asyncio.gather(*(player.run(args.seconds) for player in players))
+
+    after = await request_stats(client_type, args.host, args.port)
+    for player in players:
+        player.client.writer.close()
+    return before, after, latencies, sum(player.deltas for player in players)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog=argv[0], description=__module_description__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=server.DEFAULT_PORT)
+    parser.add_argument('--sessions', type=int, default=1000)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--rate', type=float, default=2.0, help='inputs per second per session')
+    parser.add_argument('--seed', type=engine.parse_seed, default=0)
+    parser.add_argument('--websocket', action='store_true', help='connect over WebSocket instead of TCP')
+    return parser.parse_args(argv[1:])
+
+
+def main(argv):
+    args = parse_args(argv)
+    before, after, latencies, deltas = asyncio.run(run(args))
+
+    wall = after['wall_seconds'] - before['wall_seconds']
+    cpu = after['cpu_seconds'] - before['cpu_seconds']
+    utilisation = cpu / wall if wall else 0
+    print('%d sessions for %.1fs over %s, %d deltas received' % (
+        args.sessions, args.seconds, 'WebSocket' if args.websocket else 'TCP', deltas))
+    print('server cpu %.1f%% of a core, %.0f sessions per core' % (
+        utilisation * 100, args.sessions / utilisation if utilisation else float('inf')))
+    if latencies:
+        latencies.sort()
+        print('input to delta    ' + '  '.join('p%d %7.2fms' % (p, percentile(latencies, p / 100.0) * 1000)
+                                               for p in PERCENTILES))
+    for name in ('tick_lateness', 'tick_work'):
+        stats = after[name]
+        if stats:
+            print('%-17s' % name.replace('_', ' ') + '  '.join('p%d %7.2fms' % (p, stats['p%d' % p] * 1000)
+                                                              for p in PERCENTILES))
+    print('ticks over budget %d of %d' % (after['ticks_over_budget'], after['ticks']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
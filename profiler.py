@@ -0,0 +1,239 @@
+"""
+Per frame profiling.
+
+A Profiler keeps the most recent timings of each instrumented phase in fixed
+size ring buffers and reports their percentiles, along with the number of
+frames that went over their time budget and the rate of game events. The
+engine and the frontends only time themselves while a profiler is attached to
+them, so leaving instrumentation off costs a single None check per call.
+
+Phases recorded by the instrumented code:
+
+* game.cycle, board.move_down, board.shape_to_board - engine.py
+* frame - the tetris window drawing a frame
+* starfield.cycle, starfield.draw - starfield.py
+* tick.lateness, tick.work - server.py, per tick of its timer wheel
+* input.queue, input.latency - tetris.py, from a key press to the engine
+  applying it, and to the first frame showing it being presented
+
+A StartupReport times the one-off phases of starting a frontend instead, from
+its first import to its first frame on screen.
+"""
+import array
+import json
+import time
+
+__module_name__ = 'profiler'
+__module_description__ = 'per frame profiling for the tetris clone'
+__version__ = (0, 1, 0)
+
+PERCENTILES = (50, 95, 99)
+
+
+class RingBuffer(object):
+    """
+    A fixed size buffer of floats that overwrites its oldest value once it is full.
+    """
+    def __init__(self, size):
+        self.values = array.array('d', bytes(8 * size))                         #allocated once, so recording never allocates
+        self.size = size
+        self.position = 0
+        self.count = 0                                                          #total number of values ever added
+
+    def append(self, value):
+        self.values[self.position] = value
+        self.position = (self.position + 1) % self.size
+        self.count += 1
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def recent(self):
+        """
+        Returns the values currently held, oldest first.
+        """
+        if self.count < self.size:
+            return self.values[:self.count].tolist()
+        return (self.values[self.position:] + self.values[:self.position]).tolist()
+
+
+def percentile(ordered, fraction):
+    """
+    Returns the value at a fraction of the way through a sorted list, using the nearest rank.
+    """
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class Profiler(object):
+    """
+    Records per phase timings and event counts, keeping the last size of each.
+    frame_budget: seconds a frame may take before it counts as dropped
+    """
+    def __init__(self, size=1024, frame_budget=1 / 60.0):
+        self.size = size
+        self.frame_budget = frame_budget
+        self.phases = {}
+        self.events = {}                                                        #times of the most recent events of each kind, for the event rates
+        self.frames = 0
+        self.dropped_frames = 0
+        self.slowest_input = None                                               #(trace id, seconds) of the input that took longest to reach the screen
+        self.started = time.perf_counter()
+
+    def record(self, phase, seconds):
+        """
+        Records the time one call of a phase took.
+        """
+        buffer = self.phases.get(phase)
+        if buffer is None:
+            buffer = self.phases[phase] = RingBuffer(self.size)
+        buffer.append(seconds)
+
+    def record_frame(self, phase, seconds):
+        """
+        Records the time a frame took to draw, counting it as dropped if it went over the frame budget.
+        """
+        self.record(phase, seconds)
+        self.frames += 1
+        if seconds > self.frame_budget:
+            self.dropped_frames += 1
+
+    def record_input(self, trace, pressed, applied, presented):
+        """
+        Records the latency of one traced input, given the perf_counter times it was pressed, applied and presented at.
+        """
+        self.record('input.queue', applied - pressed)
+        latency = presented - pressed
+        self.record('input.latency', latency)
+        if self.slowest_input is None or latency > self.slowest_input[1]:
+            self.slowest_input = (trace, latency)
+
+    def count(self, event):
+        """
+        Counts a game event such as an input or a gravity step.
+        """
+        buffer = self.events.get(event)
+        if buffer is None:
+            buffer = self.events[event] = RingBuffer(self.size)
+        buffer.append(time.perf_counter())
+
+    def events_per_second(self, event=None, window=1.0):
+        """
+        Returns the rate of one kind of event over the last window seconds, or of every kind together if event is None.
+        """
+        since = time.perf_counter() - window
+        buffers = self.events.values() if event is None else [self.events[event]] if event in self.events else []
+        return sum(1 for buffer in buffers for when in buffer.recent() if when >= since) / window
+
+    def stats(self, phase):
+        """
+        Returns the percentiles, maximum and number of calls of a phase, in seconds.
+        """
+        buffer = self.phases.get(phase)
+        if not buffer:
+            return None
+        ordered = sorted(buffer.recent())
+        stats = dict(('p%d' % p, percentile(ordered, p / 100.0)) for p in PERCENTILES)
+        stats['max'] = ordered[-1]
+        stats['calls'] = buffer.count
+        return stats
+
+    def summary(self):
+        """
+        Returns every statistic as a dict that can be saved as JSON.
+        """
+        return {
+            'phases': dict((phase, self.stats(phase)) for phase in sorted(self.phases)),
+            'frames': self.frames,
+            'dropped_frames': self.dropped_frames,
+            'slowest_input': self.slowest_input,
+            'events_per_second': self.events_per_second(),
+            'event_rates': dict((event, self.events_per_second(event)) for event in sorted(self.events)),
+            'uptime': time.perf_counter() - self.started,
+        }
+
+    def report(self):
+        """
+        Returns the statistics as lines of text, with times in milliseconds, for the overlay.
+        """
+        lines = []
+        for phase in sorted(self.phases):
+            stats = self.stats(phase)
+            lines.append('%-22s %s' % (phase, '  '.join(
+                'p%d %6.2f' % (p, stats['p%d' % p] * 1000) for p in PERCENTILES)))
+        lines.append('dropped frames %d of %d' % (self.dropped_frames, self.frames))
+        lines.append('events/s %.1f' % self.events_per_second() + ''.join(
+            '  %s %.1f' % (event, self.events_per_second(event)) for event in sorted(self.events)))
+        return lines
+
+    def dump(self, path):
+        """
+        Saves the summary to path as JSON.
+        """
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2, sort_keys=True)
+
+
+class StartupReport(object):
+    """
+    Times consecutive phases of starting up, each from the end of the one before.
+    """
+    def __init__(self, started=None):
+        """
+        started: the perf_counter time the first phase began at, by default now
+        """
+        self.started = self.last = time.perf_counter() if started is None else started
+        self.phases = []                                                        #(phase, seconds) in the order they ended
+
+    def mark(self, phase, deferred=0.0):
+        """
+        Ends a phase, and starts the next one.
+        deferred: seconds of work done during this phase that belong to the next one, such as an asset loaded early
+        """
+        now = time.perf_counter() - deferred
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def summary(self):
+        summary = dict(self.phases)
+        summary['total'] = self.last - self.started
+        return summary
+
+    def report(self):
+        """
+        Returns each phase and the total as lines of text, with times in milliseconds.
+        """
+        return ['%-14s %8.1f ms' % (phase, seconds * 1000) for phase, seconds in self.phases + [('total', self.last - self.started)]]
+
+
+class Overlay(object):
+    """
+    Draws a profiler's report on top of a pyglet window, refreshing it a few times a second while it is shown.
+    pyglet is only imported when an overlay is created, so the profiler itself stays usable headless.
+    """
+    refresh_interval = 0.5
+
+    def __init__(self, window, profiler):
+        import pyglet
+        self.pyglet = pyglet
+        self.window = window
+        self.profiler = profiler
+        self.visible = False
+        self.label = pyglet.text.Label('', font_name='monospace', font_size=9, x=4, y=window.height - 4,
+                                       width=window.width - 8, anchor_y='top', multiline=True)
+
+    def toggle(self):
+        self.visible = not self.visible
+        if self.visible:
+            self.refresh(0)
+            self.pyglet.clock.schedule_interval(self.refresh, self.refresh_interval)
+        else:
+            self.pyglet.clock.unschedule(self.refresh)
+        self.window.invalid = True
+
+    def refresh(self, dt):
+        self.label.text = '\n'.join(self.profiler.report())
+        self.window.invalid = True                                              #the report changes even when the game does not
+
+    def draw(self):
+        if self.visible:
+            self.label.draw()
@@ -0,0 +1,268 @@
+"""
+Recording and replaying games.
+
+A Recorder attached to an engine.Game writes a compact binary log of every
+input and gravity step. Since a board's shapes come from its seed, the log
+together with the seed is enough to play the game again exactly, either
+headless as fast as possible or in the window with ``python tetris.py --replay``.
+
+The log starts with a fixed header, followed by one event per input or
+gravity step: the milliseconds since the previous event as a varint, then a
+single event byte. A log closed by Recorder.close ends with an END event and
+the final score, lines, level and a checksum of the board, which check uses to
+spot games that no longer play out the same way.
+
+    python replay.py record FILE [number of frames] [seed]
+    python replay.py check FILE...
+"""
+import collections
+import random
+import struct
+import sys
+import time
+import zlib
+
+import engine
+
+__module_name__ = 'replay'
+__module_description__ = 'recording and replaying tetris games'
+__version__ = (0, 1, 0)
+
+MAGIC = b'TRPL'
+VERSION = 2
+HEADER = struct.Struct('<4sBQHHHB')                                             #magic, version, seed, width, height, starting level, randomizer
+HEADER_V1 = struct.Struct('<4sBQHHH')                                           #version 1 logs have no randomizer, they were all dealt uniformly
+
+RANDOMIZER_CODES = {'uniform': 0, 'bag': 1}                                     #the byte stored for each of engine.RANDOMIZERS
+CODE_RANDOMIZERS = dict((code, name) for name, code in RANDOMIZER_CODES.items())
+
+#the byte stored for each kind of event
+EVENT_END = 0
+EVENT_LEFT = 1
+EVENT_RIGHT = 2
+EVENT_ROTATE = 3
+EVENT_DOWN = 4
+EVENT_GRAVITY = 5
+EVENT_DROP = 6
+
+MOTION_EVENTS = {
+    engine.MOTION_LEFT: EVENT_LEFT,
+    engine.MOTION_RIGHT: EVENT_RIGHT,
+    engine.MOTION_UP: EVENT_ROTATE,
+    engine.MOTION_DOWN: EVENT_DOWN,
+    engine.MOTION_DROP: EVENT_DROP,
+}
+EVENT_MOTIONS = dict((event, motion) for motion, event in MOTION_EVENTS.items())
+
+Header = collections.namedtuple('Header', 'seed width height starting_level randomizer')
+Footer = collections.namedtuple('Footer', 'score lines level digest')
+
+
+class ReplayError(ValueError):
+    pass
+
+
+def write_varint(stream, value):
+    """
+    Writes a non negative integer using 7 bits per byte, with the high bit set on every byte but the last.
+    """
+    while value >= 0x80:
+        stream.write(bytes((value & 0x7f | 0x80,)))
+        value >>= 7
+    stream.write(bytes((value,)))
+
+
+def read_varint(data, pos):
+    """
+    Reads a varint from data at pos, returning the value and the position after it.
+    """
+    value = shift = 0
+    while True:
+        try:
+            byte = data[pos]
+        except IndexError:
+            raise ReplayError('replay ends in the middle of a number')
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def board_digest(board):
+    """
+    Returns a checksum of the cells of a board, the same for every board backend.
+    """
+    return zlib.crc32(bytes(cell for y in range(board.height) for cell in board.row(y)))
+
+
+class Recorder(object):
+    """
+    Records the inputs and gravity steps of an engine.Game to a binary stream.
+    """
+    def __init__(self, game, stream):
+        """
+        game: the game to record, which must not have had any input or gravity yet
+        stream: a binary file like object the log is written to
+        """
+        self.game = game
+        self.stream = stream
+        self.last_time = 0
+        board = game.board
+        stream.write(HEADER.pack(MAGIC, VERSION, board.seed, board.width, board.height, game.starting_level,
+                                 RANDOMIZER_CODES[board.randomizer.name]))
+        game.recorder = self
+
+    def write_event(self, event):
+        now = int(self.game.time * 1000)
+        write_varint(self.stream, now - self.last_time)
+        self.stream.write(bytes((event,)))
+        self.last_time = now
+
+    def on_input(self, motion):
+        event = MOTION_EVENTS.get(motion)
+        if event is not None:                                                   #motions the board ignores are not worth recording
+            self.write_event(event)
+
+    def on_gravity(self):
+        self.write_event(EVENT_GRAVITY)
+
+    def close(self):
+        """
+        Writes the final state of the game, stops recording and closes the stream.
+        """
+        game = self.game
+        self.write_event(EVENT_END)
+        for value in (game.score, game.lines, game.level, board_digest(game.board)):
+            write_varint(self.stream, value)
+        game.recorder = None
+        self.stream.close()
+
+
+def read(data):
+    """
+    Parses a log, returning its Header, a list of (milliseconds, event) pairs, and its Footer or None if it was not closed.
+    """
+    data = memoryview(data)
+    if len(data) < HEADER_V1.size:
+        raise ReplayError('replay is too short to have a header')
+    magic, version = HEADER_V1.unpack_from(data)[:2]
+    if magic != MAGIC:
+        raise ReplayError('not a replay')
+    if version == 1:
+        header = Header(*HEADER_V1.unpack_from(data)[2:] + ('uniform',))
+        pos = HEADER_V1.size
+    elif version == VERSION:
+        if len(data) < HEADER.size:
+            raise ReplayError('replay is too short to have a header')
+        fields = HEADER.unpack_from(data)
+        if fields[-1] not in CODE_RANDOMIZERS:
+            raise ReplayError('unknown randomizer %s' % fields[-1])
+        header = Header(*fields[2:-1] + (CODE_RANDOMIZERS[fields[-1]],))
+        pos = HEADER.size
+    else:
+        raise ReplayError('unsupported replay version %s' % version)
+
+    events = []
+    now = 0
+    while pos < len(data):
+        delta, pos = read_varint(data, pos)
+        if pos >= len(data):
+            raise ReplayError('replay ends in the middle of an event')
+        event = data[pos]
+        pos += 1
+        now += delta
+        if event == EVENT_END:
+            values = []
+            for i in range(4):
+                value, pos = read_varint(data, pos)
+                values.append(value)
+            return header, events, Footer(*values)
+        events.append((now, event))
+    return header, events, None
+
+
+def new_game(header, backend='list'):
+    """
+    Creates the engine.Game a log was recorded from, before any events are applied.
+    """
+    board = engine.new_board(header.width, header.height, backend, header.seed, header.randomizer)
+    return engine.Game(board, header.starting_level)
+
+
+def apply_event(game, event):
+    """
+    Applies one recorded event to a game.
+    """
+    if event == EVENT_GRAVITY:
+        game.board.move_down()
+    else:
+        game.keyboard_handler(EVENT_MOTIONS[event])
+
+
+def replay(data, backend='list'):
+    """
+    Plays a log headless as fast as possible, returning the game and the log's Footer.
+    """
+    header, events, footer = read(data)
+    game = new_game(header, backend)
+    for now, event in events:
+        apply_event(game, event)
+    return game, footer
+
+
+def check(data, backend='list'):
+    """
+    Replays a closed log and returns True if the game ends in the same state it was recorded in.
+    """
+    game, footer = replay(data, backend)
+    if footer is None:
+        raise ReplayError('replay was not closed, so there is nothing to check against')
+    return footer == Footer(game.score, game.lines, game.level, board_digest(game.board))
+
+
+def record_random(path, frames=20000, seed=None):
+    """
+    Records a headless game of random inputs to path, returning the game.
+    """
+    rng = random.Random(seed)
+    game = engine.Game(engine.Board(seed=seed), rng.randint(1, 10))
+    recorder = Recorder(game, open(path, 'wb'))
+    motions = list(MOTION_EVENTS)
+    for frame in range(frames):
+        if rng.random() < .2:
+            game.keyboard_handler(rng.choice(motions))
+        game.cycle()
+    recorder.close()
+    return game
+
+
+def main(argv):
+    if len(argv) > 2 and argv[1] == 'record':
+        frames = int(argv[3]) if len(argv) > 3 else 20000
+        seed = int(argv[4]) if len(argv) > 4 else None
+        game = record_random(argv[2], frames, seed)
+        print('recorded %s lines [%s] to %s' % (game.lines, game.score, argv[2]))
+        return 0
+
+    if len(argv) > 2 and argv[1] == 'check':
+        failed = events = 0
+        start = time.perf_counter()
+        for path in argv[2:]:
+            with open(path, 'rb') as f:
+                data = f.read()
+            events += len(read(data)[1])
+            if not check(data):
+                print('%s does not replay the same' % path)
+                failed += 1
+        elapsed = time.perf_counter() - start
+        print('%d replays, %d failed, %.0f replays/s, %.0f events/s' % (
+            len(argv) - 2, failed, (len(argv) - 2) / elapsed, events / elapsed))
+        return 1 if failed else 0
+
+    print(__doc__.split('\n\n')[-1])
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
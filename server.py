@@ -0,0 +1,497 @@
+"""
+Multiplayer game server.
+
+Hosts many headless games in one asyncio process. Players connect over TCP
+or WebSocket on the same port, are paired with an opponent in the order they
+join, and send their inputs as they happen. Gravity for every session is
+driven by a single timer wheel instead of a timer per session; at the end of
+each wheel tick, every session that changed is sent a compact delta of its
+state. Clearing two or more lines at once sends garbage rows to the
+opponent, which arrive when the opponent's next shape locks.
+
+Messages are binary. Over TCP each one is preceded by its length as a 16 bit
+integer; over WebSocket each binary frame is one message.
+
+From clients:
+
+* ``J`` + seed (u64), starting level (u8), randomizer (u8, see replay.RANDOMIZER_CODES): join, once, first
+* ``I`` + input number (u16) + event (u8, one of the replay.EVENT_ moves): an input
+* ``S``: ask for the server statistics
+
+From the server:
+
+* ``D`` + flags (u8) followed by the parts the flags select, see Session.delta
+* ``S`` + JSON: the server statistics, see Server.stats
+
+Run it with:
+
+    python server.py [--host HOST] [--port PORT]
+
+and load it with ``python loadgen.py``.
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import math
+import os
+import random
+import struct
+import sys
+import time
+
+import engine
+import replay
+from profiler import Profiler
+
+__module_name__ = 'server'
+__module_description__ = 'a server hosting many tetris games over TCP and WebSocket'
+__version__ = (0, 1, 0)
+
+DEFAULT_PORT = 7777
+TICK = 1 / 60.0                                                                 #seconds per timer wheel slot, a frame of the 60fps gravity curve
+
+MSG_JOIN = b'J'[0]
+MSG_INPUT = b'I'[0]
+MSG_STATS = b'S'[0]
+MSG_DELTA = b'D'[0]
+
+JOIN = struct.Struct('<QBB')                                                    #seed, starting level, randomizer
+INPUT = struct.Struct('<HB')                                                    #input number, event
+ACK = struct.Struct('<H')                                                       #the number of the last input applied
+LENGTH = struct.Struct('<H')                                                    #the length before each message sent over TCP
+
+#flags of a delta, saying which parts follow the flags byte, in this order
+DELTA_ACK = 0x01                                                                #u16 number of the last input applied
+DELTA_ROWS = 0x02                                                               #u8 first row, u8 number of rows, then a varint bitmask per row
+DELTA_SHAPE = 0x04                                                              #u8 kind, u8 rotation, i8 x, i8 y of the active shape
+DELTA_SCORE = 0x08                                                              #varint score, lines and level
+DELTA_GAME_OVER = 0x10                                                          #no data, the game was lost and has started over
+DELTA_GARBAGE = 0x20                                                            #varint number of garbage rows received
+
+SHAPE = struct.Struct('<BBbb')
+
+GARBAGE_LINES = {1: 0, 2: 1, 3: 2, 4: 4}                                        #garbage sent for the number of lines cleared at once
+
+WEBSOCKET_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+class TimerWheel(object):
+    """
+    A hashed timer wheel: a ring of slots each tick seconds long, where a timer is kept in the slot it is due in.
+    Scheduling and expiring a timer cost the same however many timers there are; a timer further away than one
+    turn of the wheel stays in its slot until the turn it is due on.
+    """
+    def __init__(self, tick=TICK, size=512):
+        self.tick = tick
+        self.slots = [[] for i in range(size)]
+        self.ticks = 0                                                          #ticks advanced so far
+
+    def schedule(self, delay, timer):
+        """
+        Schedules timer.expire() to be called after delay seconds, rounded up to whole ticks. A timer can only be
+        scheduled once at a time; scheduling it again replaces its earlier time.
+        """
+        due = self.ticks + max(1, math.ceil(delay / self.tick - 1e-9))          #the epsilon keeps whole ticks from rounding up to the next one
+        timer.due = due
+        self.slots[due % len(self.slots)].append((due, timer))
+
+    def cancel(self, timer):
+        timer.due = None                                                        #left in its slot, and skipped when the slot comes round
+
+    def advance(self):
+        """
+        Moves the wheel on by one tick, expiring the timers due on it.
+        """
+        self.ticks += 1
+        index = self.ticks % len(self.slots)
+        slot = self.slots[index]
+        if not slot:
+            return
+        later = []
+        self.slots[index] = later
+        for due, timer in slot:
+            if timer.due != due:                                                #cancelled, or scheduled again since
+                continue
+            if due > self.ticks:
+                later.append((due, timer))                                      #due on a later turn of the wheel
+            else:
+                timer.due = None
+                timer.expire()
+
+
+class TcpTransport(object):
+    """
+    Length prefixed messages over a stream.
+    """
+    def __init__(self, reader, writer, header=None):
+        """
+        header: the length of the first message, when it has already been read
+        """
+        self.reader, self.writer = reader, writer
+        self.header = header
+
+    async def receive(self):
+        """
+        Returns the next message, or None when the connection is closed.
+        """
+        try:
+            header, self.header = self.header, None
+            if header is None:
+                header = await self.reader.readexactly(LENGTH.size)
+            return await self.reader.readexactly(LENGTH.unpack(header)[0])
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+
+    def send(self, message):
+        self.writer.write(LENGTH.pack(len(message)) + message)
+
+
+class WebSocketTransport(object):
+    """
+    Binary WebSocket messages, after the handshake has been made by websocket_handshake.
+    """
+    def __init__(self, reader, writer):
+        self.reader, self.writer = reader, writer
+
+    async def receive(self):
+        try:
+            while True:
+                first, second = await self.reader.readexactly(2)
+                opcode, length = first & 0x0f, second & 0x7f
+                if length == 126:
+                    length = struct.unpack('>H', await self.reader.readexactly(2))[0]
+                elif length == 127:
+                    length = struct.unpack('>Q', await self.reader.readexactly(8))[0]
+                mask = await self.reader.readexactly(4) if second & 0x80 else None
+                payload = await self.reader.readexactly(length)
+                if mask is not None:
+                    payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+                if opcode == 0x8:                                               #close
+                    return None
+                if opcode == 0x9:                                               #ping
+                    self.send(payload, opcode=0xa)
+                elif opcode in (0x1, 0x2):
+                    return payload
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+
+    def send(self, message, opcode=0x2):
+        length = len(message)
+        if length < 126:
+            header = bytes((0x80 | opcode, length))
+        elif length < 1 << 16:
+            header = bytes((0x80 | opcode, 126)) + struct.pack('>H', length)
+        else:
+            header = bytes((0x80 | opcode, 127)) + struct.pack('>Q', length)
+        self.writer.write(header + message)
+
+
+async def websocket_handshake(reader, writer, first_line):
+    """
+    Answers the HTTP upgrade request a WebSocket connection starts with, returning False if it is not one.
+    """
+    key = None
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'sec-websocket-key':
+            key = value.strip().encode('latin-1')
+    if not first_line.startswith(b'GET ') or key is None:
+        writer.write(b'HTTP/1.1 400 Bad Request\r\n\r\n')
+        return False
+    accept = base64.b64encode(hashlib.sha1(key + WEBSOCKET_GUID).digest())
+    writer.write(b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                 b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+    return True
+
+
+class Session(object):
+    """
+    One player's game on the server: a headless engine.Game on a BitBoard, its connection, and its opponent.
+    The session listens to its board to build the delta sent to the player at the end of each tick.
+    """
+    due = None                                                                  #the wheel tick its gravity is due on, see TimerWheel
+    opponent = None
+
+    def __init__(self, server, transport, seed, starting_level, randomizer):
+        self.server = server
+        self.transport = transport
+        self.game = engine.Game(engine.BitBoard(seed=seed, randomizer=randomizer), starting_level)
+        self.board = self.game.board
+        self.random = random.Random(seed)                                       #picks the hole column of garbage sent to this session
+        self.board.push_handlers(self)
+        self.last_update = server.now()
+        self.pending_garbage = 0
+        self.pieces = self.board.pieces
+
+        self.ack = None                                                         #what has changed since the last delta
+        self.first_row = self.last_row = None
+        self.shape_state = None
+        self.score_state = None
+        self.game_over = False
+        self.garbage_received = 0
+        self.mark_changed()
+
+    def mark_changed(self):
+        self.server.changed.add(self)
+
+    def on_rows_changed(self, first, last):
+        if self.first_row is None:
+            self.first_row, self.last_row = first, last
+        else:
+            self.first_row, self.last_row = min(first, self.first_row), max(last, self.last_row)
+
+    def on_lines(self, num_lines, rows=()):
+        garbage = GARBAGE_LINES.get(num_lines, num_lines)
+        if garbage and self.opponent is not None:
+            self.opponent.pending_garbage += garbage
+
+    def on_game_over(self):
+        self.game_over = True
+        self.pending_garbage = 0                                                #garbage meant for the lost game is not carried into the next one
+
+    def after_move(self):
+        """
+        Applies any garbage waiting for this session once its shape has locked, and queues a delta.
+        """
+        if self.board.pieces != self.pieces:
+            self.pieces = self.board.pieces
+            if self.pending_garbage:
+                lines, self.pending_garbage = self.pending_garbage, 0
+                self.garbage_received += lines
+                self.board.add_garbage(lines, self.random.randrange(self.board.width))
+        self.mark_changed()
+
+    def on_input(self, number, event):
+        motion = replay.EVENT_MOTIONS.get(event)
+        if motion is None:
+            return
+        self.update(self.server.now())                                          #catch gravity up first, so the input lands where the player saw the shape
+        self.game.keyboard_handler(motion)
+        self.ack = number
+        self.after_move()
+        self.schedule()
+
+    def update(self, now):
+        """
+        Runs the gravity steps due since the last update.
+        """
+        if self.game.cycle(now - self.last_update):
+            self.after_move()
+        self.last_update = now
+
+    def expire(self):
+        self.update(self.server.now())
+        self.schedule()
+
+    def schedule(self):
+        delay = self.game.time_until_gravity()
+        if delay is not None:
+            self.server.wheel.schedule(delay, self)
+
+    def delta(self):
+        """
+        Returns the delta message for everything that changed since the last one, or None if nothing did.
+        """
+        flags = 0
+        parts = []
+        if self.ack is not None:
+            flags |= DELTA_ACK
+            parts.append(ACK.pack(self.ack))
+        if self.first_row is not None:
+            flags |= DELTA_ROWS
+            rows = self.board.rows[self.first_row:self.last_row + 1]
+            parts.append(bytes((self.first_row, len(rows))))
+            parts.extend(varint(row) for row in rows)
+        shape = self.board.active_shape
+        shape_state = (shape.kind, shape.rotation, shape.x, shape.y)
+        if shape_state != self.shape_state:
+            flags |= DELTA_SHAPE
+            parts.append(SHAPE.pack(*shape_state))
+        score_state = (self.game.score, self.game.lines, self.game.level)
+        if score_state != self.score_state:
+            flags |= DELTA_SCORE
+            parts.extend(varint(value) for value in score_state)
+        if self.game_over:
+            flags |= DELTA_GAME_OVER
+        if self.garbage_received:
+            flags |= DELTA_GARBAGE
+            parts.append(varint(self.garbage_received))
+        if not flags:
+            return None
+
+        self.ack = self.first_row = self.last_row = None
+        self.shape_state, self.score_state = shape_state, score_state
+        self.game_over = False
+        self.garbage_received = 0
+        return bytes((MSG_DELTA, flags)) + b''.join(parts)
+
+    async def flush(self):
+        """
+        Sends the delta, if anything changed, and waits for a player slow to read it to catch up.
+        """
+        message = self.delta()
+        if message is not None:
+            self.transport.send(message)
+            try:
+                await self.transport.writer.drain()
+            except ConnectionError:
+                pass                                                            #the connection's own loop closes the session
+
+    def close(self):
+        self.server.wheel.cancel(self)
+        self.server.changed.discard(self)
+        self.board.remove_handlers(self)
+        if self.opponent is not None:
+            self.opponent.opponent = None
+
+
+def varint(value):
+    """
+    Returns a non negative integer as 7 bits per byte, the same encoding replay.write_varint uses.
+    """
+    out = bytearray()
+    while value >= 0x80:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+class Server(object):
+    """
+    Accepts connections, pairs sessions up, and runs the timer wheel that drives every session's gravity.
+    """
+    def __init__(self, tick=TICK):
+        self.wheel = TimerWheel(tick)
+        self.sessions = set()
+        self.changed = set()                                                    #sessions with a delta to send at the end of the tick
+        self.waiting = None                                                     #the last session to join, until an opponent joins
+        self.profiler = Profiler(size=4096, frame_budget=tick)
+        self.started = time.perf_counter()
+        self.cpu_started = time.process_time()
+        self.loop = None
+
+    def now(self):
+        return self.loop.time()
+
+    async def serve(self, host='127.0.0.1', port=DEFAULT_PORT):
+        self.loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self.connection, host, port)
+        ticking = asyncio.ensure_future(self.run_wheel())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            ticking.cancel()
+
+    async def run_wheel(self):
+        """
+        Advances the wheel once per tick, expiring the gravity timers that are due and then sending the deltas.
+        Each tick's lateness and the time spent on it are recorded in the profiler.
+        """
+        start = self.loop.time()
+        while True:
+            target = start + (self.wheel.ticks + 1) * self.wheel.tick
+            delay = target - self.loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            began = self.loop.time()
+            self.profiler.record('tick.lateness', began - target)
+            self.wheel.advance()
+            await self.flush()
+            self.profiler.record_frame('tick.work', self.loop.time() - began)
+
+    async def flush(self):
+        changed, self.changed = self.changed, set()                             #sessions may change again while a slow one drains
+        for session in changed:
+            if session in self.sessions:
+                await session.flush()
+
+    def stats(self):
+        """
+        Returns the number of sessions, the CPU the server has used, and its tick statistics, as sent to clients.
+        """
+        summary = self.profiler.summary()
+        return {
+            'sessions': len(self.sessions),
+            'ticks': self.wheel.ticks,
+            'wall_seconds': time.perf_counter() - self.started,
+            'cpu_seconds': time.process_time() - self.cpu_started,
+            'tick_lateness': summary['phases'].get('tick.lateness'),
+            'tick_work': summary['phases'].get('tick.work'),
+            'ticks_over_budget': summary['dropped_frames'],
+            'inputs_per_second': self.profiler.events_per_second('input'),
+        }
+
+    def join(self, session):
+        self.sessions.add(session)
+        if self.waiting is not None and self.waiting in self.sessions:
+            session.opponent, self.waiting.opponent = self.waiting, session
+            self.waiting = None
+        else:
+            self.waiting = session
+        session.schedule()
+
+    async def connection(self, reader, writer):
+        try:
+            start = await reader.readexactly(2)
+        except asyncio.IncompleteReadError:
+            writer.close()
+            return
+        if start == b'GE':                                                      #a WebSocket connection starts with an HTTP GET, a TCP one with a length
+            if not await websocket_handshake(reader, writer, start + await reader.readline()):
+                writer.close()
+                return
+            transport = WebSocketTransport(reader, writer)
+        else:
+            transport = TcpTransport(reader, writer, start)
+
+        session = None
+        try:
+            while True:
+                message = await transport.receive()
+                if not message:
+                    break
+                kind = message[0]
+                if kind == MSG_INPUT and session is not None and len(message) == 1 + INPUT.size:
+                    self.profiler.count('input')
+                    session.on_input(*INPUT.unpack_from(message, 1))
+                elif kind == MSG_JOIN and session is None and len(message) == 1 + JOIN.size:
+                    seed, level, randomizer = JOIN.unpack_from(message, 1)
+                    session = Session(self, transport, seed, level, replay.CODE_RANDOMIZERS.get(randomizer, 'uniform'))
+                    self.join(session)
+                elif kind == MSG_STATS:
+                    transport.send(bytes((MSG_STATS,)) + json.dumps(self.stats()).encode())
+                if writer.transport.get_write_buffer_size() > 1 << 16:
+                    await writer.drain()                                        #only wait on slow readers
+        finally:
+            if session is not None:
+                self.sessions.discard(session)
+                session.close()
+            writer.close()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog=argv[0], description=__module_description__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    return parser.parse_args(argv[1:])
+
+
+def main(argv):
+    args = parse_args(argv)
+    print('serving on %s:%d, pid %d' % (args.host, args.port, os.getpid()))
+    try:
+        asyncio.run(Server().serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
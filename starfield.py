@@ -3,15 +3,18 @@
 import pyglet
 from pyglet.window import key
 
+import argparse
 import math
 import random
+import sys
+import time
+
+from profiler import Overlay, Profiler
 
 __module_name__ = 'starfield'
 __module_description__ = 'a starfield written in python'
 __version__ = (0, 1, 0)
 
-window = pyglet.window.Window(width=800, height=600)
-
 
 class Star(object):
     def __init__(self, origin, width, height):
@@ -53,19 +56,6 @@ class Star(object):
     @property
     def coordinates(self):
         return self.x + self.origin[0], self.y + self.origin[1]
-    
-    def draw(self):
-        calc_x, calc_y = map(int, self.coordinates)
-        w = int(self.width)
-        return ('v2i', (
-            calc_x, calc_y,
-            calc_x + w, calc_y,
-            calc_x + w, calc_y + w,
-            calc_x, calc_y + w)
-        )
-    
-    def gl_color(self, r, g, b):
-        return ('c3B', (r, g, b) * 4)
 
 
 class StarField(object):
@@ -74,6 +64,12 @@ class StarField(object):
     is_paused = False
     
     num_stars = 100
+    profiler = None                                                             #if set, times cycle and draw_handler, see profiler.Profiler
+    overlay = None
+
+    batch = None                                                                #created on the first draw, along with the vertex list
+    vertex_list = None                                                          #a quad for each eye of each star, written in place every frame
+    capacity = 0                                                                #stars the vertex list has room for
     
     def __init__(self, window_ref):
         self.window_ref = window_ref
@@ -105,63 +101,192 @@ class StarField(object):
     def should_update(self):
         return not self.is_paused
     
+    def ensure_capacity(self, count):
+        """
+        Makes sure the vertex list has room for count stars, growing it if needed. It never shrinks,
+        so removing stars and adding them back does not reallocate it.
+        """
+        if self.vertex_list is not None and count <= self.capacity:
+            return
+        self.capacity = max(count, self.capacity * 2)                          #grow ahead, so adding stars a few at a time does not reallocate every frame
+        if self.vertex_list is not None:
+            self.vertex_list.delete()
+        if self.batch is None:
+            self.batch = pyglet.graphics.Batch()
+        quads = 2 * self.capacity                                               #one quad for each eye of each star
+        indices = [4 * quad + i for quad in range(quads) for i in (0, 1, 2, 0, 2, 3)]
+        self.vertex_list = self.batch.add_indexed(4 * quads, pyglet.gl.GL_TRIANGLES, None, indices,
+                                                  'v2i/stream', 'c3B/static')
+        self.colors_3d = None                                                   #the colors of the new list still have to be written
+        self.drawn = 0
+
+    def update_colors(self):
+        """
+        Colors the first eye blue and the second red in 3d, or the first eye white in 2d, when the mode has changed.
+        """
+        if self.colors_3d == self.draw_3d:
+            return
+        eye = 12 * self.capacity                                                #three color bytes for each of the four vertices of each star
+        self.vertex_list.colors[:eye] = (0, 0, 255) * 4 * self.capacity if self.draw_3d else (255, 255, 255) * 4 * self.capacity
+        self.vertex_list.colors[eye:] = (255, 0, 0) * 4 * self.capacity
+        self.vertex_list.vertices[8 * self.capacity:] = (0,) * 8 * self.capacity #hide the second eye until it is written
+        self.colors_3d = self.draw_3d
+
     def draw_handler(self):
+        profiler = self.profiler
+        if profiler is not None:
+            start = time.perf_counter()
         self.window_ref.clear()
-        batch = pyglet.graphics.Batch()
+        self.ensure_capacity(max(self.num_stars, self.star_count))
+        self.update_colors()
+
+        vertices = self.vertex_list.vertices                                    #the list is written in place, then uploaded when the batch is drawn
+        second = 8 * self.capacity                                              #where the second eye's quads start
+        i = self.write_vertices(vertices, second)
+        if i < self.drawn:                                                      #collapse the quads of stars that have gone since the last frame
+            vertices[i:self.drawn] = (0,) * (self.drawn - i)
+            vertices[second + i:second + self.drawn] = (0,) * (self.drawn - i)
+        self.drawn = i
+
+        self.batch.draw()
+        if self.overlay is not None:
+            self.overlay.draw()
+        if profiler is not None:
+            profiler.record_frame('starfield.draw', time.perf_counter() - start)
+
+    def write_vertices(self, vertices, second):
+        """
+        Writes the quad of each star into vertices, with the second eye's quads starting at second in 3d,
+        and returns how many values were written for each eye.
+        """
+        draw_3d = self.draw_3d
+        i = 0
         for star in self.stars:
-            gl_data = star.draw()
-            if self.draw_3d:            
-                batch.add_indexed(4, pyglet.gl.GL_TRIANGLES, None, 
-                    [0, 1, 2, 0, 2, 3],
-                    gl_data,
-                    star.gl_color(0, 0, 255)
-                )
+            calc_x, calc_y = int(star.x + star.origin[0]), int(star.y + star.origin[1])
+            w = int(star.width)
+            vertices[i:i + 8] = (calc_x, calc_y, calc_x + w, calc_y, calc_x + w, calc_y + w, calc_x, calc_y + w)
+            if draw_3d:
                 offset = (float(star.z) / star.max_depth) * 50 # 1 -> 0
-                star.x += offset 
-                gl_data = star.draw()
-                star.x -= offset
-                batch.add_indexed(4, pyglet.gl.GL_TRIANGLES, None, 
-                    [0, 1, 2, 0, 2, 3],
-                    gl_data,
-                    star.gl_color(255, 0, 0)
-                )
-            else:
-                batch.add_indexed(4, pyglet.gl.GL_TRIANGLES, None, 
-                    [0, 1, 2, 0, 2, 3],
-                    gl_data
-                )
-            
-        batch.draw()
+                calc_x = int(star.x + offset + star.origin[0])
+                vertices[second + i:second + i + 8] = (calc_x, calc_y, calc_x + w, calc_y, calc_x + w, calc_y + w, calc_x, calc_y + w)
+            i += 8
+        return i
+
+    @property
+    def star_count(self):
+        return len(self.stars)
+
+    def toggle_profiler(self):
+        """
+        Shows or hides the profiler overlay, starting to profile the first time it is shown.
+        """
+        if self.profiler is None:
+            self.profiler = Profiler(frame_budget=1 / self.frame_rate)
+        if self.overlay is None:
+            self.overlay = Overlay(self.window_ref, self.profiler)
+        self.overlay.toggle()
     
     def move_stars(self):
         for star in self.stars:
             star.move()
     
     def cycle(self):
+        profiler = self.profiler
+        if profiler is not None:
+            start = time.perf_counter()
         if self.should_update():
             self.move_stars()
             self.update_stars()
+        if profiler is not None:
+            profiler.record('starfield.cycle', time.perf_counter() - start)
+
+
+class ArrayStarField(StarField):
+    """
+    A StarField that keeps its stars in a starsim.StarArrays instead of a set of Star objects, so that it can move and
+    draw hundreds of thousands of stars. It needs numpy, which is only imported when one is created.
+    """
+    def __init__(self, window_ref, seed=None):
+        import starsim
+        self.starsim = starsim
+        self.window_ref = window_ref
+
+        self.width = self.window_ref.width
+        self.height = self.window_ref.height
+        self.center = (self.width/2, self.height/2)
+
+        self.stars = starsim.StarArrays(self.width, self.height, self.num_stars, seed)
+
+    def update_stars(self):
+        self.stars.num_stars = self.num_stars
+        self.stars.cull()
+
+    def move_stars(self):
+        self.stars.move()
+
+    @property
+    def star_count(self):
+        return self.stars.count
+
+    def write_vertices(self, vertices, second):
+        quads = self.starsim.quad_view(vertices)                                #a numpy view of the vertex list, so nothing is copied
+        self.stars.write_quads(quads)
+        if self.draw_3d:
+            self.stars.write_quads(quads[second // 8:], offset=True)
+        return 8 * self.stars.count
+
+
+STARFIELDS = {'objects': StarField, 'numpy': ArrayStarField}
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog=argv[0], description=__module_description__)
+    parser.add_argument('--profile', metavar='FILE',
+                        help='profile the starfield and save the timings to FILE on exit, F3 shows them')
+    parser.add_argument('--backend', choices=sorted(STARFIELDS), default='objects',
+                        help='keep the stars as Star objects, or in numpy arrays for large fields')
+    parser.add_argument('--stars', type=int, default=StarField.num_stars,
+                        help='the number of stars to start with, = and - change it by a tenth, at least 50')
+    return parser.parse_args(argv[1:])
+
+
+def main(argv):
+    args = parse_args(argv)
+    window = pyglet.window.Window(width=800, height=600)
+
+    starfield = STARFIELDS[args.backend](window)
+    starfield.num_stars = args.stars
+    starfield.update_stars()
+    starfield.draw_3d = True
+    if args.profile:
+        starfield.profiler = Profiler(frame_budget=1 / starfield.frame_rate)
+
+    @window.event
+    def on_draw():
+        starfield.draw_handler()
+
+    @window.event
+    def on_key_press(key_pressed, mod):
+        if key_pressed == key.P:
+            starfield.is_paused = not starfield.is_paused
+        elif key_pressed == key.EQUAL:
+            starfield.num_stars += max(50, starfield.num_stars // 10)
+        elif key_pressed == key.MINUS:
+            starfield.num_stars -= max(50, starfield.num_stars // 10)
+        elif key_pressed == key.T:
+            starfield.draw_3d = not starfield.draw_3d
+        elif key_pressed == key.F3:
+            starfield.toggle_profiler()
+
+    def update(dt):
+        starfield.cycle()
+
+    pyglet.clock.schedule_interval(update, 1 / starfield.frame_rate)
+    pyglet.app.run()
+
+    if args.profile:
+        starfield.profiler.dump(args.profile)
+
 
-starfield = StarField(window)
-starfield.draw_3d = True
-
-@window.event
-def on_draw():
-    starfield.draw_handler()
-
-@window.event
-def on_key_press(key_pressed, mod):
-    if key_pressed == key.P:
-        starfield.is_paused = not starfield.is_paused
-    elif key_pressed == key.EQUAL:
-        starfield.num_stars += 50
-    elif key_pressed == key.MINUS:
-        starfield.num_stars -= 50
-    elif key_pressed == key.T:
-        starfield.draw_3d = not starfield.draw_3d
-
-def update(dt):
-    starfield.cycle()
-
-pyglet.clock.schedule_interval(update, 1 / starfield.frame_rate)
-pyglet.app.run()
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,190 @@
+"""
+Vectorized starfield simulation.
+
+Holds every star of a starfield in NumPy arrays, one per attribute, instead of
+a Star object per star. Moving the stars, dropping the ones that have left the
+screen and spawning their replacements are done for all of them at once, with
+the same motion as starfield.Star, and the quads drawn for the stars are
+written straight from the arrays into a vertex buffer.
+
+Run it directly to time it without a display:
+
+    python starsim.py [number of stars] [number of steps]
+"""
+import sys
+import time
+
+import numpy as np
+
+__module_name__ = 'starsim'
+__module_description__ = 'a vectorized starfield simulation'
+__version__ = (0, 1, 0)
+
+FIELDS = ('x', 'y', 'z', 'dx', 'dy', 'ddx', 'ddy', 'width')                     #one array for each, the same attributes as starfield.Star
+
+
+class StarArrays(object):
+    """
+    The stars of a starfield of width by height, stored as one array per attribute. The first count entries of each
+    array are live stars, the rest is spare capacity so that adding stars does not reallocate every step.
+    """
+    def __init__(self, width, height, num_stars=100, seed=None):
+        """
+        num_stars: how many stars to keep on screen, stars are only added when others leave the screen
+        seed: seeds the generator that places new stars
+        """
+        self.screen_width, self.screen_height = width, height                  #width itself is the array of star sizes, as on starfield.Star
+        self.origin = (width / 2, height / 2)
+        self.max_depth = max(width, height)
+        self.num_stars = num_stars
+        self.random = np.random.default_rng(seed)
+        self.count = 0
+        self.capacity = 0
+        self.reserve(num_stars)
+        self.fill()
+
+    def reserve(self, capacity):
+        """
+        Makes sure the arrays have room for capacity stars, doubling them when they are too small.
+        """
+        if capacity <= self.capacity:
+            return
+        self.capacity = max(capacity, self.capacity * 2)
+        for name in FIELDS:
+            grown = np.zeros(self.capacity)
+            if self.count:
+                grown[:self.count] = getattr(self, name)[:self.count]
+            setattr(self, name, grown)
+
+    def spawn(self, where, n):
+        """
+        Places n new stars in the entries selected by where, a slice or an index array, heading away from the center
+        like starfield.Star.
+        """
+        x = self.random.integers(1, self.screen_width + 1, n) - self.origin[0]
+        y = self.random.integers(1, self.screen_height + 1, n) - self.origin[1]
+        x[x == 0] = 1                                                           #a star at the center would never move
+        y[y == 0] = 1
+
+        wide = np.abs(x) > np.abs(y)
+        dx = np.where(wide, 1.0, np.abs(x / y)) * np.where(x > 0, 1, -1)
+        dy = np.where(wide, np.abs(y / x), 1.0) * np.where(y > 0, 1, -1)
+
+        self.x[where] = x
+        self.y[where] = y
+        self.z[where] = self.max_depth
+        self.dx[where] = dx
+        self.dy[where] = dy
+        self.ddx[where] = .1 * dx
+        self.ddy[where] = .1 * dy
+        self.width[where] = 2
+
+    def fill(self):
+        """
+        Adds stars until there are num_stars of them.
+        """
+        if self.count < self.num_stars:
+            self.reserve(self.num_stars)
+            self.spawn(slice(self.count, self.num_stars), self.num_stars - self.count)
+            self.count = self.num_stars
+
+    def move(self):
+        """
+        Moves every star one step, like starfield.Star.move.
+        """
+        n = self.count
+        x, y = self.x[:n], self.y[:n]
+        x += self.dx[:n]
+        y += self.dy[:n]
+        self.z[:n] -= 1
+        self.dx[:n] += self.ddx[:n]
+        self.dy[:n] += self.ddy[:n]
+        np.multiply(self.max_depth - self.z[:n], .1, out=self.width[:n])
+        self.width[:n] += 2
+
+    def onscreen(self):
+        """
+        Returns which of the live stars are still on screen.
+        """
+        n = self.count
+        cx = self.x[:n] + self.origin[0]
+        cy = self.y[:n] + self.origin[1]
+        return (cx >= 0) & (cx <= self.screen_width) & (cy >= 0) & (cy <= self.screen_height)
+
+    def cull(self):
+        """
+        Replaces the stars that have left the screen. While there are more stars than num_stars, the ones that have
+        left are dropped instead, so lowering num_stars thins the field out as stars leave, as StarField.update_stars does.
+        """
+        gone = ~self.onscreen()
+        if not gone.any():
+            self.fill()
+            return
+        if self.count > self.num_stars:
+            keep = np.flatnonzero(~gone)
+            for name in FIELDS:                                                 #move the stars that are left to the front
+                values = getattr(self, name)
+                values[:len(keep)] = values[keep]
+            self.count = len(keep)
+            self.fill()
+        else:
+            gone = np.flatnonzero(gone)
+            self.spawn(gone, len(gone))                                         #respawn in place, so nothing has to move
+            self.fill()
+
+    def step(self):
+        self.move()
+        self.cull()
+
+    def write_quads(self, out, offset=False):
+        """
+        Writes the quad of each live star into out, an (n, 8) int array of x, y pairs for the four corners.
+        offset: shift each star right by its depth, for the second eye of the 3d view
+        """
+        n = self.count
+        if offset:
+            calc_x = (self.x[:n] + (self.z[:n] / self.max_depth) * 50 + self.origin[0]).astype(np.int32)
+        else:
+            calc_x = (self.x[:n] + self.origin[0]).astype(np.int32)
+        calc_y = (self.y[:n] + self.origin[1]).astype(np.int32)
+        w = self.width[:n].astype(np.int32)
+        out = out[:n]
+        out[:, 0] = out[:, 6] = calc_x
+        out[:, 2] = out[:, 4] = calc_x + w
+        out[:, 1] = out[:, 3] = calc_y
+        out[:, 5] = out[:, 7] = calc_y + w
+
+
+def quad_view(vertices):
+    """
+    Returns an (n, 8) int view of a pyglet vertex list's v2i vertices, one row per quad, for write_quads to fill in place.
+    """
+    return np.ctypeslib.as_array(vertices).reshape(-1, 8)
+
+
+def main(argv):
+    num_stars = int(argv[1]) if len(argv) > 1 else 100000
+    steps = int(argv[2]) if len(argv) > 2 else 400
+    stars = StarArrays(800, 600, num_stars, seed=0)
+    quads = np.zeros((2, num_stars, 8), dtype=np.int32)                        #stands in for the vertex buffer of both eyes
+
+    start = time.perf_counter()
+    for i in range(steps):
+        stars.step()
+    step_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(steps):
+        stars.step()
+        stars.write_quads(quads[0])
+        stars.write_quads(quads[1], offset=True)
+    frame_time = time.perf_counter() - start
+
+    print('step:          %8.0f steps/s  %12.0f star-steps/s' % (steps / step_time, num_stars * steps / step_time))
+    print('step + quads:  %8.0f steps/s  %12.0f star-steps/s' % (steps / frame_time, num_stars * steps / frame_time))
+    print('%d stars' % num_stars)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -1,430 +1,575 @@
+import time
+IMPORT_STARTED = time.perf_counter()                                            #the startup report counts the imports from here
+
 import pyglet
 from pyglet.window import key
 
-import random
+import argparse
+import json
 import sys
 
+import assets
+import engine
+import replay
+from engine import BOARD_WIDTH, BOARD_HEIGHT, BLOCK_FULL, BLOCK_ACTIVE, Board
+from profiler import Overlay, Profiler, StartupReport
+
 __module_name__ = 'tetris'
 __module_description__ = 'a clone of tetris written in python'
 __version__ = (0, 1, 0)
 #Comments done by Pasindu Gunasekara for COMP SCI 3IO3
 
-# these are the dimensions from the gameboy version
-BOARD_WIDTH = 14
-BOARD_HEIGHT = 20
-
-#values to represent various types of spaces on the board
-#0 - empty space on the board
-#1 - space occupied by a block
-#2 - active block
-BLOCK_EMPTY = 0
-BLOCK_FULL = 1
-BLOCK_ACTIVE = 2
-BLOCK_IMG_FILE = 'img/block.png'                                                #selects an image for a block to display
-
-block = pyglet.image.load(BLOCK_IMG_FILE)                                       #loads the image into pyglet using any available image decoder
-block_sprite = pyglet.sprite.Sprite(block)                                      #generates a pyglet sprite out of the image
-
-BLOCK_WIDTH = block.width                                                       #gets the width dimension from the actual width of the block image previously loaded
-BLOCK_HEIGHT = block.height                                                     #gets the width dimension from the actual width of the block image previously loaded
+MAX_WINDOW_WIDTH = 800                                                          #larger boards are shown through a scrolling viewport
+MAX_WINDOW_HEIGHT = 800
+SCROLL_ROWS = 3                                                                 #rows scrolled by a step of the mouse wheel
+GAME_MOTIONS = (engine.MOTION_LEFT, engine.MOTION_RIGHT, engine.MOTION_UP, engine.MOTION_DOWN)
 
-window = pyglet.window.Window(width=BOARD_WIDTH*BLOCK_WIDTH,
-                              height=BOARD_HEIGHT*BLOCK_HEIGHT)                 #creates a new window with pylet using the width and height previous taken, along with accounting for the block size by multiplying by the block width or height
 
-class Shape(object):
+class BoardRenderer(object):
     """
-    The shape class is used to build each shape that the user might encounter in a game of tetris.
-    Performs various other operations on shapes, such as selecting, cloning, and rotating.
+    The board renderer draws a headless engine.Board into a pyglet window using the blocks of an assets.BlockAtlas.
+    It only draws the part of the board inside its viewport, keeping a sprite for each cell of the viewport rather than of
+    the board, so boards far larger than the window cost no more to draw than small ones. The viewport can be scrolled
+    and zoomed, and by default follows the active shape. Only the sprites of rows the board reports as changed, and that
+    are in view, are updated, so the cost of a frame does not grow with the number of filled cells. The active shape is
+    drawn by its own four sprites, and the ghost showing where it will land by four faint ones.
     """
-    #Array of 6 different types of shapes that a user may recieve randomly at each iteration of the game.
-    _shapes = [
-        [[0, 1, 0, 0], [0, 1, 0, 0], [0, 1, 0, 0], [0, 1, 0, 0]],
-        [[0, 0, 0, 0], [0, 1, 1, 0], [0, 1, 1, 0], [0, 0, 0, 0]],
-        [[0, 0, 0, 0], [0, 1, 0, 0], [1, 1, 1, 0], [0, 0, 0, 0]],
-        [[0, 0, 0, 0], [0, 0, 1, 0], [0, 0, 1, 0], [0, 1, 1, 0]],
-        [[0, 0, 0, 0], [0, 0, 1, 0], [0, 1, 1, 0], [0, 1, 0, 0]],
-        [[0, 0, 0, 0], [0, 1, 0, 0], [0, 1, 1, 0], [0, 0, 1, 0]],
-    ]
-    
-    def __init__(self, x=0, y=0):
-        """
-        x: x coordinate of the shape with a default value of 0 
-        y: y coordinate of the shape with a default value of 0 
-        """
-        self.shape = random.choice(self._shapes)                                #Selects a random shape from the preset array of shapes
-        self.shape = self.copy_shape()                                          #Sets the current shape of the object
-
-        for i in range(random.choice(range(4))):
-            self.rotate()                                                       #Select a random orientation for the shape
-
-        self.x = x
-        self.y = y
-
-    def copy_shape(self):
-        """
-        Returns an array with the copy of the current shape selected for the object.
-        """
-        new_shape = []
-        for row in self.shape:                                                  #iterates over each element in the array 'shape'
-            new_shape.append(row[:])                                            #Appends each row of the original shape, to the copied shape
-        return new_shape
-    
-    def clone(self):
-        """
-        Creates a object of the Shape class and copies the current shape to create a copy of itself.
-        """
-        cloned = Shape()                                                        #cloned: holds the new shape to be returned
-        cloned.shape = self.copy_shape()                                        #the constructor selects a random shape, but a copy overwrites it
-        cloned.x = self.x
-        cloned.y = self.y
-        return cloned
-    
-    def rotate(self):
-        """
-        Rotates the shape to change it's orientation when the shape is generated or when the user rotates it.
-        """
-        new_shape = self.copy_shape()                                           #new_shape: a temporary variable that holds a copy of the current shape in order to not overwrite it until the rotation is complete
-        for j in range(0, 4):
-            for i in range(0, 4):
-                new_shape[i][j] = self.shape[4 - j - 1][i]                      #rotate the matrix holding the shape
-        self.shape = new_shape                                                  #replaces the current shape with the new rotated shape
+    ghost_opacity = 64                                                          #the ghost is drawn as a faint copy of the active shape
+    min_scale = 0.25                                                            #the furthest the viewport zooms out, a quarter of the block image's size
+    max_scale = 4.0
+
+    def __init__(self, board, atlas=None, x=0, y=0, batch=None, width=None, height=None, scale=1.0):
+        """
+        board: the engine.Board to draw
+        atlas: the assets.BlockAtlas the blocks are drawn from, by default the one shared by every board
+        x, y: the bottom left corner of the board within the window, so several boards can share one window
+        batch: a pyglet batch shared with other boards, by default the renderer draws its own
+        width, height: the size of the viewport in pixels, by default large enough for the whole board
+        scale: the zoom of the viewport, the size cells are drawn at relative to the block image
+        """
+        self.board = board
+        self.atlas = atlas or assets.block_atlas()                              #built on first use, then shared with every other board and window
+        block = self.atlas
+        self.x, self.y = x, y
+        self.scale = scale
+        #the size of the viewport, by default the whole board so the window can display all blocks
+        self.calculated_height = height or int(self.board.height * block.height * scale)
+        self.calculated_width = width or int(self.board.width * block.width * scale)
+        self.first_row = self.first_col = 0                                     #the board cell shown in the top left corner of the viewport
+        self.follow = True                                                      #keep the active shape in view, until the viewport is scrolled by hand
+
+        self.owns_batch = batch is None
+        self.batch = batch or pyglet.graphics.Batch()
+        self.board_group = pyglet.graphics.OrderedGroup(0)                      #the locked blocks are drawn first
+        self.ghost_group = pyglet.graphics.OrderedGroup(1)                      #then the ghost showing where the active shape will land
+        self.shape_group = pyglet.graphics.OrderedGroup(2)                      #and the active shape on top of them
+
+        self.cells = []                                                         #a sprite for each cell of the viewport, hidden while the cell it shows is empty
+        self.shape_sprites = [self.make_sprite(0, 0, self.shape_group) for i in range(4)]
+        self.ghost_sprites = [self.make_sprite(0, 0, self.ghost_group) for i in range(4)]
+        for sprite in self.ghost_sprites:
+            sprite.opacity = self.ghost_opacity
+        self.shape_state = None                                                 #kind, rotation and position of the active shape when its sprites were last moved
+
+        self.board.push_handlers(self)
+        self.build_cells()
 
     @property
-    def left_edge(self):
+    def cell_width(self):
+        return self.atlas.width * self.scale
+
+    @property
+    def cell_height(self):
+        return self.atlas.height * self.scale
+
+    @property
+    def visible_rows(self):
         """
-        Tests if the shape is on a left edge, returns the coordinate of the left edge if found.
+        The number of board rows the viewport shows, counting one cut off at its edge.
         """
-        for x in range(0, 4):                                                   #Test points from left (0) to right(4)
-            for y in range(0, 4):                                               #Test points from bottom (0) to top (3)
-                if self.shape[y][x] == BLOCK_FULL:                              #if left edge is found
-                    return x                                                    #If the left block is a full block, then return the x coordinate of the full block
+        return min(self.board.height, -(-self.calculated_height // int(self.cell_height)))
 
     @property
-    def right_edge(self):
+    def visible_cols(self):
+        return min(self.board.width, -(-self.calculated_width // int(self.cell_width)))
+
+    def make_sprite(self, x, y, group):
         """
-        Tests if the shape is on a right edge, returns coordinate if found.
+        Creates a hidden block sprite for cell x, y of the board
         """
-        for x in range(3, -1, -1):                                              #test x values 3, 2, 1, 0, going from right (3) to left (0)
-            for y in range(0, 4):                                               #test y values from bottom (0) to top (3)
-                if self.shape[y][x] == BLOCK_FULL:                              #if right edge is found
-                    return x                                                    #return the x coordinate of the first right edge block found
+        sprite = pyglet.sprite.Sprite(self.atlas.block, *self.cell_position(x, y), batch=self.batch, group=group)
+        sprite.scale = self.scale
+        sprite.visible = False
+        return sprite
 
-    @property
-    def bottom_edge(self):
+    def build_cells(self):
         """
-        Test if the shape in a bottom edge, returns the coordinate if found
+        Creates the sprites of the viewport's cells, after it was created, resized or zoomed.
         """
-        for y in range(3, -1, -1):                                              #test x values 3, 2, 1, 0, going from right (3) to left (0)
-            for x in range(0, 4):                                               #test y values from bottom (0) to top (3)
-                if self.shape[y][x] == BLOCK_FULL:                              #if right edge is found
-                    return y                                                    #return the y coordinate of the first bottom edge block found
+        for sprite in [sprite for row in self.cells for sprite in row]:
+            sprite.delete()
+        self.scroll_to(self.first_row, self.first_col, refresh=False)           #a larger viewport may no longer fit where it was
+        self.cells = [[self.make_sprite(self.first_col + col, self.first_row + row, self.board_group)
+                       for col in range(self.visible_cols)] for row in range(self.visible_rows)]
+        for sprite in self.shape_sprites + self.ghost_sprites:
+            sprite.scale = self.scale
+        self.refresh()
 
+    def cell_position(self, x, y):
+        """
+        Returns the window coordinates of cell x, y of the board
+        """
+        y += 1 - self.first_row # since calculated_height does not account for 0-based index
+        return self.x + (x - self.first_col) * self.cell_width, self.y + self.calculated_height - y * self.cell_height
+
+    def refresh(self):
+        """
+        Updates every sprite in the viewport, after it has moved.
+        """
+        self.on_rows_changed(self.first_row, self.first_row + self.visible_rows - 1)
+
+    def on_rows_changed(self, first, last):
+        """
+        Shows or hides the sprites of the rows from first to last that are in view, to match the board.
+        """
+        first_col = self.first_col
+        last_col = first_col + self.visible_cols
+        for y in range(max(first, self.first_row), min(last, self.first_row + self.visible_rows - 1) + 1):
+            for sprite, col in zip(self.cells[y - self.first_row], self.board.row(y, first_col, last_col)):
+                visible = col == BLOCK_FULL or col == BLOCK_ACTIVE
+                if sprite.visible != visible:                                   #only touch the sprites that changed
+                    sprite.visible = visible
+        self.shape_state = None                                                 #the ghost may land somewhere else now
+
+    def scroll_to(self, first_row, first_col, refresh=True):
+        """
+        Moves the viewport to show first_row and first_col in its top left corner, as far as the board allows.
+        """
+        first_row = max(0, min(first_row, self.board.height - self.visible_rows))
+        first_col = max(0, min(first_col, self.board.width - self.visible_cols))
+        if (first_row, first_col) != (self.first_row, self.first_col):
+            self.first_row, self.first_col = first_row, first_col
+            if refresh:
+                self.refresh()
+
+    def scroll(self, rows, cols=0):
+        """
+        Scrolls the viewport by a number of rows and columns, which stops it following the active shape.
+        """
+        self.follow = False
+        self.scroll_to(self.first_row + rows, self.first_col + cols)
+
+    def zoom(self, factor):
+        """
+        Zooms the viewport in or out by factor, keeping the cell in its middle where it was.
+        """
+        scale = max(self.min_scale, min(self.max_scale, self.scale * factor))
+        if scale == self.scale:
+            return
+        middle_row = self.first_row + self.visible_rows // 2
+        middle_col = self.first_col + self.visible_cols // 2
+        self.scale = scale
+        self.first_row = middle_row - self.visible_rows // 2
+        self.first_col = middle_col - self.visible_cols // 2
+        self.build_cells()
+
+    def resize(self, width, height):
+        """
+        Changes the size of the viewport in pixels, to fit a resized window.
+        """
+        if (width, height) != (self.calculated_width, self.calculated_height):
+            self.calculated_width, self.calculated_height = width, height
+            self.build_cells()
+
+    def follow_shape(self, shape):
+        """
+        Scrolls the viewport to the active shape if it has left it, leaving some room below it to see where it lands.
+        """
+        rows, cols = self.visible_rows, self.visible_cols
+        first_row, first_col = self.first_row, self.first_col
+        if shape.y < first_row or shape.y + shape.bottom_edge >= first_row + rows:
+            first_row = shape.y - rows // 3
+        if shape.x + shape.left_edge < first_col or shape.x + shape.right_edge >= first_col + cols:
+            first_col = shape.x - cols // 2
+        self.scroll_to(first_row, first_col)
+
+    def in_view(self, x, y):
+        return self.first_col <= x < self.first_col + self.visible_cols and self.first_row <= y < self.first_row + self.visible_rows
+
+    def update_shape(self):
+        """
+        Moves the sprites of the active shape and its ghost to their current positions, if the shape has moved since the last frame.
+        """
+        shape = self.board.active_shape
+        state = (shape.kind, shape.rotation, shape.x, shape.y)
+        if state == self.shape_state:
+            return
+        if self.follow:
+            self.follow_shape(shape)
+        if self.shape_state is None or self.shape_state[0] != shape.kind:
+            variant = self.atlas.variant(shape.kind)                            #the shape and its ghost are drawn in the colour of its kind
+            for sprite in self.shape_sprites + self.ghost_sprites:
+                sprite.image = variant
+        self.shape_state = state
+        ghost_y = self.board.drop_y(shape)                                      #found from the board's column index, without stepping the shape down
+        for sprite, ghost, (x, y) in zip(self.shape_sprites, self.ghost_sprites, shape.cells):
+            sprite.position = self.cell_position(x + shape.x, y + shape.y)
+            sprite.visible = self.in_view(x + shape.x, y + shape.y)
+            ghost.position = self.cell_position(x + shape.x, y + ghost_y)
+            #hidden once it is covered by the shape itself, or when it lands out of view
+            ghost.visible = ghost_y != shape.y and y + ghost_y >= 0 and self.in_view(x + shape.x, y + ghost_y)
 
-class Board(pyglet.event.EventDispatcher):
-    """
-    The board class is used for the game board containing the shapes.
-    Allows for various board operations, such as resetting the game, adding shapes, and collision detection.
-    """
-    #variables used to keep track of the current shape, the next shape, and the board matrix
-    active_shape = None
-    pending_shape = None
-    board = None
-    
-    def __init__(self, width, height, block):
-        """
-        Initializes the board with the height, and width, and begins a new game.
-        """
-        self.width, self.height = width, height                                 #sets the height and width of the game board
-        self.block = block                                                      #sets the block sprite for the board based on the image file loaded previously
-        self.calculated_height = self.height * BLOCK_HEIGHT                     #the calculated height accounts for the height of the block, so that the window can display all blocks
-        self.calculated_width = self.width * BLOCK_WIDTH                        #calculated width accounts for the width of the block
-        self.reset()                                                            #clears the board, and starts a new game
-    
-    def reset(self):
-        """
-        Clears the board and starts a new game
-        """
-        self.board = []                                                         #sets the board to be an empty board
-        for row in range(self.height):                                          #For each row in the board where the number of rows = height
-            self.board.append([0] * self.width)                                 #Set each row to be an array of 0s
-        
-        self.pending_shape = Shape()                                            #get the next shape to add to the board (random)
-        self.add_shape()                                                        #calls the add_shape method to add the new shape to the window
-
-    def add_shape(self):
-        """
-        Adds a new shape to the window, and sets it as the current active shape
-        """
-        self.active_shape = self.pending_shape.clone()                          #sets the current active shape to be the preselected pending shape
-        self.active_shape.x = self.width // 2 - self.active_shape.left_edge     #sets the shape to be in the middle of the x axis of the board
-        self.active_shape.y = -1                                                #sets the y coordinate of the shape to be the top of the screen
-        self.pending_shape = Shape()                                            #create a new random pending shape to send out next
-        
-        if self.is_collision():                                                 #checks if the blocks hit the top of the the window
-            self.reset()                                                        #If so, the game ends, and resets
-            self.dispatch_event('on_game_over')                                 #the on_game_over event will reset the game
-    
-    def rotate_shape(self):
-        """
-        Rotates the active shape
-        """
-        rotated_shape = self.active_shape.clone()                               #works on a copy of the active shape
-        rotated_shape.rotate()                                                  #rotate once using the rotate method on Shape
-
-        if rotated_shape.left_edge + rotated_shape.x < 0:
-            rotated_shape.x = -rotated_shape.left_edge
-        elif rotated_shape.right_edge + rotated_shape.x >= self.width:
-            rotated_shape.x = self.width - rotated_shape.right_edge - 1
-        
-        if rotated_shape.bottom_edge + rotated_shape.y > self.height:
-            return False
-        
-        if not self.is_collision(rotated_shape):                                #if no collision is detected on the rotated shape
-            self.active_shape = rotated_shape                                   #set the new rotated shape to be the active shape
-    
-    def move_left(self):
-        """
-        Moves the active shape left if possible, and returns true. If it is not possible to move, then returns False.
-        """
-        self.active_shape.x -= 1                                                #moves the shape by 1 unit to the left
-        if self.out_of_bounds() or self.is_collision():                         #checks if the move causes the shape to collide with another shape or go out of bounds
-            self.active_shape.x += 1                                            #if there is a collision or it goes out of bounds, then reset the shape back to it's previous position
-            return False                                                        #return false if it is not possible to move left
-        return True                                                             #return true if it is possible to move left
-    
-    def move_right(self):
-        """
-        Moves the active shape right if possible, and returns true. If it is not possible to move, then returns False.
-        """
-        self.active_shape.x += 1                                                #moves the shape by 1 unit to the right
-        if self.out_of_bounds() or self.is_collision():                         #checks if the move causes the shape to collide with another shape or go out of bounds
-            self.active_shape.x -= 1                                            #if there is a collision or it goes out of bounds, then reset the shape back to it's previous position
-            return False                                                        #return false if it is not possible to move right
-        return True                                                             #return true if it is possible to move right
-    
-    def move_down(self):
-        """
-        Moves the active shape down if possible, and returns true. If it is not possible to move, then returns False.
-        """
-        self.active_shape.y += 1                                                #moves the shape by 1 unit down
-        
-        if self.check_bottom() or self.is_collision():                          #Checks if the new position of the shape causes the shape to hit to the bottom or cause a collision
-            self.active_shape.y -= 1                                            #if so, reset back to the original position of the shape
-            self.shape_to_board()                                               #add shape to permant location on the board
-            self.add_shape()                                                    #add a new shape, as the current one has hit the bottom
-            return False                                                        #return false because the move was not possible
-        return True                                                             #return true because the move was possible
-    
-    def out_of_bounds(self, shape=None):
-        """
-        Checks if the shape has gone out of bounds on the two sides of the board
-        """
-        shape = shape or self.active_shape                                      #check the shape that gets passed in, or by default the currently selected shape
-        if shape.x + shape.left_edge < 0:                                       #check for the shape going off the left side of the board
-            return True                                                         #return true if it does
-        elif shape.x + shape.right_edge >= self.width:                          #check for the shape going off the of the right side of the board
-            return True                                                         #return true if it does
-        return False                                                            #if the shape does not go out of the left and right bounds, then return false
-    
-    def check_bottom(self, shape=None):
-        """
-        Checks if the shape has hit the bottom of the board.
-        """
-        shape = shape or self.active_shape                                      #the shape to be checked if not passed in, will be the current shape for the board
-        if shape.y + shape.bottom_edge >= self.height:                          #if the shape has hit the bottom, or goes lower than the bottom of the board
-            return True                                                         #return true as the shape is at the bottom
-        return False                                                            #return false as the shape has not hit the bottom
-    
-    def is_collision(self, shape=None):
-        """
-        Check if a shape has collide with other shapes that are transposed onto the board.
-        """
-        shape = shape or self.active_shape                                      #checks the current shape or a user specified shape
-        for y in range(4):                                                      #range from the bottom of a shape (0) to the top (3)
-            for x in range(4):                                                  #range from the left of a shape (0) to the right (3)
-                if y + shape.y < 0:                                             #
-                    continue                                                    #skip this iteration of the loop
-                if shape.shape[y][x] and self.board[y + shape.y][x + shape.x]:  #if a point on the shape collides with a transposed shape on the board
-                    return True                                                 #return true as there is a collision
-        return False                                                            #return false as there is no collision detected
-    
-    def test_for_line(self):
-        """
-        Test is there is a full row, if so then the row can be removed
-        """
-        for y in range(self.height - 1, -1, -1):                                #loop from the top the of the board (self.height-1) to the bottom of the board (0)
-            counter = 0                                                         #use a counter to keep track of how many blocks are encountered in each row
-            for x in range(self.width):                                         #loop through each block in the current row
-                if self.board[y][x] == BLOCK_FULL:                              #if there exists a block in that cell
-                    counter += 1                                                #then increment the counter to indicate that there is a block in that cell
-            if counter == self.width:                                           #check if the number of blocks within the row are equal to the number of cells in the row, if yes the row is full
-                self.process_line(y)                                            #remove the current row, and move all lines above it down one line
-                return True                                                     #return true as a line was found
-        return False                                                            #return false as a line was not found after looping through all cells within the board
-    
-    def process_line(self, y_to_remove):
-        """
-        Removed a row based on the row value provided in the argument by moving all over rows above it it down by one unit.
-        """
-        for y in range(y_to_remove - 1, -1, -1):                                #loop from the the row to remove, and iterate down to 0
-            for x in range(self.width):                                         #process each block within that row
-                self.board[y + 1][x] = self.board[y][x]                         #overwrite the previous row
-    
-    def shape_to_board(self):
-        # transpose onto board
-        # while test for line, process & increase score
-        for y in range(4):                                                      #loop through y coordinates in the shape, from bottom(0) to top(3)
-            for x in range(4):                                                  #loop through y coordinates in the shape, from left(0) to right(3)
-                dx = x + self.active_shape.x                                    #calculate the for where the x coordinate will lie on the board
-                dy = y + self.active_shape.y                                    #calculate the for where the x coordinate will lie on the board
-                if self.active_shape.shape[y][x] == BLOCK_FULL:                 #if the the current block is a filled block
-                    self.board[dy][dx] = BLOCK_FULL                             #then transpose it onto the board
-        
-        lines_found = 0                                                         #checks the number of lines found on the board to keep track of the score
-        while self.test_for_line():                                             #uses the line test function to find all lines and remove them
-            lines_found += 1                                                    #when lines are found, increase the player score by 1
-        
-        if lines_found:                                                         #if the players score increased
-            self.dispatch_event('on_lines', lines_found)                        #then update the score
-
-    def move_piece(self, motion_state):
-        """
-        Defines a set of keyboard events to perform actions on the shape within the game.
-        """
-        if motion_state == key.MOTION_LEFT:                                     #listens for the left arrow key
-            self.move_left()                                                    #move the shape left by one unit if possible
-        elif motion_state == key.MOTION_RIGHT:                                  #listens for the right arrow key
-            self.move_right()                                                   #move the shape right by one unit if possible
-        elif motion_state == key.MOTION_UP:                                     #listens for the up arrow key
-            self.rotate_shape()                                                 #rotate the shape clockwise by 90 degrees
-        elif motion_state == key.MOTION_DOWN:                                   #listens for the down arrow key
-            self.move_down()                                                    #move the shape down by one unit if possible
-    
     def draw_game_board(self):
         """
-        Draws the game board at each frame based on the values of the current board matrix.
+        Draws the game board, only the active shape needs updating before the batch is drawn.
         """
-        for y, row in enumerate(board.board):                                   #loop over each row within the board
-            for x, col in enumerate(row):                                       #loop ovr each column at each row to select each cell at y, x
-                if col == BLOCK_FULL or col == BLOCK_ACTIVE:                    #check if the current column has an stationary block (FULL) or a moving block (ACTIVE)
-                    self.draw_block(x, y)                                       #if a block exists, then draw the block on the screen using the x y coordinates provided by the loop
-        
-        for y in range(4):                                                      #
-            for x in range(4):
-                dx = x + self.active_shape.x
-                dy = y + self.active_shape.y
-                if self.active_shape.shape[y][x] == BLOCK_FULL:
-                    self.draw_block(dx, dy)
-    
-    def draw_block(self, x, y):
+        self.update_shape()
+        if self.owns_batch:
+            self.batch.draw()                                                   #a shared batch is drawn once by its owner for all of its boards
+
+    def delete(self):
         """
-        Draws a block onto the screen using the blit method in pyglet
+        Stops listening to the board and frees the sprites
         """
-        y += 1 # since calculated_height does not account for 0-based index
-        self.block.blit(x * BLOCK_WIDTH, self.calculated_height - y * BLOCK_HEIGHT)
+        self.board.remove_handlers(self)
+        for sprite in self.shape_sprites + self.ghost_sprites + [sprite for row in self.cells for sprite in row]:
+            sprite.delete()
+
+
+class ChangeDrivenEventLoop(pyglet.app.EventLoop):
+    """
+    An event loop that only redraws the windows with their invalid flag set.
+    The default loop redraws every window after every scheduled function, even when nothing on screen has changed.
+    """
+    def idle(self):
+        dt = self.clock.update_time()
+        self.clock.call_scheduled_functions(dt)
 
+        for window in pyglet.app.windows:
+            if window.invalid:                                                  #set by the game when its state changes, or by the window being exposed or resized
+                window.switch_to()
+                window.dispatch_event('on_draw')
+                window.flip()
+
+        return self.clock.get_sleep_time(True)
+
+
+class GameWindow(pyglet.window.Window):
+    """
+    A window that dispatches on_presented once each frame has been flipped onto the screen, whichever event loop flips it.
+    """
+    event_types = pyglet.window.Window.event_types + ['on_presented']           #a list of its own, so plain windows are left as they are
 
-Board.register_event_type('on_lines')                                           #event listener to update score and increase difficulty
-Board.register_event_type('on_game_over')                                       #event listener to check for a game over
+    def flip(self):
+        super(GameWindow, self).flip()
+        self.dispatch_event('on_presented')                                     #the frame has been handed to the display, which ends the latency of the inputs it shows
 
 
-class Game(object):
+class Game(engine.Game):
     """
-    The game class puts together the other two classes, and contains functionality to run the game loop, handle keyboard events, and update the window title with the user score.
+    Runs an engine.Game inside a pyglet window, drawing the board and showing the score in the window title.
     """
-    ticks = 0
-    factor = 4
-    frame_rate = 60.0                                                           #the game window will update 60 times a second for a framerate of 60fps
-    
-    is_paused = False
-    
-    def __init__(self, window_ref, board, starting_level=1):
+    def __init__(self, window_ref, board, atlas=None, starting_level=1):
         """
-        Constructor: sets up the window, the board, and the callback functions
+        Constructor: sets up the window, the board renderer, and the game itself
         """
         self.window_ref = window_ref                                            #sets the specifications for the window and creates it
-        self.board = board                                                      #Sets the default game board
-        self.starting_level = int(starting_level)                               #if the starting level is specified by the user, set it manually
-        self.register_callbacks()                                               #register callback functions for
-        self.reset()
-    
-    def register_callbacks(self):
-        """ Sets up the callback functions for drawing, and keyboard """
-        self.board.push_handlers(self)                                          #pushes event handlers onto the stack (drawing, and keyboard)
-    
-    def reset(self):
-        """
-        Resets the current game, but setting the start level back to the start level specified by the user, and reseting the score.
-        """
-        self.level = self.starting_level
-        self.lines = 0
-        self.score = 0
-    
-    def should_update(self):
-        if self.is_paused:                                                      #check if the game is currently paused
-            return False                                                        #if paused, don't update board
-        
-        self.ticks += 1
-        if self.ticks >= (self.frame_rate - (self.level * self.factor)):
-            self.ticks = 0
-            return True
-        return False
-    
+        self.renderer = BoardRenderer(board, atlas, width=window_ref.width,
+                                      height=window_ref.height)                 #draws the part of the board that fits in the window using the shared block atlas
+        super(Game, self).__init__(board, starting_level)
+        self.presenting = []                                                    #traced inputs shown by the frame being drawn, until it is presented
+        self.updated = time.perf_counter()                                      #when update last ran, as pressing a key moves the next update forward
+
+    overlay = None                                                              #a profiler.Overlay drawn over the board, set by toggle_profiler
+
     def draw_handler(self):
+        profiler = self.profiler
+        if profiler is not None:
+            start = time.perf_counter()
         self.window_ref.clear()                                                 #Clears the screen
-        self.board.draw_game_board()                                            #draws the game board, which can be called at every frame to animate the application
-    
+        self.renderer.draw_game_board()                                         #draws the game board, which can be called at every frame to animate the application
+        if self.overlay is not None:
+            self.overlay.draw()
+        self.mark_drawn()
+        self.window_ref.invalid = False                                         #nothing needs drawing until the game changes again
+        self.presenting[:] = self.traced                                        #this frame is the first to show these inputs, those of a frame never presented are dropped
+        self.traced.clear()
+        if profiler is not None:
+            profiler.record_frame('frame', time.perf_counter() - start)
+
+    def on_presented(self):
+        """
+        Records the latency of every traced input shown by the frame just presented, from its key press to now.
+        """
+        if self.presenting:
+            now = time.perf_counter()
+            if self.profiler is not None:
+                for trace, pressed, applied in self.presenting:
+                    self.profiler.record_input(trace, pressed, applied, now)
+            del self.presenting[:]
+
+    def toggle_profiler(self):
+        """
+        Shows or hides the profiler overlay, starting to profile the first time it is shown.
+        """
+        if self.profiler is None:
+            self.set_profiler(Profiler())
+        if self.overlay is None:
+            self.overlay = Overlay(self.window_ref, self.profiler)
+        self.overlay.toggle()
+
+    def invalidate(self):
+        """
+        Asks for the window to be redrawn if the game has changed since it was last drawn.
+        """
+        if self.needs_redraw:
+            self.window_ref.invalid = True
+
     def keyboard_handler(self, motion):
-        self.board.move_piece(motion)                                           #sets up the keyboard handler, by passing the key values into the board keyboard function
-    
-    def on_lines(self, num_lines):
-        """
-        Sets the score and current level;
-        """
-        self.score += (num_lines * self.level)                                  #the score per line increases as the level increase
-        self.lines += num_lines
-        if self.lines / 10 > self.level:
-            self.level = self.lines / 10                                        #Set the level one the user reaches level * 10 lines
-    
-    def on_game_over(self):
-        self.reset()                                                            #reset the game on game overs
-    
-    def cycle(self):
-        if self.should_update():                                                #cycles through the game as long as it is not paused
-            self.board.move_down()                                              #start moving shapes down if the game is not paused
-            self.update_caption()                                               #set the score in the window title at each frame
-    
-    def toggle_pause(self):
-        self.is_paused = not self.is_paused                                     #pause or unpause the game
-    
-    def update_caption(self):
-        self.window_ref.set_caption('Tetris - %s lines [%s]' % (self.lines, self.score)) #sets the window title to be the number of lines and the current score
+        super(Game, self).keyboard_handler(motion)
+        self.invalidate()
 
+    def press(self, motion, timestamp=None):
+        """
+        Queues a key press and runs the next update straight away, so the input is applied before the next frame is drawn.
+        """
+        trace = super(Game, self).press(motion, timestamp)
+        self.schedule()
+        return trace
 
-board = Board(BOARD_WIDTH, BOARD_HEIGHT, block)                                 #create a board with the specified height, width, and the block image
+    def release(self, motion, timestamp=None):
+        trace = super(Game, self).release(motion, timestamp)
+        self.schedule()
+        return trace
 
-if len(sys.argv) > 1:
-    starting_level = int(sys.argv[1])                                           #set a custom level if it is given by the user
-else:
-    starting_level = 1                                                          #if a custom level is not set, then start at level 1
+    def toggle_pause(self):
+        super(Game, self).toggle_pause()
+        self.updated = time.perf_counter()                                      #time spent paused is not played
+        self.schedule()                                                         #stops gravity while paused, and restarts it on resume
+        self.invalidate()
 
-game = Game(window, board, starting_level)                                      #start a new game using the board and specified starting level
+    def cycle(self, dt=None):
+        if super(Game, self).cycle(dt):                                         #moves the active shape down when the game is due an update
+            self.update_caption()                                               #set the score in the window title at each frame
+        self.invalidate()
 
-@window.event
-def on_draw():
-    game.draw_handler()                              x                           #sets the draw handling event for pyglet
+    def update(self, dt):
+        """
+        Applies the queued inputs and runs the gravity steps that are due, then schedules the next update.
+        dt is measured from the last update rather than taken from the clock, as a key press reschedules it early.
+        """
+        now = time.perf_counter()
+        self.cycle(now - self.updated)
+        self.updated = now
+        self.schedule()
 
-@window.event
-def on_text_motion(motion):
-    game.keyboard_handler(motion)                                               #sets the keyboard handling even for pyglet
+    def schedule(self):
+        """
+        Schedules update for when the next input, auto repeat or gravity step is due, instead of polling every frame.
+        Nothing is scheduled while paused unless inputs are waiting.
+        """
+        pyglet.clock.unschedule(self.update)
+        delays = [delay for delay in (self.time_until_gravity(), self.time_until_input()) if delay is not None]
+        if delays:
+            pyglet.clock.schedule_once(self.update, min(delays))
 
-@window.event
-def on_key_press(key_pressed, mod):
-    if key_pressed == key.P:
-        game.toggle_pause()                                                     #pauses the game using the 'P' key
+    def update_caption(self):
+        self.window_ref.set_caption('Tetris - %s lines [%s]' % (self.lines, self.score)) #sets the window title to be the number of lines and the current score
 
-def update(dt):
-    game.cycle()                                                                #runs an infinite game cycle
 
-pyglet.clock.schedule_interval(update, 1 / game.frame_rate)
-pyglet.app.run()
+class ReplayPlayer(object):
+    """
+    Plays a recorded game in the window, applying each event at the time it was recorded instead of running gravity.
+    """
+    def __init__(self, game, events):
+        """
+        game: the frontend Game, created from the replay's header
+        events: the (milliseconds, event) pairs read from the replay
+        """
+        self.game = game
+        self.events = events
+        self.position = 0
+
+    def schedule(self):
+        """
+        Schedules step for the time of the next event, if there is one left.
+        """
+        if self.position < len(self.events):
+            previous = self.events[self.position - 1][0] if self.position else 0
+            pyglet.clock.schedule_once(self.step, (self.events[self.position][0] - previous) / 1000.0)
+
+    def step(self, dt):
+        """
+        Applies every event recorded at the same time as the next one, then schedules the events after them.
+        """
+        now = self.events[self.position][0]
+        while self.position < len(self.events) and self.events[self.position][0] == now:
+            replay.apply_event(self.game, self.events[self.position][1])
+            self.position += 1
+        self.game.update_caption()
+        self.game.invalidate()
+        self.schedule()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog=argv[0], description=__module_description__)
+    parser.add_argument('level', nargs='?', type=int, default=1,
+                        help='the level to start at')
+    parser.add_argument('--seed', type=engine.parse_seed,
+                        help='seed for the shapes, so the same seed always deals the same game')
+    parser.add_argument('--randomizer', choices=sorted(engine.RANDOMIZERS), default='uniform',
+                        help='deal shapes uniformly at random, or from a shuffled bag of every shape')
+    parser.add_argument('--record', metavar='FILE',
+                        help='record the game to FILE, see replay.py')
+    parser.add_argument('--replay', metavar='FILE',
+                        help='play back a game recorded to FILE instead of playing')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='profile the game and save the timings to FILE on exit, F3 shows them while playing')
+    parser.add_argument('--width', type=int, default=BOARD_WIDTH,
+                        help='width of the board in cells, up to %d' % engine.MAX_BOARD_WIDTH)
+    parser.add_argument('--height', type=int, default=BOARD_HEIGHT,
+                        help='height of the board in cells, up to %d; boards larger than the window scroll' % engine.MAX_BOARD_HEIGHT)
+    parser.add_argument('--das', type=float, metavar='MS',
+                        help='repeat held movement keys in the game, after a delayed auto shift of MS milliseconds, '
+                             'instead of at the rate the keyboard repeats them')
+    parser.add_argument('--arr', type=float, default=33.0, metavar='MS',
+                        help='milliseconds between auto repeats once they start, 0 moves as far as the shape goes; with --das')
+    parser.add_argument('--startup-report', metavar='FILE', nargs='?', const='-',
+                        help='time the imports, loading the assets and the first frame, then exit; '
+                             'prints the times, or saves them to FILE as JSON')
+    return parser.parse_args(argv[1:])
+
+
+def main(argv, redraw_on_change=True):
+    """
+    Opens the window and runs a game, starting at the level given as the first argument, or plays back a recorded game.
+    redraw_on_change: only redraw the window when the game changes, instead of after every update
+    """
+    startup = StartupReport(IMPORT_STARTED)
+    startup.mark('import')
+    args = parse_args(argv)
+
+    if args.replay:
+        with open(args.replay, 'rb') as f:
+            header, events, footer = replay.read(f.read())
+        width, height, seed, starting_level = header.width, header.height, header.seed, header.starting_level
+        randomizer = header.randomizer
+    else:
+        width, height, seed, starting_level = args.width, args.height, args.seed, args.level
+        randomizer = args.randomizer
+
+    board = Board(width, height, seed, randomizer)                              #create a board with the specified height and width
+
+    block = assets.cache.image(assets.BLOCK_IMG_FILE)                           #only the block's size is needed before there is a window to make textures in
+    window = GameWindow(width=min(width*block.width, MAX_WINDOW_WIDTH),
+                        height=min(height*block.height, MAX_WINDOW_HEIGHT),
+                        resizable=True)                                         #creates a new window with pylet large enough for the whole board, or as large as fits on screen for boards that have to scroll
+    startup.mark('window', assets.cache.load_time)                              #decoding the block image counts towards the assets
+    atlas = assets.block_atlas()                                                #the shape colours are tinted into one texture, once per process
+    startup.mark('assets')
+
+    game = Game(window, board, atlas, starting_level)                           #start a new game using the board and specified starting level
+    startup.mark('game')
+    recorder = None
+    if args.record:
+        recorder = replay.Recorder(game, open(args.record, 'wb'))
+    if args.profile:
+        game.set_profiler(Profiler())
+    if args.das is not None:
+        game.auto_repeat = engine.AutoRepeat(args.das / 1000.0, args.arr / 1000.0)
+
+    def started(dt):
+        startup.mark('first frame')                                             #scheduled by the first draw, so it runs once that frame has been flipped onto the screen
+        if args.startup_report:
+            if args.startup_report == '-':
+                print('\n'.join(startup.report()))
+            else:
+                with open(args.startup_report, 'w') as f:
+                    json.dump(startup.summary(), f, indent=2)
+            pyglet.app.exit()
+
+    def on_first_draw():
+        window.remove_handler('on_draw', on_first_draw)
+        pyglet.clock.schedule_once(started, 0)
+
+    @window.event
+    def on_draw():
+        game.draw_handler()                                                     #sets the draw handling event for pyglet
+    window.push_handlers(on_draw=on_first_draw)
+
+    @window.event
+    def on_presented():
+        game.on_presented()                                                     #ends the latency of the inputs the frame shows
+
+    @window.event
+    def on_expose():
+        window.invalid = True                                                   #the window contents were lost and have to be drawn again
+
+    @window.event
+    def on_resize(width, height):
+        game.renderer.resize(width, height)                                     #the viewport grows or shrinks with the window
+        window.invalid = True
+
+    @window.event
+    def on_key_release(key_released, mod):
+        if key_released in GAME_MOTIONS and game.auto_repeat is not None and not args.replay:
+            game.release(key_released)
+
+    @window.event
+    def on_mouse_scroll(x, y, scroll_x, scroll_y):
+        game.renderer.scroll(-int(scroll_y) * SCROLL_ROWS, int(scroll_x) * SCROLL_ROWS)
+        window.invalid = True
+
+    @window.event
+    def on_key_press(key_pressed, mod):
+        renderer = game.renderer
+        if key_pressed == key.P and not args.replay:
+            game.toggle_pause()                                                 #pauses the game using the 'P' key
+        elif key_pressed == key.SPACE and not args.replay:
+            game.press(engine.MOTION_DROP)                                      #drops the shape using the space bar
+        elif key_pressed in GAME_MOTIONS and game.auto_repeat is not None and not args.replay:
+            game.press(key_pressed)                                             #the engine repeats the key while it is held, so the keyboard's own repeats are ignored
+            return
+        elif key_pressed == key.F3:
+            game.toggle_profiler()                                              #shows the frame timings, also while replaying
+        elif key_pressed in (key.EQUAL, key.PLUS, key.NUM_ADD):
+            renderer.zoom(2.0)                                                  #zooms the viewport in and out by doubling or halving the size of the cells
+        elif key_pressed in (key.MINUS, key.NUM_SUBTRACT):
+            renderer.zoom(0.5)
+        elif key_pressed == key.PAGEUP:
+            renderer.scroll(-renderer.visible_rows)                             #scrolling by hand stops the viewport following the active shape
+        elif key_pressed == key.PAGEDOWN:
+            renderer.scroll(renderer.visible_rows)
+        elif key_pressed == key.HOME:
+            renderer.scroll(-board.height)
+        elif key_pressed == key.END:
+            renderer.scroll(board.height)
+        elif key_pressed == key.F:
+            renderer.follow = not renderer.follow                               #follows the active shape again, scrolling to it on its next move
+            renderer.shape_state = None
+        else:
+            return
+        window.invalid = True
+
+    if args.replay:
+        ReplayPlayer(game, events).schedule()                                   #the replay moves the shapes, so the keyboard and gravity are left off
+    else:
+        @window.event
+        def on_text_motion(motion):
+            if motion in GAME_MOTIONS and game.auto_repeat is None:
+                game.press(motion)                                              #queues the key for the next update, page and line motions scroll instead
+
+        game.schedule()                                                         #starts the gravity timer, which keeps scheduling itself
+
+    if redraw_on_change:
+        pyglet.app.event_loop = ChangeDrivenEventLoop()                         #pyglet.app.run uses whichever loop is installed here
+    pyglet.app.run()
+
+    if recorder is not None:
+        recorder.close()                                                        #finish the recording once the window is closed
+    if args.profile:
+        game.profiler.dump(args.profile)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,260 @@
+"""
+Headless tournaments.
+
+Plays many games at once across a pool of processes, each game with its own
+seed, starting level and controller, the bot or policy making its moves. The
+result of each game is written out as a line of JSON as soon as it finishes,
+and a summary of every game is written as the last line, so the output of a
+long tournament can be followed as it runs and read back with one json.loads
+per line.
+
+A controller is a class built with the engine.Game it plays and a
+random.Random seeded for it, whose update() is called once a frame before
+gravity, and which makes its moves through game.keyboard_handler or the board.
+Besides the CONTROLLERS below, any class can be named as module:Class.
+
+    python tournament.py [--games K] [--workers N] [--seed S] [--level L...] [--controller NAME...] [--output FILE]
+"""
+import argparse
+import collections
+import concurrent.futures
+import importlib
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+import engine
+from profiler import percentile
+
+__module_name__ = 'tournament'
+__module_description__ = 'plays many headless tetris games across a process pool'
+__version__ = (0, 1, 0)
+
+MOTIONS = (engine.MOTION_LEFT, engine.MOTION_RIGHT, engine.MOTION_UP, engine.MOTION_DOWN, engine.MOTION_DROP)
+
+#what one game of a tournament is played with
+GameSpec = collections.namedtuple('GameSpec', 'index seed level controller backend randomizer max_pieces')
+
+SUMMARY_FIELDS = ('lines', 'score', 'pieces', 'frames')                         #the per game results the summary gives statistics of
+
+
+class IdleController(object):
+    """
+    Makes no moves, leaving every shape to gravity, as a baseline.
+    """
+    def __init__(self, game, rng):
+        self.game = game
+
+    def update(self):
+        pass
+
+
+class RandomController(object):
+    """
+    Makes a random move every frame.
+    """
+    def __init__(self, game, rng):
+        self.game = game
+        self.random = rng
+
+    def update(self):
+        self.game.keyboard_handler(self.random.choice(MOTIONS))
+
+
+class AutoPlayController(object):
+    """
+    Places each shape where autoplay.AutoPlayer rates best, dropping it straight there.
+    """
+    depth = 1
+
+    def __init__(self, game, rng):
+        import autoplay
+        self.game = game
+        self.player = autoplay.AutoPlayer(game.board, depth=self.depth)
+
+    def update(self):
+        self.player.play()
+
+
+class LookaheadController(AutoPlayController):
+    """
+    AutoPlayController searching the pending shape as well.
+    """
+    depth = 2
+
+
+CONTROLLERS = {
+    'idle': IdleController,
+    'random': RandomController,
+    'autoplay': AutoPlayController,
+    'lookahead': LookaheadController,
+}
+
+
+def find_controller(name):
+    """
+    Returns the controller class for one of the CONTROLLERS, or for a module:Class name.
+    """
+    if name in CONTROLLERS:
+        return CONTROLLERS[name]
+    module, _, attribute = name.partition(':')
+    if not attribute:
+        raise ValueError('Unknown controller "%s"' % name)
+    return getattr(importlib.import_module(module), attribute)
+
+
+def play_game(spec):
+    """
+    Plays one game until its first game over or until max_pieces shapes have locked, and returns its result as a dict.
+    Runs in a worker process, so it only takes and returns things that can be pickled.
+    """
+    started, cpu_started = time.perf_counter(), time.process_time()
+    board = engine.new_board(backend=spec.backend, seed=spec.seed, randomizer=spec.randomizer)
+    game = engine.Game(board, spec.level)
+    controller = find_controller(spec.controller)(game, random.Random(spec.seed))
+    frame = 1 / game.frame_rate
+    frames = 0
+    totals = {'lines': 0, 'score': 0}
+    game_over = []
+    spawned = [board.pieces]                                                    #shapes spawned before the current call, as the board resets itself before on_game_over
+
+    def on_lines(num_lines, rows=()):
+        totals['lines'] += num_lines
+        totals['score'] += num_lines * game.level                               #scored as the game does, before a game over resets its score
+
+    def on_game_over():
+        game_over.append({'pieces': spawned[0], 'frame': frames, 'seconds': game.time})
+
+    board.push_handlers(on_lines=on_lines, on_game_over=on_game_over)
+    while board.pieces <= spec.max_pieces:
+        spawned[0] = board.pieces
+        controller.update()
+        if game_over:
+            break
+        spawned[0] = board.pieces
+        game.cycle(frame)
+        frames += 1
+        if game_over:
+            break
+
+    close = getattr(controller, 'close', None)
+    if close is not None:
+        close()
+    return {
+        'game': spec.index,
+        'seed': spec.seed,
+        'level': spec.level,
+        'controller': spec.controller,
+        'lines': totals['lines'],
+        'score': totals['score'],
+        'pieces': game_over[0]['pieces'] if game_over else board.pieces - 1,    #shapes locked, the last one spawned never locks
+        'frames': frames,
+        'seconds': game.time,
+        'game_over': game_over[0] if game_over else None,                       #None if the game was still going at max_pieces
+        'wall_seconds': time.perf_counter() - started,
+        'cpu_seconds': time.process_time() - cpu_started,
+    }
+
+
+def summarize(results):
+    """
+    Returns summary statistics of a list of game results, for every controller and level played and overall.
+    """
+    groups = collections.defaultdict(list)
+    for result in results:
+        groups['all'].append(result)
+        groups['%s@%d' % (result['controller'], result['level'])].append(result)
+    summary = {}
+    for name, group in sorted(groups.items()):
+        stats = {'games': len(group), 'games_over': sum(1 for result in group if result['game_over'])}
+        for field in SUMMARY_FIELDS:
+            values = sorted(result[field] for result in group)
+            stats[field] = {
+                'mean': statistics.fmean(values),
+                'stdev': statistics.pstdev(values),
+                'min': values[0],
+                'p50': percentile(values, .5),
+                'p95': percentile(values, .95),
+                'max': values[-1],
+            }
+        summary[name] = stats
+    return summary
+
+
+def game_specs(args):
+    """
+    Returns the GameSpec of each game, every seed being played by each controller at each level in turn.
+    """
+    combinations = [(controller, level) for controller in args.controller for level in args.level]
+    return [GameSpec(i, args.seed + i // len(combinations), combinations[i % len(combinations)][1],
+                     combinations[i % len(combinations)][0], args.backend, args.randomizer, args.max_pieces)
+            for i in range(args.games)]
+
+
+def run(args, output):
+    """
+    Plays the tournament, writing each result to output as it arrives and the summary last. Returns the summary.
+    """
+    specs = game_specs(args)
+    results = []
+    started = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(args.workers) as pool:
+        for future in concurrent.futures.as_completed([pool.submit(play_game, spec) for spec in specs]):
+            result = future.result()
+            results.append(result)
+            output.write(json.dumps(result, sort_keys=True) + '\n')
+            output.flush()                                                      #so results can be followed while the tournament runs
+    elapsed = time.perf_counter() - started
+
+    summary = summarize(results)
+    summary['all']['wall_seconds'] = elapsed
+    summary['all']['workers'] = args.workers
+    summary['all']['games_per_second'] = len(results) / elapsed
+    busy = sum(result['cpu_seconds'] for result in results)                     #the time one process would have taken
+    summary['all']['speedup'] = busy / elapsed
+    output.write(json.dumps({'summary': summary}, sort_keys=True) + '\n')
+    output.flush()
+    return summary
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog=argv[0], description=__module_description__)
+    parser.add_argument('--games', type=int, default=100, help='number of games to play')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of processes to play them in')
+    parser.add_argument('--seed', type=engine.parse_seed, default=0, help='seed of the first game, the rest follow on from it')
+    parser.add_argument('--level', type=int, nargs='+', default=[1], help='starting levels to play each seed at')
+    parser.add_argument('--controller', nargs='+', default=['autoplay'],
+                        help='controllers to play each seed with, from %s or as module:Class' % ', '.join(sorted(CONTROLLERS)))
+    parser.add_argument('--backend', choices=sorted(engine.BOARD_BACKENDS), default='bitboard')
+    parser.add_argument('--randomizer', choices=sorted(engine.RANDOMIZERS), default='uniform')
+    parser.add_argument('--max-pieces', type=int, default=1000, help='end a game that has not been lost after this many shapes')
+    parser.add_argument('--output', metavar='FILE', help='write the JSON lines to FILE instead of standard output')
+    args = parser.parse_args(argv[1:])
+    for name in args.controller:
+        find_controller(name)                                                   #fail before starting the pool, not in every worker
+    return args
+
+
+def main(argv):
+    args = parse_args(argv)
+    output = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        summary = run(args, output)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    overall = summary['all']
+    for name, stats in sorted(summary.items()):
+        sys.stderr.write('%-20s %4d games %4d lost  lines %8.1f  score %9.1f  pieces %8.1f\n' % (
+            name, stats['games'], stats['games_over'], stats['lines']['mean'], stats['score']['mean'], stats['pieces']['mean']))
+    sys.stderr.write('%.1f games/s over %d workers, %.2fx the speed of one\n' % (
+        overall['games_per_second'], overall['workers'], overall['speedup']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))